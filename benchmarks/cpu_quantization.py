@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+"""
+Benchmark CPU weight precisions of the transformers backend.
+
+Each precision runs in a fresh process (so that peak RSS is not polluted by
+the previous model) and generates the initial diagram of a sample Product
+Vision Board. Reports load time, time to first token, decode tokens/s and
+peak RSS against the float32 baseline.
+
+Usage:
+    python benchmarks/cpu_quantization.py --model mistralai/Mistral-7B-Instruct-v0.3
+    python benchmarks/cpu_quantization.py --precisions fp32 int8 --max-tokens 128 --json results.json
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from dotenv import load_dotenv
+
+from src.pvb_flow.ai.cpu_quantization import CPU_PRECISIONS
+from src.pvb_flow.ai.prompts_config import DiagramPrompts
+
+
+SAMPLE_PVB = {
+    "1. Utilisateur Cible": [
+        "Passionnés de cuisine amateur",
+        "Professionnels de la restauration"
+    ],
+    "2. Description du Produit": [
+        "Application de gestion de recettes avec suggestions personnalisées",
+        "Planification automatique des repas de la semaine"
+    ],
+    "3. Fonctionnalités Clés": [
+        "Recherche de recettes par ingrédients disponibles",
+        "Génération automatique de liste de courses",
+        "Suggestions basées sur les préférences alimentaires"
+    ],
+    "4. Enjeux et Indicateurs": [
+        "Réduire le gaspillage alimentaire de 30%",
+        "Atteindre 100 000 utilisateurs actifs en 6 mois"
+    ],
+    "Summary": "Simplifier la planification des repas et réduire le gaspillage alimentaire"
+}
+
+RESULT_PREFIX = "BENCHMARK_RESULT "
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_one(model_name: str, precision: str, max_tokens: int) -> dict:
+    """Load the model with one precision and time a generation (child process)."""
+    from src.pvb_flow.ai.mistral_text_analyzer import MistralTextAnalyzer
+
+    start = time.perf_counter()
+    analyzer = MistralTextAnalyzer(
+        hf_token=os.getenv("HUGGINGFACE_TOKEN"),
+        model_name=model_name,
+        use_prefix_cache=False,
+        session_cache_mb=0,
+        cpu_precision=precision
+    )
+    load_seconds = time.perf_counter() - start
+    load_rss_mb = peak_rss_mb()
+
+    conversation = [{"role": "user", "content": DiagramPrompts.get_initial_prompt(SAMPLE_PVB)}]
+
+    # Untimed warm-up: first calls pay one-off allocation and kernel selection costs
+    analyzer.generate_response(conversation, max_tokens=4)
+
+    start = time.perf_counter()
+    first_token_seconds = None
+    chunks = []
+    for chunk in analyzer.generate_response_stream(conversation, max_tokens=max_tokens):
+        if first_token_seconds is None:
+            first_token_seconds = time.perf_counter() - start
+        chunks.append(chunk)
+    total_seconds = time.perf_counter() - start
+
+    tokens = len(analyzer.tokenizer.encode("".join(chunks), add_special_tokens=False))
+    decode_seconds = total_seconds - (first_token_seconds or 0.0)
+
+    return {
+        "precision": precision,
+        "load_seconds": round(load_seconds, 2),
+        "first_token_seconds": round(first_token_seconds or total_seconds, 3),
+        "tokens": tokens,
+        "tokens_per_second": round((tokens - 1) / decode_seconds, 2) if tokens > 1 and decode_seconds > 0 else 0.0,
+        "load_rss_mb": round(load_rss_mb),
+        "peak_rss_mb": round(peak_rss_mb())
+    }
+
+
+def run_in_subprocess(model_name: str, precision: str, max_tokens: int) -> dict:
+    """Run one precision in a fresh CPU-only process and parse its result."""
+    command = [
+        sys.executable, os.path.abspath(__file__),
+        "--model", model_name,
+        "--max-tokens", str(max_tokens),
+        "--child", precision
+    ]
+    # Hide GPUs so that the CPU path is measured
+    env = dict(os.environ, CUDA_VISIBLE_DEVICES="")
+    completed = subprocess.run(command, env=env, capture_output=True, text=True)
+
+    for line in reversed(completed.stdout.splitlines()):
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+
+    sys.stderr.write(completed.stdout + completed.stderr)
+    return {"precision": precision, "error": f"exit code {completed.returncode}"}
+
+
+def print_report(results: list):
+    """Print a comparison table against the float32 baseline."""
+    baseline = next((r for r in results if r["precision"] == "fp32" and "error" not in r), None)
+
+    print(f"\n{'precision':<10}{'load s':>9}{'TTFT s':>9}{'tok/s':>10}{'speedup':>9}{'peak RSS MB':>13}{'RSS vs fp32':>13}")
+    for result in results:
+        if "error" in result:
+            print(f"{result['precision']:<10}  failed: {result['error']}")
+            continue
+        speedup = rss_ratio = "-"
+        if baseline is not None and baseline["tokens_per_second"]:
+            speedup = f"{result['tokens_per_second'] / baseline['tokens_per_second']:.2f}x"
+            rss_ratio = f"{result['peak_rss_mb'] / baseline['peak_rss_mb']:.2f}x"
+        print(
+            f"{result['precision']:<10}{result['load_seconds']:>9.1f}{result['first_token_seconds']:>9.2f}"
+            f"{result['tokens_per_second']:>10.1f}{speedup:>9}{result['peak_rss_mb']:>13}{rss_ratio:>13}"
+        )
+
+
+def main():
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--model", default=os.getenv("DEFAULT_MODEL") or "mistralai/Mistral-Small-Instruct-2409")
+    parser.add_argument("--precisions", nargs="+", choices=CPU_PRECISIONS, default=list(CPU_PRECISIONS))
+    parser.add_argument("--max-tokens", type=int, default=256)
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    parser.add_argument("--child", choices=CPU_PRECISIONS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        result = run_one(args.model, args.child, args.max_tokens)
+        print(RESULT_PREFIX + json.dumps(result))
+        return
+
+    results = []
+    for precision in args.precisions:
+        print(f"⏱️  {args.model} [{precision}]...")
+        results.append(run_in_subprocess(args.model, precision, args.max_tokens))
+
+    print_report(results)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"model": args.model, "max_tokens": args.max_tokens, "results": results}, f, indent=2)
+        print(f"\n✓ Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,419 @@
+#!/usr/bin/env python
+"""
+End-to-end latency benchmark of the chat pipeline.
+
+Runs a fixed corpus of Product Vision Boards, each followed by a script of
+refinement requests, through ui.handlers.handle_message against one
+analyzer backend. Every turn records time to first token, an estimate of
+the prefill time, decode tokens/s, analyzer time and total latency
+(including extraction and UI overhead). The report gives percentiles per
+turn kind (initial / refinement), as JSON and optionally CSV, and can be
+compared against a previous report to catch regressions after prompt or
+default changes.
+
+Usage:
+    python benchmarks/latency.py --backend stub --json report.json
+    python benchmarks/latency.py --backend transformers --model HuggingFaceTB/SmolLM2-135M-Instruct --csv turns.csv
+    python benchmarks/latency.py --backend auto --compare baseline.json --max-regression 0.15
+"""
+import argparse
+import contextlib
+import csv
+import hashlib
+import importlib
+import importlib.util
+import inspect
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from dotenv import load_dotenv
+
+from src.pvb_flow.ai import generation_limits
+from src.pvb_flow.ai.generation_limits import CHARS_PER_TOKEN, MAX_NEW_TOKENS
+from src.pvb_flow.ai.prompts_config import DiagramPrompts
+from src.pvb_flow.ui.handlers import handle_message
+
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus", "latency_corpus.json")
+BACKENDS = ("auto", "stub", "transformers", "mlx", "qwen")
+PERCENTILES = (50, 90, 95, 99)
+
+# Reported per turn, summarized with percentiles
+METRICS = ("ttft_s", "prefill_s", "decode_tokens_per_s", "analyzer_s", "total_s", "overhead_s")
+# Metrics where lower is better (the others regress when they drop)
+LOWER_IS_BETTER = {"ttft_s", "prefill_s", "analyzer_s", "total_s", "overhead_s"}
+# Timing noise ignored by --compare, whatever the relative change
+MIN_REGRESSION_SECONDS = 0.01
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """
+    Linear-interpolated percentile.
+
+    Args:
+        values: Observations
+        pct: Percentile, 0 to 100
+
+    Returns:
+        Percentile value, None without observations
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+class TimedAnalyzer:
+    """
+    Analyzer proxy recording the timings of each streamed generation.
+
+    Keyword arguments the wrapped analyzer does not accept (e.g.
+    prompt_lookup for the ZeroGPU analyzer) are dropped, so that any
+    backend runs through the same handler.
+    """
+
+    def __init__(self, analyzer):
+        self.analyzer = analyzer
+        self.calls: List[Dict] = []
+
+        parameters = inspect.signature(analyzer.generate_response_stream).parameters.values()
+        self._accepts_any = any(p.kind == inspect.Parameter.VAR_KEYWORD for p in parameters)
+        self._accepted = {p.name for p in parameters}
+
+    def __getattr__(self, name):
+        if name == "analyzer":
+            raise AttributeError(name)
+        return getattr(self.analyzer, name)
+
+    def generate_response_stream(self, conversation: List[Dict[str, str]], max_tokens: int = MAX_NEW_TOKENS, **kwargs):
+        kwargs = {k: v for k, v in kwargs.items() if self._accepts_any or k in self._accepted}
+
+        call = {"conversation": conversation, "start": time.perf_counter(), "first": None, "chunks": []}
+        for chunk in self.analyzer.generate_response_stream(conversation, max_tokens=max_tokens, **kwargs):
+            if call["first"] is None:
+                call["first"] = time.perf_counter()
+            call["chunks"].append(chunk)
+            yield chunk
+        call["end"] = time.perf_counter()
+        self.calls.append(call)
+
+
+def count_tokens(analyzer, text: str) -> int:
+    """Count tokens with the analyzer's tokenizer, or estimate them."""
+    tokenizer = getattr(analyzer, "tokenizer", None) or getattr(getattr(analyzer, "processor", None), "tokenizer", None)
+    if tokenizer is not None:
+        try:
+            return len(tokenizer.encode(text, add_special_tokens=False))
+        except TypeError:
+            return len(tokenizer.encode(text))
+    return max(1, len(text) // CHARS_PER_TOKEN) if text else 0
+
+
+def load_space_analyzer(model_name: Optional[str]):
+    """Import the ZeroGPU analyzer from the Space copy (its package is also named src)."""
+    space_src = os.path.join(ROOT, "huggingface-space", "src")
+    spec = importlib.util.spec_from_file_location(
+        "space_src", os.path.join(space_src, "__init__.py"), submodule_search_locations=[space_src]
+    )
+    package = importlib.util.module_from_spec(spec)
+    sys.modules["space_src"] = package
+    spec.loader.exec_module(package)
+
+    module = importlib.import_module("space_src.ai.qwen_zerogpu_analyzer")
+    analyzer = module.QwenZeroGPUAnalyzer(model_name=model_name) if model_name else module.QwenZeroGPUAnalyzer()
+    analyzer._load_model()
+    return analyzer
+
+
+def build_analyzer(args):
+    """Create the analyzer under test."""
+    hf_token = os.getenv("HUGGINGFACE_TOKEN")
+
+    if args.backend in ("auto", "stub"):
+        from src.pvb_flow.ai.analyzer_factory import create_analyzer
+        stub_options = {
+            "time_to_first_token": args.stub_ttft,
+            "tokens_per_second": args.stub_tokens_per_second,
+            "jitter": args.stub_jitter
+        }
+        return create_analyzer(
+            hf_token=hf_token,
+            model_name=args.model,
+            backend=args.backend,
+            stub_options=stub_options if args.backend == "stub" else None
+        )
+
+    if args.backend == "transformers":
+        from src.pvb_flow.ai.mistral_text_analyzer import MistralTextAnalyzer
+        return MistralTextAnalyzer(
+            hf_token=hf_token,
+            model_name=args.model or "mistralai/Mistral-Small-Instruct-2409",
+            cpu_precision=args.cpu_precision
+        )
+
+    if args.backend == "mlx":
+        from src.pvb_flow.ai.mistral_mlx_analyzer import MistralMLXAnalyzer
+        analyzer = MistralMLXAnalyzer(model_name=args.model or "mlx-community/Mistral-Small-3.1-24B-Instruct-2503-8bit")
+        analyzer._load_model()
+        return analyzer
+
+    return load_space_analyzer(args.model)
+
+
+def run_turn(timed: TimedAnalyzer, state: Dict, user_input: str, kind: str, case: str, turn: int, args) -> Dict:
+    """Send one message through handle_message and measure it."""
+    timed.calls.clear()
+    output = io.StringIO()
+
+    start = time.perf_counter()
+    # The handler logs every turn: keep the report readable
+    with contextlib.redirect_stdout(output if not args.verbose else sys.stdout):
+        for result in handle_message(
+            user_input,
+            state["conversation"],
+            state["current_diagram"],
+            state["pvb_data"],
+            timed,
+            session_id=state["session_id"],
+            edit_mode=args.edit_mode
+        ):
+            pass
+    total = time.perf_counter() - start
+
+    conversation, _, _, current_diagram, pvb_data, _ = result
+    state.update(conversation=conversation, current_diagram=current_diagram, pvb_data=pvb_data)
+    answer = conversation[-1]["content"]
+
+    row = {"case": case, "turn": turn, "kind": kind, "calls": len(timed.calls), "total_s": total}
+    if answer.startswith("Error generating response"):
+        row["error"] = answer.splitlines()[0]
+    if not timed.calls:
+        return row
+
+    first_call = timed.calls[0]
+    prompt_text = "\n".join(message["content"] for message in first_call["conversation"])
+    output_tokens = sum(count_tokens(timed, "".join(call["chunks"])) for call in timed.calls)
+    analyzer_seconds = sum(call["end"] - call["start"] for call in timed.calls)
+    decode_seconds = sum(
+        call["end"] - call["first"] for call in timed.calls if call["first"] is not None
+    )
+    # A single chunk (e.g. a streamer flushing everything at the end) has no decode rate
+    chunks = sum(len(call["chunks"]) for call in timed.calls)
+
+    ttft = (first_call["first"] or first_call["end"]) - first_call["start"]
+    decode_tps = (
+        (output_tokens - len(timed.calls)) / decode_seconds
+        if decode_seconds > 0 and chunks > len(timed.calls) else None
+    )
+    row.update(
+        prompt_tokens=count_tokens(timed, prompt_text),
+        output_tokens=output_tokens,
+        ttft_s=ttft,
+        # The first chunk also holds one decode step
+        prefill_s=max(0.0, ttft - 1 / decode_tps) if decode_tps else ttft,
+        decode_tokens_per_s=decode_tps,
+        analyzer_s=analyzer_seconds,
+        overhead_s=total - analyzer_seconds,
+        diagram_chars=len(current_diagram or "")
+    )
+    return row
+
+
+def run_corpus(timed: TimedAnalyzer, corpus: List[Dict], repeat: int, args) -> List[Dict]:
+    """Run every case of the corpus `repeat` times."""
+    rows = []
+    for iteration in range(repeat):
+        for case in corpus:
+            state = {
+                "conversation": [],
+                "current_diagram": "",
+                "pvb_data": {},
+                "session_id": f"bench-{case['name']}-{iteration}"
+            }
+            script = [("initial", json.dumps(case["pvb"], ensure_ascii=False))]
+            script += [("refinement", feedback) for feedback in case.get("refinements", [])]
+
+            for turn, (kind, user_input) in enumerate(script):
+                row = run_turn(timed, state, user_input, kind, case["name"], turn, args)
+                row["iteration"] = iteration
+                rows.append(row)
+                print(
+                    f"  {case['name']:<14}#{turn} {kind:<10} total {row['total_s']:6.2f}s"
+                    + (f"  TTFT {row['ttft_s']:6.2f}s" if "ttft_s" in row else "")
+                    + (f"  {row['decode_tokens_per_s']:7.1f} tok/s" if row.get("decode_tokens_per_s") else "")
+                    + (f"  ❌ {row['error']}" if "error" in row else "")
+                )
+    return rows
+
+
+def summarize(rows: List[Dict]) -> Dict:
+    """Percentiles of each metric, per turn kind and overall."""
+    summary = {}
+    for kind in ("all", "initial", "refinement"):
+        selected = [row for row in rows if kind == "all" or row["kind"] == kind]
+        if not selected:
+            continue
+        stats = {"turns": len(selected), "errors": sum(1 for row in selected if "error" in row)}
+        for metric in METRICS:
+            values = [row[metric] for row in selected if row.get(metric) is not None]
+            if values:
+                stats[metric] = {
+                    "mean": sum(values) / len(values),
+                    **{f"p{pct}": percentile(values, pct) for pct in PERCENTILES}
+                }
+        summary[kind] = stats
+    return summary
+
+
+def environment_info(args) -> Dict:
+    """What the numbers depend on: backend, host, code and prompt versions."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True
+        ).stdout.strip() or None
+    except OSError:
+        commit = None
+
+    prompts = inspect.getsource(DiagramPrompts) + inspect.getsource(generation_limits)
+    return {
+        "backend": args.backend,
+        "model": args.model,
+        "edit_mode": args.edit_mode,
+        "repeat": args.repeat,
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "commit": commit,
+        "prompts_sha256": hashlib.sha256(prompts.encode("utf-8")).hexdigest()[:16],
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S")
+    }
+
+
+def compare(summary: Dict, baseline: Dict, max_regression: float) -> List[str]:
+    """
+    Compare p50/p95 against a baseline report.
+
+    Returns:
+        Descriptions of the metrics that regressed by more than max_regression
+    """
+    regressions = []
+    print(f"\n{'metric':<36}{'baseline':>12}{'current':>12}{'change':>10}")
+    for kind, stats in summary.items():
+        for metric in METRICS:
+            for stat in ("p50", "p95"):
+                current = stats.get(metric, {}).get(stat)
+                previous = baseline.get(kind, {}).get(metric, {}).get(stat)
+                if current is None or not previous:
+                    continue
+                change = (current - previous) / previous
+                worse = change if metric in LOWER_IS_BETTER else -change
+                noise = metric in LOWER_IS_BETTER and abs(current - previous) < MIN_REGRESSION_SECONDS
+                flag = " ⚠️" if worse > max_regression and not noise else ""
+                name = f"{kind}.{metric}.{stat}"
+                print(f"{name:<36}{previous:>12.3f}{current:>12.3f}{change:>+10.1%}{flag}")
+                if flag:
+                    regressions.append(f"{name} {change:+.1%}")
+    return regressions
+
+
+def write_csv(path: str, rows: List[Dict]):
+    """Write one line per turn."""
+    fields = ["iteration", "case", "turn", "kind", "calls", "prompt_tokens", "output_tokens",
+              *METRICS, "diagram_chars", "error"]
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=fields, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main():
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--backend", choices=BACKENDS, default="stub")
+    parser.add_argument("--model", default=os.getenv("DEFAULT_MODEL"), help="Model name or local path")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS)
+    parser.add_argument("--repeat", type=int, default=1, help="Runs of the whole corpus")
+    parser.add_argument("--warmup", type=int, default=1, help="Untimed turns before measuring")
+    parser.add_argument("--edit-mode", action="store_true", help="Answer refinements with edit operations")
+    parser.add_argument("--cpu-precision", default="fp32", help="CPU weights for the transformers backend")
+    parser.add_argument("--stub-ttft", type=float, default=0.5)
+    parser.add_argument("--stub-tokens-per-second", type=float, default=30.0)
+    parser.add_argument("--stub-jitter", type=float, default=0.1)
+    parser.add_argument("--json", help="Write the report (summary and turns) to this JSON file")
+    parser.add_argument("--csv", help="Write one line per turn to this CSV file")
+    parser.add_argument("--compare", help="Baseline JSON report to compare p50/p95 against")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="Relative slowdown tolerated by --compare before failing")
+    parser.add_argument("--verbose", action="store_true", help="Show the handler logs")
+    args = parser.parse_args()
+
+    with open(args.corpus, encoding="utf-8") as f:
+        corpus = json.load(f)
+
+    print(f"🔧 Loading {args.backend} analyzer...")
+    start = time.perf_counter()
+    timed = TimedAnalyzer(build_analyzer(args))
+    load_seconds = time.perf_counter() - start
+
+    if args.warmup > 0:
+        print("🔥 Warm-up...")
+        warmup_case = dict(corpus[0], name=f"warmup-{corpus[0]['name']}")
+        warmup_case["refinements"] = warmup_case.get("refinements", [])[:args.warmup - 1]
+        run_corpus(timed, [warmup_case], 1, args)
+
+    print(f"⏱️  {len(corpus)} cases x {args.repeat}...")
+    rows = run_corpus(timed, corpus, args.repeat, args)
+    summary = summarize(rows)
+
+    print(f"\n{'kind':<12}{'turns':>6}{'TTFT p50':>10}{'TTFT p95':>10}{'tok/s p50':>11}{'total p50':>11}{'total p95':>11}")
+    for kind, stats in summary.items():
+        ttft = stats.get("ttft_s", {})
+        tps = stats.get("decode_tokens_per_s", {})
+        total = stats.get("total_s", {})
+        print(
+            f"{kind:<12}{stats['turns']:>6}{ttft.get('p50') or 0:>10.2f}{ttft.get('p95') or 0:>10.2f}"
+            f"{tps.get('p50') or 0:>11.1f}{total.get('p50') or 0:>11.2f}{total.get('p95') or 0:>11.2f}"
+        )
+
+    report = {
+        "environment": environment_info(args),
+        "load_seconds": load_seconds,
+        "summary": summary,
+        "turns": rows
+    }
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\n✓ Report written to {args.json}")
+    if args.csv:
+        write_csv(args.csv, rows)
+        print(f"✓ Turns written to {args.csv}")
+
+    failed = any("error" in row for row in rows)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("environment", {}).get("prompts_sha256") != report["environment"]["prompts_sha256"]:
+            print("ℹ️  Prompts or generation limits changed since the baseline")
+        regressions = compare(summary, baseline.get("summary", {}), args.max_regression)
+        if regressions:
+            print(f"\n❌ {len(regressions)} regression(s) above {args.max_regression:.0%}: {', '.join(regressions)}")
+            failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
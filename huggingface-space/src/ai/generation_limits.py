@@ -0,0 +1,81 @@
+"""
+Generation budget helpers.
+
+The prompts ask for a single ```mermaid``` block, so everything generated
+after its closing fence is discarded by extract_mermaid_code(). These
+helpers size max_new_tokens from the expected diagram size and detect the
+end of the block so decoding can stop there.
+"""
+import re
+from typing import Dict, Optional
+
+
+# Hard ceiling kept from the original fixed budget
+MAX_NEW_TOKENS = 4000
+MIN_NEW_TOKENS = 512
+
+# Mermaid with French labels, <br/> tags and emojis averages ~3 chars per token
+CHARS_PER_TOKEN = 3
+
+# Initial diagrams: fixed cost (header, Légende, style lines) plus per PVB entry
+INITIAL_BASE_TOKENS = 768
+TOKENS_PER_PVB_ITEM = 160
+
+# Refinements may grow the diagram ("plus de détails"), leave room for that
+REFINEMENT_GROWTH = 2.0
+REFINEMENT_MARGIN_TOKENS = 256
+
+MERMAID_OPEN_FENCE = "```mermaid"
+MERMAID_CLOSE_FENCE_PATTERN = re.compile(r"\r?\n[ \t]*```")
+
+
+def estimate_max_new_tokens(
+    current_diagram: Optional[str] = None,
+    pvb_data: Optional[Dict] = None
+) -> int:
+    """
+    Size the generation budget for a request.
+
+    Refinements are sized from the diagram being edited, initial requests
+    from the number of Product Vision Board entries.
+
+    Args:
+        current_diagram: Diagram being refined, if any
+        pvb_data: Product Vision Board of an initial request, if any
+
+    Returns:
+        max_new_tokens to use, between MIN_NEW_TOKENS and MAX_NEW_TOKENS
+    """
+    if current_diagram:
+        diagram_tokens = len(current_diagram) / CHARS_PER_TOKEN
+        estimate = diagram_tokens * REFINEMENT_GROWTH + REFINEMENT_MARGIN_TOKENS
+    elif pvb_data:
+        items = sum(len(value) if isinstance(value, list) else 1 for value in pvb_data.values())
+        estimate = INITIAL_BASE_TOKENS + TOKENS_PER_PVB_ITEM * items
+    else:
+        return MAX_NEW_TOKENS
+
+    return int(min(MAX_NEW_TOKENS, max(MIN_NEW_TOKENS, estimate)))
+
+
+def find_mermaid_block_end(text: str) -> int:
+    """
+    Find where the first ```mermaid``` block of a response closes.
+
+    Args:
+        text: Response text (possibly partial)
+
+    Returns:
+        Index just after the closing fence, or -1 if the block is not closed yet
+    """
+    start = text.find(MERMAID_OPEN_FENCE)
+    if start == -1:
+        return -1
+
+    match = MERMAID_CLOSE_FENCE_PATTERN.search(text, start + len(MERMAID_OPEN_FENCE))
+    return match.end() if match else -1
+
+
+def has_closed_mermaid_block(text: str) -> bool:
+    """Whether a response already contains a complete ```mermaid``` block."""
+    return find_mermaid_block_end(text) != -1
@@ -3,9 +3,12 @@ Qwen3-VL model with ZeroGPU support for Hugging Face Spaces.
 Uses transformers with @spaces.GPU decorator.
 """
 import torch
-from typing import List, Dict
-from transformers import AutoProcessor, Qwen3VLForConditionalGeneration
+from threading import Thread, Lock
+from typing import List, Dict, Iterator, Optional
+from transformers import AutoProcessor, Qwen3VLForConditionalGeneration, TextIteratorStreamer, StoppingCriteriaList
 import spaces
+from .generation_limits import MAX_NEW_TOKENS
+from .stopping_criteria import MermaidFenceStoppingCriteria
 
 
 class QwenZeroGPUAnalyzer:
@@ -27,47 +30,58 @@ class QwenZeroGPUAnalyzer:
         self.model_name = model_name
         self.model = None
         self.processor = None
+        self._load_lock = Lock()
 
-        print(f"✓ Qwen ZeroGPU analyzer initialized (model will load on first inference)")
+        print(f"✓ Qwen ZeroGPU analyzer initialized (call preload() to load the model at startup)")
         print(f"  Model: {self.model_name}")
 
+    def preload(self) -> Thread:
+        """
+        Load the model in a background thread, so the first user does not wait for it.
+
+        Weights are loaded outside of @spaces.GPU: ZeroGPU attaches the GPU to
+        them when a decorated function runs. No warm-up generation is run, it
+        would consume GPU quota.
+
+        Returns:
+            Started loader thread
+        """
+        thread = Thread(target=self._load_model, name="model-loader", daemon=True)
+        thread.start()
+        return thread
+
     def _load_model(self):
-        """Load model and processor (called on first inference)."""
-        if self.model is not None:
-            return
+        """Load model and processor (at startup via preload(), or on first inference)."""
+        with self._load_lock:
+            if self.model is not None:
+                return
 
-        print(f"Loading model: {self.model_name}...")
+            print(f"Loading model: {self.model_name}...")
 
-        # Load processor (for Qwen3-VL)
-        self.processor = AutoProcessor.from_pretrained(
-            self.model_name
-        )
+            # Load processor (for Qwen3-VL)
+            self.processor = AutoProcessor.from_pretrained(
+                self.model_name
+            )
 
-        # Load model (Qwen3-VL model)
-        self.model = Qwen3VLForConditionalGeneration.from_pretrained(
-            self.model_name,
-            torch_dtype="auto",  # Use auto dtype like in official example
-            device_map="auto"
-        )
+            # Load model (Qwen3-VL model)
+            self.model = Qwen3VLForConditionalGeneration.from_pretrained(
+                self.model_name,
+                torch_dtype="auto",  # Use auto dtype like in official example
+                device_map="auto"
+            )
 
-        print(f"✓ Model loaded: {self.model_name}")
+            print(f"✓ Model loaded: {self.model_name}")
 
-    @spaces.GPU(duration=60)  # ZeroGPU decorator - max 60 seconds
-    def generate_response(self, conversation: List[Dict[str, str]], max_tokens: int = 4000) -> str:
+    def prepare_inputs(self, conversation: List[Dict[str, str]]):
         """
-        Generate response from conversation history using ZeroGPU.
+        Format a conversation for Qwen3-VL and tokenize it.
 
         Args:
             conversation: List of conversation messages with 'role' and 'content'
-            max_tokens: Maximum tokens to generate
 
         Returns:
-            Generated response text
+            Processor outputs on the model device
         """
-        # Load model on first call
-        if self.model is None:
-            self._load_model()
-
         # Format conversation for Qwen3-VL (text-only usage)
         # Build prompt from conversation history
         messages = []
@@ -89,12 +103,43 @@ class QwenZeroGPUAnalyzer:
             return_dict=True,
             return_tensors="pt"
         )
-        inputs = inputs.to(self.model.device)
+        return inputs.to(self.model.device)
+
+    def _stopping_criteria(self, inputs) -> StoppingCriteriaList:
+        """Stop right after the ```mermaid``` block instead of running to EOS."""
+        return StoppingCriteriaList([
+            MermaidFenceStoppingCriteria(self.processor.tokenizer, inputs.input_ids.shape[1])
+        ])
+
+    @spaces.GPU(duration=60)  # ZeroGPU decorator - max 60 seconds
+    def generate_response(
+        self,
+        conversation: List[Dict[str, str]],
+        max_tokens: int = MAX_NEW_TOKENS,
+        session_id: Optional[str] = None
+    ) -> str:
+        """
+        Generate response from conversation history using ZeroGPU.
+
+        Args:
+            conversation: List of conversation messages with 'role' and 'content'
+            max_tokens: Maximum tokens to generate
+            session_id: Unused by this backend, accepted for interface compatibility
+
+        Returns:
+            Generated response text
+        """
+        # Load model on first call
+        if self.model is None:
+            self._load_model()
+
+        inputs = self.prepare_inputs(conversation)
 
         # Generate with ZeroGPU (following official example)
         generated_ids = self.model.generate(
             **inputs,
-            max_new_tokens=max_tokens
+            max_new_tokens=max_tokens,
+            stopping_criteria=self._stopping_criteria(inputs)
         )
 
         # Trim generated ids (remove input tokens)
@@ -112,6 +157,62 @@ class QwenZeroGPUAnalyzer:
 
         return output_text[0].strip()
 
+    @spaces.GPU(duration=60)  # ZeroGPU decorator - max 60 seconds
+    def generate_response_stream(
+        self,
+        conversation: List[Dict[str, str]],
+        max_tokens: int = MAX_NEW_TOKENS,
+        session_id: Optional[str] = None
+    ) -> Iterator[str]:
+        """
+        Stream the response to a conversation as text chunks using ZeroGPU.
+
+        Args:
+            conversation: List of conversation messages with 'role' and 'content'
+            max_tokens: Maximum tokens to generate
+            session_id: Unused by this backend, accepted for interface compatibility
+
+        Yields:
+            Newly decoded text chunks, in order
+        """
+        # Load model on first call
+        if self.model is None:
+            self._load_model()
+
+        inputs = self.prepare_inputs(conversation)
+        streamer = TextIteratorStreamer(
+            self.processor.tokenizer,
+            skip_prompt=True,
+            skip_special_tokens=True,
+            clean_up_tokenization_spaces=False
+        )
+        errors = []
+
+        def _generate():
+            try:
+                self.model.generate(
+                    **inputs,
+                    max_new_tokens=max_tokens,
+                    stopping_criteria=self._stopping_criteria(inputs),
+                    streamer=streamer
+                )
+            except Exception as e:
+                # Unblock the consumer, the error is re-raised below
+                errors.append(e)
+                streamer.end()
+
+        thread = Thread(target=_generate, daemon=True)
+        thread.start()
+        try:
+            for chunk in streamer:
+                if chunk:
+                    yield chunk
+        finally:
+            thread.join()
+
+        if errors:
+            raise errors[0]
+
     def cleanup_model(self):
         """Cleanup (managed by ZeroGPU)."""
         # ZeroGPU handles cleanup automatically
@@ -0,0 +1,54 @@
+"""
+Stopping criteria for transformers generate().
+"""
+import torch
+from transformers import StoppingCriteria
+
+from .generation_limits import MERMAID_OPEN_FENCE, MERMAID_CLOSE_FENCE_PATTERN
+
+
+class MermaidFenceStoppingCriteria(StoppingCriteria):
+    """
+    Stop decoding once the ```mermaid``` block of the answer has been closed.
+
+    Only a short window of recent tokens is decoded at each step, so the
+    check stays cheap however long the answer gets.
+    """
+
+    # Covers a fence split over several tokens, even when assisted decoding
+    # accepts a run of draft tokens in a single step
+    WINDOW_TOKENS = 32
+
+    def __init__(self, tokenizer, prompt_length: int):
+        """
+        Initialize the criterion.
+
+        Args:
+            tokenizer: Tokenizer used to decode generated tokens
+            prompt_length: Number of prompt tokens at the start of input_ids
+        """
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self._opened_at = {}  # row -> start of the window where the opening fence was seen
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        done = [self._row_done(row, ids) for row, ids in enumerate(input_ids)]
+        return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
+
+    def _row_done(self, row: int, ids: torch.LongTensor) -> bool:
+        length = ids.shape[0]
+        opened_at = self._opened_at.get(row)
+        start = max(self.prompt_length if opened_at is None else opened_at, length - self.WINDOW_TOKENS)
+        window = self.tokenizer.decode(ids[start:], skip_special_tokens=True)
+
+        fence = window.find(MERMAID_OPEN_FENCE)
+        if opened_at is None:
+            if fence == -1:
+                return False
+            # From here on, windows start no earlier than this one
+            self._opened_at[row] = start
+
+        # Only look after the opening fence when it is in the window: both
+        # fences may arrive in one step when several draft tokens are accepted
+        index = fence + len(MERMAID_OPEN_FENCE) if fence != -1 else 0
+        return MERMAID_CLOSE_FENCE_PATTERN.search(window, index) is not None
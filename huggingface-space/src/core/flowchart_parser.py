@@ -0,0 +1,296 @@
+"""
+Parser of Mermaid flowcharts into a compact syntax tree.
+
+Statements are recognized by the line grammar of mermaid_grammar; this
+module assembles them into nodes, edges, subgraphs, styles and class
+definitions, checks the block structure (header, subgraph/end nesting)
+and reports the line and column of the first error.
+
+Each line is parsed once, by the parser of its statement type (tens of
+microseconds per line), which keeps validation cheap enough to run while
+a diagram is streamed.
+"""
+import re
+from typing import Dict, List, Optional, Tuple
+
+from .mermaid_grammar import (
+    COMPLETE, INCOMPLETE, DIRECTIONS, STATEMENT_PARSERS, check_line, check_statement,
+    opens_description_block, parse_chain, strip_comment
+)
+
+
+# Keywords starting a statement that is not a node/edge chain
+_KEYWORDS = frozenset(keyword for keyword, _ in STATEMENT_PARSERS)
+
+# First word of a statement; 'accTitle:' and 'accDescr{' need no space
+_FIRST_WORD_PATTERN = re.compile(r"[^\s;:{]+")
+
+# 'id@' naming a link, as in 'A e1@--> B'
+_EDGE_ID_PATTERN = re.compile(r"^\w+@")
+
+
+class FlowchartSyntaxError(ValueError):
+    """A flowchart does not parse; line and column are 1-based."""
+
+    def __init__(self, message: str, line: int, column: int):
+        super().__init__(f"Line {line}, column {column}: {message}")
+        self.message = message
+        self.line = line
+        self.column = column
+
+
+class Node:
+    """A node, with its label and shape once defined."""
+
+    __slots__ = ("id", "label", "shape", "css_class", "subgraph", "line")
+
+    def __init__(self, node_id: str, line: int, subgraph: Optional[str] = None):
+        self.id = node_id
+        self.label = None  # None until the node is given a shape
+        self.shape = None  # Delimiters, e.g. "[]", "{{}}", "[//]"
+        self.css_class = None
+        self.subgraph = subgraph  # Id of the innermost subgraph where it first appears
+        self.line = line
+
+    def __repr__(self):
+        return f"Node({self.id!r}, label={self.label!r}, shape={self.shape!r})"
+
+
+class Edge:
+    """A link between two nodes."""
+
+    __slots__ = ("source", "target", "arrow", "label", "line")
+
+    def __init__(self, source: str, target: str, arrow: str, label: Optional[str], line: int):
+        self.source = source
+        self.target = target
+        self.arrow = arrow  # Link operator without its label, e.g. "-->", "-.->"
+        self.label = label
+        self.line = line
+
+    def __repr__(self):
+        return f"Edge({self.source!r} {self.arrow} {self.target!r}, label={self.label!r})"
+
+
+class Subgraph:
+    """A subgraph and the nodes that first appear in it."""
+
+    __slots__ = ("id", "title", "parent", "direction", "node_ids", "line")
+
+    def __init__(self, subgraph_id: str, title: str, parent: Optional[str], line: int):
+        self.id = subgraph_id
+        self.title = title
+        self.parent = parent
+        self.direction = None
+        self.node_ids: List[str] = []
+        self.line = line
+
+    def __repr__(self):
+        return f"Subgraph({self.id!r}, title={self.title!r}, nodes={len(self.node_ids)})"
+
+
+class Style:
+    """A 'style' statement (target is a node id) or a 'classDef' (target is a class name)."""
+
+    __slots__ = ("target", "properties", "line")
+
+    def __init__(self, target: str, properties: Dict[str, str], line: int):
+        self.target = target
+        self.properties = properties
+        self.line = line
+
+    def __repr__(self):
+        return f"Style({self.target!r}, {self.properties!r})"
+
+
+class Flowchart:
+    """Syntax tree of a flowchart."""
+
+    __slots__ = ("direction", "nodes", "edges", "subgraphs", "styles", "class_defs", "class_assignments")
+
+    def __init__(self, direction: Optional[str]):
+        self.direction = direction
+        self.nodes: Dict[str, Node] = {}  # In order of first appearance
+        self.edges: List[Edge] = []
+        self.subgraphs: Dict[str, Subgraph] = {}
+        self.styles: List[Style] = []
+        self.class_defs: List[Style] = []
+        self.class_assignments: List[Tuple[List[str], str]] = []  # (node ids, class name)
+
+    def __repr__(self):
+        return (
+            f"Flowchart({self.direction}, nodes={len(self.nodes)}, edges={len(self.edges)}, "
+            f"subgraphs={len(self.subgraphs)})"
+        )
+
+
+def _parse_properties(text: str) -> Dict[str, str]:
+    properties = {}
+    for declaration in text.rstrip(";").split(","):
+        name, _, value = declaration.partition(":")
+        properties[name.strip()] = value.strip()
+    return properties
+
+
+def _split_link(link: str) -> Tuple[str, Optional[str]]:
+    """Split a link text from parse_chain() into its operator and label."""
+    link = _EDGE_ID_PATTERN.sub("", link)
+    if "|" in link:
+        arrow, _, label = link.partition("|")
+        label = label.rsplit("|", 1)[0].strip()
+        if len(label) >= 2 and label[0] == label[-1] == '"':
+            label = label[1:-1]
+        return arrow.strip(), label
+    # '-- text -->', '== text ==>', '-. text .->'
+    if len(link) > 3 and link[2] == " " and link[:2] in ("--", "==", "-."):
+        words = link.split()
+        return words[0] + words[-1], " ".join(words[1:-1]) or None
+    return link, None
+
+
+class _Builder:
+    """Accumulates statements into a Flowchart."""
+
+    __slots__ = ("chart", "open_subgraphs")
+
+    def __init__(self, chart: Flowchart):
+        self.chart = chart
+        self.open_subgraphs: List[Subgraph] = []
+
+    def node(self, parsed: tuple, line: int) -> str:
+        node_id, shape, label, css_class = parsed
+        node = self.chart.nodes.get(node_id)
+        if node is None:
+            subgraph = self.open_subgraphs[-1] if self.open_subgraphs else None
+            node = Node(node_id, line, subgraph.id if subgraph else None)
+            self.chart.nodes[node_id] = node
+            if subgraph is not None:
+                subgraph.node_ids.append(node_id)
+        if shape is not None:
+            node.shape = shape
+            node.label = label
+        if css_class is not None:
+            node.css_class = css_class
+        return node_id
+
+    def chain(self, parts: list, line: int):
+        sources = [self.node(parsed, line) for parsed in parts[0]]
+        for index in range(1, len(parts), 2):
+            arrow, label = _split_link(parts[index])
+            targets = [self.node(parsed, line) for parsed in parts[index + 1]]
+            for source in sources:
+                for target in targets:
+                    self.chart.edges.append(Edge(source, target, arrow, label, line))
+            sources = targets
+
+    def subgraph(self, body: str, line: int):
+        rest = body[len("subgraph"):].strip().rstrip(";").strip()
+        if rest.startswith('"'):
+            subgraph_id = title = rest.strip('"')
+        else:
+            subgraph_id = rest.split("[", 1)[0].split(None, 1)[0]
+            title = rest[len(subgraph_id):].strip()
+            if title.startswith("[") and title.endswith("]"):
+                title = title[1:-1].strip('"')
+            title = title or subgraph_id
+        parent = self.open_subgraphs[-1].id if self.open_subgraphs else None
+        subgraph = Subgraph(subgraph_id, title, parent, line)
+        self.chart.subgraphs[subgraph_id] = subgraph
+        self.open_subgraphs.append(subgraph)
+
+
+def _statement(builder: _Builder, line: str, line_number: int, indent: int):
+    """Add one statement (not the header) to the tree, raising on a syntax error."""
+    body = line[indent:]
+    match = _FIRST_WORD_PATTERN.match(body)
+    first_word = match.group(0) if match else ""
+
+    if first_word not in _KEYWORDS:
+        parts, column, message = parse_chain(line, structured=True)
+        if parts is None:
+            raise FlowchartSyntaxError(message, line_number, column + 1)
+        builder.chain(parts, line_number)
+        return
+
+    status, column, message = check_statement(line, first_word)
+    if status != COMPLETE:
+        if status == INCOMPLETE:
+            column, message = len(line), "Unexpected end of line"
+        raise FlowchartSyntaxError(message, line_number, column + 1)
+
+    chart = builder.chart
+    body = strip_comment(body)
+    words = body.rstrip(";").split()
+    if first_word == "subgraph":
+        builder.subgraph(body, line_number)
+    elif first_word == "end":
+        if not builder.open_subgraphs:
+            raise FlowchartSyntaxError("'end' without an open subgraph", line_number, indent + 1)
+        builder.open_subgraphs.pop()
+    elif first_word == "direction":
+        if builder.open_subgraphs:
+            builder.open_subgraphs[-1].direction = words[1]
+        else:
+            chart.direction = words[1]
+    elif first_word == "style":
+        chart.styles.append(Style(words[1], _parse_properties(" ".join(words[2:])), line_number))
+    elif first_word == "classDef":
+        properties = _parse_properties(" ".join(words[2:]))
+        for name in words[1].split(","):
+            chart.class_defs.append(Style(name, properties, line_number))
+    elif first_word == "class":
+        chart.class_assignments.append((words[1].split(","), words[2]))
+    # linkStyle, click, accTitle and accDescr only need to be valid
+
+
+def parse_flowchart(code: str) -> Flowchart:
+    """
+    Parse a Mermaid flowchart.
+
+    Args:
+        code: Diagram code, starting with a 'flowchart'/'graph' header
+
+    Returns:
+        Flowchart syntax tree
+
+    Raises:
+        FlowchartSyntaxError: At the first invalid statement, or for a
+            missing header, an unclosed subgraph or accDescr block
+    """
+    builder = None
+    line_number = 0
+    description_line = 0  # Line of an open 'accDescr {' block
+
+    for line_number, line in enumerate(code.split("\n"), start=1):
+        line = line.rstrip("\r")
+        if description_line:
+            if "}" in line:
+                description_line = 0
+            continue
+        indent = len(line) - len(line.lstrip(" \t"))
+        if indent == len(line) or line.startswith("%%", indent):
+            continue
+
+        if builder is None:
+            status, column, message = check_line(line, is_header=True)
+            if status != COMPLETE:
+                if status == INCOMPLETE:
+                    column, message = len(line), "Unexpected end of line"
+                raise FlowchartSyntaxError(message, line_number, column + 1)
+            words = strip_comment(line.strip()).rstrip(";").split()
+            direction = words[1] if len(words) > 1 and words[1] in DIRECTIONS else None
+            builder = _Builder(Flowchart(direction))
+            continue
+
+        _statement(builder, line, line_number, indent)
+        if opens_description_block(line):
+            description_line = line_number
+
+    if builder is None:
+        raise FlowchartSyntaxError("Expected 'flowchart' or 'graph' header", 1, 1)
+    if description_line:
+        raise FlowchartSyntaxError("accDescr block is not closed with '}'", description_line, 1)
+    if builder.open_subgraphs:
+        subgraph = builder.open_subgraphs[-1]
+        raise FlowchartSyntaxError(f"Subgraph '{subgraph.id}' is not closed with 'end'", line_number, 1)
+    return builder.chart
@@ -1,30 +1,42 @@
 """
 Utilities for extracting and validating Mermaid diagrams from LLM responses.
 """
-import re
-from typing import Tuple, Optional
+from typing import List, Tuple, Optional
+
+from .fenced_blocks import CODE, Segment, find_block, scan_fenced_blocks
+from .flowchart_parser import FlowchartSyntaxError, parse_flowchart
+
+
+# Other diagram types are accepted on their declaration only
+OTHER_DIAGRAM_TYPES = ('sequenceDiagram', 'classDiagram', 'stateDiagram', 'stateDiagram-v2',
+                       'erDiagram', 'gantt', 'pie')
 
 
 class MermaidExtractor:
     """Extracts and validates Mermaid code from text."""
 
     @staticmethod
-    def extract_mermaid_code(llm_response: str) -> Tuple[Optional[str], bool]:
+    def extract_mermaid_code(
+        llm_response: str,
+        segments: Optional[List[Segment]] = None
+    ) -> Tuple[Optional[str], bool]:
         """
         Extract Mermaid code from LLM response.
 
         Args:
             llm_response: Full response from the LLM
+            segments: Result of scan_fenced_blocks() on the response, if
+                already available
 
         Returns:
             Tuple of (mermaid_code, is_valid)
         """
-        # Pattern to match ```mermaid ... ```
-        pattern = r'```mermaid\n(.*?)\n```'
-        match = re.search(pattern, llm_response, re.DOTALL)
+        if segments is None:
+            segments = scan_fenced_blocks(llm_response)
+        block = find_block(segments, "mermaid")
 
-        if match:
-            code = match.group(1).strip()
+        if block is not None:
+            code = block.content.strip()
             is_valid, _ = MermaidExtractor.validate_mermaid_syntax(code)
             return code, is_valid
 
@@ -33,37 +45,40 @@ class MermaidExtractor:
     @staticmethod
     def validate_mermaid_syntax(code: str) -> Tuple[bool, str]:
         """
-        Basic Mermaid syntax validation.
+        Mermaid syntax validation.
+
+        Flowcharts are fully parsed (see flowchart_parser); other diagram
+        types are only checked for their declaration.
 
         Args:
             code: Mermaid diagram code
 
         Returns:
-            Tuple of (is_valid, error_message)
+            Tuple of (is_valid, error_message); errors give the line and column
         """
         if not code or not code.strip():
             return False, "Empty Mermaid code"
 
-        # Check for diagram type declaration
-        diagram_types = ['flowchart', 'graph', 'sequenceDiagram', 'classDiagram',
-                        'stateDiagram', 'erDiagram', 'gantt', 'pie']
+        first_statement = next(
+            (line.strip() for line in code.split("\n") if line.strip() and not line.strip().startswith("%%")),
+            ""
+        )
+        first_word = first_statement.split(None, 1)[0] if first_statement else ""
 
-        has_diagram_type = any(dtype in code for dtype in diagram_types)
-        if not has_diagram_type:
+        if first_word in OTHER_DIAGRAM_TYPES:
+            return True, f"Valid {first_word} declaration"
+        if first_word not in ('flowchart', 'graph'):
             return False, "Missing diagram type declaration (flowchart, graph, etc.)"
 
-        # Check for connections (common syntax)
-        connection_patterns = ['-->', '->', '---', '-.->', '==>','-.->']
-        has_connections = any(conn in code for conn in connection_patterns)
+        try:
+            chart = parse_flowchart(code)
+        except FlowchartSyntaxError as e:
+            return False, str(e)
 
-        if not has_connections:
-            return False, "No connections found in diagram"
-
-        # Check for at least one node definition
-        # Nodes are typically: ID[Label] or ID(Label) or ID{Label}
-        node_pattern = r'[A-Z]\d*[\[\(\{]'
-        if not re.search(node_pattern, code):
+        if not chart.nodes:
             return False, "No nodes defined in diagram"
+        if not chart.edges:
+            return False, "No connections found in diagram"
 
         return True, "Valid Mermaid syntax"
 
@@ -97,15 +112,17 @@ class MermaidExtractor:
         Returns:
             List of Mermaid code strings
         """
-        pattern = r'```mermaid\n(.*?)\n```'
-        matches = re.findall(pattern, text, re.DOTALL)
-        return [match.strip() for match in matches]
+        return [
+            segment.content.strip()
+            for segment in scan_fenced_blocks(text)
+            if segment.kind == CODE and segment.closed and segment.language == "mermaid"
+        ]
 
 
 # Convenience functions
-def extract_mermaid_code(llm_response: str) -> Tuple[Optional[str], bool]:
+def extract_mermaid_code(llm_response: str, segments: Optional[List[Segment]] = None) -> Tuple[Optional[str], bool]:
     """Shorthand for MermaidExtractor.extract_mermaid_code()"""
-    return MermaidExtractor.extract_mermaid_code(llm_response)
+    return MermaidExtractor.extract_mermaid_code(llm_response, segments)
 
 
 def validate_mermaid_syntax(code: str) -> Tuple[bool, str]:
@@ -0,0 +1,816 @@
+"""
+Line-level grammar of Mermaid flowcharts.
+
+Checks a single line (possibly still being generated) against the
+flowchart syntax used in our diagrams: header, nodes and their shapes,
+edges with optional labels and ids, subgraph/end, direction, style,
+classDef, class, linkStyle, click, accTitle/accDescr and %% comments
+(on their own line or after a statement).
+
+A line is reported as:
+- COMPLETE: valid as it is
+- INCOMPLETE: not valid yet, but some continuation makes it valid
+- INVALID: no continuation can make it valid
+
+The distinction lets callers validate text while it is being decoded.
+"""
+import re
+from typing import Optional, Tuple
+
+
+COMPLETE = "complete"
+INCOMPLETE = "incomplete"
+INVALID = "invalid"
+
+DIRECTIONS = ("TB", "TD", "BT", "RL", "LR")
+HEADER_KEYWORDS = ("flowchart", "graph")
+
+# (opening, closing) node shape delimiters, longest openings first
+NODE_SHAPES = (
+    ("(((", ")))"),
+    ("((", "))"),
+    ("([", "])"),
+    ("[[", "]]"),
+    ("[(", ")]"),
+    ("[/", "/]"),
+    ("[/", "\\]"),
+    ("[\\", "\\]"),
+    ("[\\", "/]"),
+    ("{{", "}}"),
+    ("[", "]"),
+    ("(", ")"),
+    ("{", "}"),
+    (">", "]"),
+)
+
+# Shapes by first character of their opening delimiter
+_SHAPES_BY_FIRST_CHAR = {
+    char: tuple(shape for shape in NODE_SHAPES if shape[0][0] == char) for char in "[({>"
+}
+
+_ID_PATTERN = re.compile(r"\w+")
+
+# 'label' entry of a node's @{ ... } metadata
+_METADATA_LABEL_PATTERN = re.compile(r'\blabel\s*:\s*(?:"([^"]*)"|([^,}]*))')
+
+# 'accDescr {' opening a description whose closing '}' is on a later line
+_DESCRIPTION_BLOCK_PATTERN = re.compile(r"accDescr\s*\{[^}]*$")
+
+# Characters that cannot appear in an unquoted node label
+LABEL_FORBIDDEN = set('[](){}"')
+
+# Characters that cannot appear in '-- text -->' link text
+LINK_TEXT_FORBIDDEN = set('[](){}"|;`')
+
+
+class _EndOfInput(Exception):
+    """The line ended while a construct was still open."""
+
+
+class _Mismatch(Exception):
+    """The line contains a character no continuation can fix."""
+
+    def __init__(self, pos: int, message: str):
+        super().__init__(message)
+        self.pos = pos
+        self.message = message
+
+
+class _Cursor:
+    """Read position over a line."""
+
+    __slots__ = ("text", "pos")
+
+    def __init__(self, text: str, pos: int = 0):
+        self.text = text
+        self.pos = pos
+
+    def at_end(self) -> bool:
+        return self.pos >= len(self.text)
+
+    def peek(self) -> Optional[str]:
+        return self.text[self.pos] if self.pos < len(self.text) else None
+
+    def startswith(self, literal: str) -> bool:
+        return self.text.startswith(literal, self.pos)
+
+    def expect(self, literal: str, message: str):
+        """Consume a literal, distinguishing a truncated line from a wrong one."""
+        for char in literal:
+            if self.pos >= len(self.text):
+                raise _EndOfInput()
+            if self.text[self.pos] != char:
+                raise _Mismatch(self.pos, message)
+            self.pos += 1
+
+    def skip_spaces(self) -> int:
+        start = self.pos
+        while self.pos < len(self.text) and self.text[self.pos] in " \t":
+            self.pos += 1
+        return self.pos - start
+
+    def require_spaces(self, message: str):
+        if self.at_end():
+            raise _EndOfInput()
+        if not self.skip_spaces():
+            raise _Mismatch(self.pos, message)
+
+
+def _parse_id(cursor: _Cursor, what: str = "node id") -> str:
+    match = _ID_PATTERN.match(cursor.text, cursor.pos)
+    if match is None:
+        if cursor.at_end():
+            raise _EndOfInput()
+        raise _Mismatch(cursor.pos, f"Expected {what}")
+    cursor.pos = match.end()
+    return match.group(0)
+
+
+def _parse_quoted(cursor: _Cursor) -> str:
+    cursor.expect('"', "Expected '\"'")
+    end = cursor.text.find('"', cursor.pos)
+    if end == -1:
+        raise _EndOfInput()
+    value = cursor.text[cursor.pos:end]
+    cursor.pos = end + 1
+    return value
+
+
+def _parse_label(cursor: _Cursor, closing: str) -> str:
+    """Parse a node label up to (not including) its closing delimiter."""
+    if cursor.peek() == '"':
+        return _parse_quoted(cursor)
+
+    start = cursor.pos
+    while not cursor.at_end():
+        if cursor.startswith(closing):
+            return cursor.text[start:cursor.pos]
+        char = cursor.peek()
+        if char in LABEL_FORBIDDEN and not closing.startswith(char):
+            raise _Mismatch(cursor.pos, f"Unexpected '{char}' in unquoted label (quote the label)")
+        if char in LABEL_FORBIDDEN and closing.startswith(char):
+            if closing.startswith(cursor.text[cursor.pos:]):
+                # Closing delimiter still being written, e.g. ']' of '])'
+                raise _EndOfInput()
+            # e.g. ']' of a '/]' closing that does not match here
+            raise _Mismatch(cursor.pos, f"Expected '{closing}' to close the node shape")
+        cursor.pos += 1
+    raise _EndOfInput()
+
+
+def _parse_shape(cursor: _Cursor) -> Optional[Tuple[str, str]]:
+    """
+    Parse an optional node shape.
+
+    Every (opening, closing) pair matching the text is tried, so that
+    e.g. '[/' followed by '\\]' and '[' followed by a plain label are both
+    accepted. A truncated shape is reported as end of input if any
+    alternative is still viable.
+    """
+    shapes = _SHAPES_BY_FIRST_CHAR.get(cursor.peek())
+    if shapes is None:
+        return None
+
+    text = cursor.text
+    start = cursor.pos
+    truncated = False
+    best_error = None
+
+    for opening, closing in shapes:
+        cursor.pos = start
+        if not text.startswith(opening, start) and not opening.startswith(text[start:start + len(opening)]):
+            continue
+        try:
+            cursor.expect(opening, "Unexpected node shape")
+            label = _parse_label(cursor, closing)
+            cursor.expect(closing, f"Expected '{closing}' to close the node shape")
+            return opening + closing, label
+        except _EndOfInput:
+            truncated = True
+        except _Mismatch as e:
+            if best_error is None or e.pos > best_error.pos:
+                best_error = e
+
+    cursor.pos = start
+    if truncated:
+        raise _EndOfInput()
+    raise best_error or _Mismatch(start, "Invalid node shape")
+
+
+def _parse_metadata(cursor: _Cursor) -> Tuple[str, str]:
+    """Parse '@{ shape: rect, label: "x" }' node metadata as an '@{}' shape with its label."""
+    cursor.expect("@{", "Expected '{' after '@'")
+    start = cursor.pos
+    quoted = False
+    while not cursor.at_end():
+        char = cursor.peek()
+        if char == '"':
+            quoted = not quoted
+        elif char == "}" and not quoted:
+            match = _METADATA_LABEL_PATTERN.search(cursor.text, start, cursor.pos)
+            cursor.pos += 1
+            if match is None:
+                return "@{}", ""
+            return "@{}", match.group(1) if match.group(1) is not None else match.group(2).strip()
+        cursor.pos += 1
+    raise _EndOfInput()
+
+
+def _parse_node(cursor: _Cursor) -> Tuple[str, Optional[Tuple[str, str]], Optional[str]]:
+    node_id = _parse_id(cursor)
+    shape = _parse_shape(cursor)
+    if shape is None and cursor.peek() == "@":
+        shape = _parse_metadata(cursor)
+    css_class = None
+    if cursor.startswith(":::") or (cursor.peek() == ":" and ":::".startswith(cursor.text[cursor.pos:])):
+        cursor.expect(":::", "Expected ':::'")
+        css_class = _parse_id(cursor, "class name")
+    return node_id, shape, css_class
+
+
+def _parse_node_group(cursor: _Cursor, nodes: Optional[list] = None, structured: bool = False):
+    while True:
+        start = cursor.pos
+        node = _parse_node(cursor)
+        if nodes is not None:
+            if structured:
+                node_id, shape, css_class = node
+                nodes.append((node_id, shape[0], shape[1], css_class) if shape else (node_id, None, None, css_class))
+            else:
+                nodes.append(cursor.text[start:cursor.pos])
+        save = cursor.pos
+        cursor.skip_spaces()
+        if cursor.peek() != "&":
+            cursor.pos = save
+            return
+        cursor.pos += 1
+        cursor.skip_spaces()
+
+
+def _scan_link_text(cursor: _Cursor, terminators: Tuple[str, ...]):
+    """Consume '-- text -->' style link text up to one of its terminators."""
+    best = None
+    for terminator in terminators:
+        index = cursor.text.find(terminator, cursor.pos)
+        if index != -1 and (best is None or index < best[0]):
+            best = (index, terminator)
+
+    end = best[0] if best is not None else len(cursor.text)
+    for index in range(cursor.pos, end):
+        if cursor.text[index] in LINK_TEXT_FORBIDDEN:
+            raise _Mismatch(index, f"Unexpected '{cursor.text[index]}' in link text")
+
+    if best is None:
+        raise _EndOfInput()
+    cursor.pos = best[0] + len(best[1])
+
+
+def _parse_link_tail(cursor: _Cursor, line_char: str, heads: str):
+    """
+    Finish a '--'/'==' link: more line characters and/or an arrow head.
+
+    A bare '--' or '==' is not a link, it needs a third character.
+    """
+    extra = 0
+    while cursor.peek() == line_char:
+        cursor.pos += 1
+        extra += 1
+    if not cursor.at_end() and cursor.peek() in heads:
+        cursor.pos += 1
+    elif extra == 0:
+        if cursor.at_end():
+            raise _EndOfInput()
+        raise _Mismatch(cursor.pos, f"Expected '{line_char}' or an arrow head to finish the link")
+
+
+def _parse_link(cursor: _Cursor) -> bool:
+    """
+    Parse an optional edge operator with its optional |label|.
+
+    Returns:
+        True if a link was consumed
+    """
+    char = cursor.peek()
+    if char is None or char not in "-=~<":
+        return False
+
+    if cursor.peek() == "<":
+        cursor.pos += 1
+        if cursor.at_end():
+            raise _EndOfInput()
+
+    char = cursor.peek()
+    if char == "~":
+        cursor.expect("~~~", "Expected '~~~'")
+    elif char == "-":
+        cursor.pos += 1
+        if cursor.at_end():
+            raise _EndOfInput()
+        if cursor.peek() == ".":
+            # Dotted: -.-  -.->  -..->  or -. text .->
+            while cursor.peek() == ".":
+                cursor.pos += 1
+            if cursor.at_end():
+                raise _EndOfInput()
+            if cursor.peek() == " ":
+                _scan_link_text(cursor, (".->", ".-"))
+            else:
+                cursor.expect("-", "Expected '-' to close the dotted link")
+                if cursor.peek() == ">":
+                    cursor.pos += 1
+        else:
+            cursor.expect("-", "Expected '-' in link")
+            if cursor.at_end():
+                raise _EndOfInput()
+            if cursor.peek() == " ":
+                # -- text -->
+                _scan_link_text(cursor, ("-->", "---"))
+            else:
+                _parse_link_tail(cursor, "-", ">ox")
+    elif char == "=":
+        cursor.expect("==", "Expected '==' in thick link")
+        if cursor.at_end():
+            raise _EndOfInput()
+        if cursor.peek() == " ":
+            _scan_link_text(cursor, ("==>", "==="))
+        else:
+            _parse_link_tail(cursor, "=", ">")
+    else:
+        raise _Mismatch(cursor.pos, "Invalid link")
+
+    # Optional |label|
+    save = cursor.pos
+    cursor.skip_spaces()
+    if cursor.peek() == "|":
+        cursor.pos += 1
+        if cursor.peek() == '"':
+            _parse_quoted(cursor)
+            cursor.expect("|", "Expected '|' after the link label")
+        else:
+            _parse_label(cursor, "|")
+            cursor.pos += 1
+    else:
+        cursor.pos = save
+    return True
+
+
+def _parse_statement_end(cursor: _Cursor):
+    """Accept an optional ';' and a trailing %% comment."""
+    cursor.skip_spaces()
+    if cursor.peek() == ";":
+        cursor.pos += 1
+        cursor.skip_spaces()
+    if cursor.startswith("%%"):
+        cursor.pos = len(cursor.text)
+    elif cursor.text[cursor.pos:] == "%":
+        raise _EndOfInput()
+    if not cursor.at_end():
+        raise _Mismatch(cursor.pos, f"Unexpected '{cursor.peek()}'")
+
+
+def _parse_edge_id(cursor: _Cursor) -> bool:
+    """
+    Parse an optional 'id@' naming the link that follows, as in 'A e1@--> B'.
+
+    Returns:
+        True if an edge id was consumed
+    """
+    match = _ID_PATTERN.match(cursor.text, cursor.pos)
+    if match is None:
+        return False
+    if match.end() == len(cursor.text):
+        # A word at the end of the line may still become an edge id
+        raise _EndOfInput()
+    if cursor.text[match.end()] != "@":
+        return False
+    cursor.pos = match.end() + 1
+    return True
+
+
+def _parse_chain(cursor: _Cursor, parts: Optional[list] = None, structured: bool = False):
+    nodes = []
+    _parse_node_group(cursor, nodes, structured)
+    if parts is not None:
+        parts.append(nodes)
+    while True:
+        cursor.skip_spaces()
+        start = cursor.pos
+        has_id = _parse_edge_id(cursor)
+        if not _parse_link(cursor):
+            if has_id:
+                if cursor.at_end():
+                    raise _EndOfInput()
+                raise _Mismatch(cursor.pos, "Expected a link after the edge id")
+            break
+        if parts is not None:
+            parts.append(cursor.text[start:cursor.pos].strip())
+        cursor.skip_spaces()
+        nodes = []
+        _parse_node_group(cursor, nodes, structured)
+        if parts is not None:
+            parts.append(nodes)
+    _parse_statement_end(cursor)
+
+
+def _parse_keyword(cursor: _Cursor, keyword: str):
+    """Consume a keyword that must be followed by a space or the end of the line."""
+    cursor.expect(keyword, f"Expected '{keyword}'")
+    if not cursor.at_end() and cursor.peek() not in " \t;":
+        raise _Mismatch(cursor.pos, f"Expected a space after '{keyword}'")
+
+
+def _parse_direction(cursor: _Cursor):
+    remaining = cursor.text[cursor.pos:cursor.pos + 2]
+    for direction in DIRECTIONS:
+        if direction.startswith(remaining) and len(remaining) < 2:
+            raise _EndOfInput()
+        if remaining == direction:
+            cursor.pos += 2
+            return
+    raise _Mismatch(cursor.pos, "Expected a direction (TD, TB, BT, LR, RL)")
+
+
+def _parse_header(cursor: _Cursor):
+    for keyword in HEADER_KEYWORDS:
+        remaining = cursor.text[cursor.pos:]
+        if keyword.startswith(remaining) or remaining.startswith(keyword):
+            _parse_keyword(cursor, keyword)
+            if cursor.skip_spaces() and not cursor.at_end() and cursor.peek() not in ";%":
+                _parse_direction(cursor)
+            _parse_statement_end(cursor)
+            return
+    raise _Mismatch(cursor.pos, "Expected 'flowchart' or 'graph' header")
+
+
+def _parse_properties(cursor: _Cursor):
+    """Parse 'name:value,name:value' style declarations."""
+    while True:
+        start = cursor.pos
+        while not cursor.at_end() and (cursor.peek().isalnum() or cursor.peek() == "-"):
+            cursor.pos += 1
+        if cursor.pos == start:
+            if cursor.at_end():
+                raise _EndOfInput()
+            raise _Mismatch(cursor.pos, "Expected a style property")
+        cursor.expect(":", "Expected ':' after style property")
+        start = cursor.pos
+        while not cursor.at_end() and cursor.peek() not in ",;" and not cursor.startswith("%%"):
+            cursor.pos += 1
+        if cursor.pos == start or not cursor.text[start:cursor.pos].strip():
+            if cursor.at_end():
+                raise _EndOfInput()
+            raise _Mismatch(cursor.pos, "Expected a style value")
+        if cursor.peek() != ",":
+            break
+        cursor.pos += 1
+    _parse_statement_end(cursor)
+
+
+def _parse_id_list(cursor: _Cursor, what: str):
+    _parse_id(cursor, what)
+    while cursor.peek() == ",":
+        cursor.pos += 1
+        _parse_id(cursor, what)
+
+
+def _parse_style(cursor: _Cursor):
+    _parse_keyword(cursor, "style")
+    cursor.require_spaces("Expected a space after 'style'")
+    _parse_id(cursor)
+    cursor.require_spaces("Expected a space before style properties")
+    _parse_properties(cursor)
+
+
+def _parse_class_def(cursor: _Cursor):
+    _parse_keyword(cursor, "classDef")
+    cursor.require_spaces("Expected a space after 'classDef'")
+    _parse_id_list(cursor, "class name")
+    cursor.require_spaces("Expected a space before class properties")
+    _parse_properties(cursor)
+
+
+def _parse_class(cursor: _Cursor):
+    _parse_keyword(cursor, "class")
+    cursor.require_spaces("Expected a space after 'class'")
+    _parse_id_list(cursor, "node id")
+    cursor.require_spaces("Expected a space before the class name")
+    _parse_id(cursor, "class name")
+    _parse_statement_end(cursor)
+
+
+def _parse_link_style(cursor: _Cursor):
+    _parse_keyword(cursor, "linkStyle")
+    cursor.require_spaces("Expected a space after 'linkStyle'")
+    if cursor.peek() == "d":
+        cursor.expect("default", "Expected 'default' or link indexes")
+    else:
+        start = cursor.pos
+        while not cursor.at_end() and (cursor.peek().isdigit() or cursor.peek() == ","):
+            cursor.pos += 1
+        if cursor.pos == start:
+            if cursor.at_end():
+                raise _EndOfInput()
+            raise _Mismatch(cursor.pos, "Expected link indexes")
+    cursor.require_spaces("Expected a space before link style properties")
+    _parse_properties(cursor)
+
+
+def _parse_subgraph(cursor: _Cursor):
+    _parse_keyword(cursor, "subgraph")
+    cursor.require_spaces("Expected a subgraph name")
+    if cursor.peek() == '"':
+        _parse_quoted(cursor)
+        _parse_statement_end(cursor)
+        return
+    _parse_id(cursor, "subgraph id")
+    if cursor.peek() == "[":
+        _parse_shape(cursor)
+        _parse_statement_end(cursor)
+    # Otherwise the rest of the line is a free-text title
+
+
+def _parse_end(cursor: _Cursor):
+    _parse_keyword(cursor, "end")
+    _parse_statement_end(cursor)
+
+
+def _parse_direction_statement(cursor: _Cursor):
+    _parse_keyword(cursor, "direction")
+    cursor.require_spaces("Expected a direction")
+    _parse_direction(cursor)
+    _parse_statement_end(cursor)
+
+
+def _parse_click(cursor: _Cursor):
+    _parse_keyword(cursor, "click")
+    cursor.require_spaces("Expected a node id after 'click'")
+    _parse_id(cursor)
+
+
+def _parse_acc_title(cursor: _Cursor):
+    cursor.expect("accTitle", "Expected 'accTitle'")
+    cursor.skip_spaces()
+    cursor.expect(":", "Expected ':' after 'accTitle'")
+    # The rest of the line is the title
+
+
+def _parse_acc_descr(cursor: _Cursor):
+    cursor.expect("accDescr", "Expected 'accDescr'")
+    cursor.skip_spaces()
+    if cursor.peek() == "{":
+        # Free text up to a '}' on this line or a later one
+        cursor.pos += 1
+        return
+    cursor.expect(":", "Expected ':' or '{' after 'accDescr'")
+    # The rest of the line is the description
+
+
+STATEMENT_PARSERS = (
+    ("subgraph", _parse_subgraph),
+    ("end", _parse_end),
+    ("direction", _parse_direction_statement),
+    ("style", _parse_style),
+    ("classDef", _parse_class_def),
+    ("class", _parse_class),
+    ("linkStyle", _parse_link_style),
+    ("click", _parse_click),
+    ("accTitle", _parse_acc_title),
+    ("accDescr", _parse_acc_descr),
+)
+
+
+_PARSERS_BY_KEYWORD = dict(STATEMENT_PARSERS)
+
+
+def _run(parser, text: str, start: int) -> Tuple[str, int, str]:
+    cursor = _Cursor(text, start)
+    try:
+        parser(cursor)
+        return COMPLETE, -1, ""
+    except _EndOfInput:
+        return INCOMPLETE, -1, ""
+    except _Mismatch as e:
+        return INVALID, e.pos, e.message
+
+
+def check_line(line: str, is_header: bool = False) -> Tuple[str, int, str]:
+    """
+    Check one line of a flowchart body.
+
+    Args:
+        line: Line text without its newline (may be a partial line)
+        is_header: Whether this is the first statement of the diagram,
+            which must be the 'flowchart'/'graph' declaration
+
+    Returns:
+        Tuple of (status, error_column, error_message); the column is -1
+        unless the status is INVALID
+    """
+    start = len(line) - len(line.lstrip(" \t"))
+    body = line[start:]
+
+    if not body or body.startswith("%%") or (body == "%"):
+        return (COMPLETE if body != "%" else INCOMPLETE), -1, ""
+
+    if is_header:
+        return _run(_parse_header, line, start)
+
+    # Keywords are tried first; a word that is only a keyword prefix may
+    # also be a node id, so every viable alternative is considered
+    candidates = [
+        parser for keyword, parser in STATEMENT_PARSERS
+        if body.startswith(keyword) or keyword.startswith(body.split(" ", 1)[0])
+    ]
+    candidates.append(_parse_chain)
+
+    results = [_run(parser, line, start) for parser in candidates]
+    for status in (COMPLETE, INCOMPLETE):
+        for result in results:
+            if result[0] == status:
+                return result
+
+    # Report the error that got furthest into the line
+    return max(results, key=lambda result: result[1])
+
+
+def check_statement(line: str, keyword: str) -> Tuple[str, int, str]:
+    """
+    Check a line known to start with a statement keyword.
+
+    Faster than check_line(), which also considers the word as a node id
+    prefix (needed while the line is still being generated).
+
+    Args:
+        line: Line text without its newline
+        keyword: First word of the line, one of the STATEMENT_PARSERS keywords
+
+    Returns:
+        Tuple of (status, error_column, error_message), as check_line()
+    """
+    start = len(line) - len(line.lstrip(" \t"))
+    return _run(_PARSERS_BY_KEYWORD[keyword], line, start)
+
+
+def parse_chain(line: str, structured: bool = False) -> Tuple[Optional[list], int, str]:
+    """
+    Parse a node/edge statement, reporting where it fails.
+
+    Args:
+        line: Complete line such as 'A["x"] -->|"oui"| B & C'
+        structured: Give nodes as parse_node() tuples instead of their text
+
+    Returns:
+        Tuple of (parts, error_column, error_message): parts as returned by
+        split_chain(), or None with the column of the error (the line
+        length if the line is truncated)
+    """
+    start = len(line) - len(line.lstrip(" \t"))
+    parts = []
+    try:
+        _parse_chain(_Cursor(line, start), parts, structured)
+    except _EndOfInput:
+        return None, len(line), "Unexpected end of line"
+    except _Mismatch as e:
+        return None, e.pos, e.message
+    return parts, -1, ""
+
+
+def split_chain(line: str) -> Optional[list]:
+    """
+    Split a node/edge statement into its node groups and links.
+
+    Args:
+        line: Complete line such as 'A["x"] -->|"oui"| B & C'
+
+    Returns:
+        Alternating list of node groups (lists of node texts) and link
+        texts, e.g. [['A["x"]'], '-->|"oui"|', ['B', 'C']], or None if the
+        line is not a node/edge statement
+    """
+    body = line.lstrip(" \t")
+    if not body or body.startswith("%%") or any(
+        body.split(None, 1)[0].rstrip(";") == keyword for keyword, _ in STATEMENT_PARSERS
+    ):
+        return None
+    return parse_chain(line)[0]
+
+
+def parse_node(text: str) -> Tuple[str, Optional[str], Optional[str], Optional[str]]:
+    """
+    Split a node text from split_chain() into its components.
+
+    Args:
+        text: Node text such as 'A["📊 Source"]:::data'
+
+    Returns:
+        Tuple of (node_id, shape, label, css_class), e.g.
+        ('A', '[]', '📊 Source', 'data'); shape and label are None for a
+        bare id, css_class without a ':::' suffix
+
+    Raises:
+        ValueError: If the text is not a single node
+    """
+    cursor = _Cursor(text)
+    try:
+        node_id, shape, css_class = _parse_node(cursor)
+    except (_EndOfInput, _Mismatch):
+        raise ValueError(f"Invalid node: {text}")
+    if not cursor.at_end():
+        raise ValueError(f"Invalid node: {text}")
+    if shape is None:
+        return node_id, None, None, css_class
+    return node_id, shape[0], shape[1], css_class
+
+
+def is_fence_prefix(line: str) -> bool:
+    """Whether a line is (the beginning of) a closing ``` fence."""
+    body = line.strip()
+    return bool(body) and ("```".startswith(body) or body == "```")
+
+
+def strip_comment(line: str) -> str:
+    """Remove a trailing %% comment (outside quoted text) from a line."""
+    quoted = False
+    for index, char in enumerate(line):
+        if char == '"':
+            quoted = not quoted
+        elif char == "%" and not quoted and line.startswith("%%", index):
+            return line[:index].rstrip()
+    return line
+
+
+def opens_description_block(line: str) -> bool:
+    """Whether a line opens an 'accDescr {' description closed on a later line."""
+    return _DESCRIPTION_BLOCK_PATTERN.match(line.strip()) is not None
+
+
+class FlowchartGrammarState:
+    """
+    Block-level state carried from one line to the next.
+
+    Tracks whether the header was seen, how many subgraphs are open and
+    whether a multi-line accDescr is open, so that 'end' lines and the closing
+    fence are only accepted where valid.
+    """
+
+    __slots__ = ("header_seen", "depth", "description")
+
+    def __init__(self, header_seen: bool = False, depth: int = 0, description: bool = False):
+        self.header_seen = header_seen
+        self.depth = depth
+        self.description = description  # Inside an 'accDescr {' block
+
+    def copy(self) -> "FlowchartGrammarState":
+        return FlowchartGrammarState(self.header_seen, self.depth, self.description)
+
+    def check(self, line: str) -> Tuple[str, int, str]:
+        """
+        Check a line in the current state, without advancing.
+
+        Args:
+            line: Line text without its newline (may be a partial line)
+
+        Returns:
+            Tuple of (status, error_column, error_message)
+        """
+        if self.description:
+            # Free text until the closing '}'
+            return COMPLETE, -1, ""
+
+        body = line.strip()
+        is_header = not self.header_seen and bool(body) and not body.startswith("%")
+        status, column, message = check_line(line, is_header=is_header)
+
+        if status == COMPLETE and self.depth == 0 and strip_comment(body).split(";")[0].strip() == "end":
+            return INVALID, len(line) - len(line.lstrip()), "'end' without an open subgraph"
+
+        return status, column, message
+
+    def can_close(self) -> bool:
+        """Whether the diagram may end here."""
+        return self.header_seen and self.depth == 0 and not self.description
+
+    def advance(self, line: str):
+        """
+        Update the state with a finished line.
+
+        Args:
+            line: Complete line text without its newline
+        """
+        body = line.strip()
+        if self.description:
+            self.description = "}" not in body
+            return
+        if not body or body.startswith("%%"):
+            return
+        if not self.header_seen:
+            self.header_seen = True
+            return
+
+        first_word = body.split(None, 1)[0].rstrip(";")
+        if first_word == "subgraph":
+            self.depth += 1
+        elif first_word == "end" and self.depth > 0:
+            self.depth -= 1
+        elif opens_description_block(body):
+            self.description = True
@@ -4,14 +4,75 @@ Uses Mistral API for diagram generation.
 """
 import gradio as gr
 import os
-from typing import Tuple, List, Dict
-from ..ai.qwen_zerogpu_analyzer import QwenZeroGPUAnalyzer
+from typing import Tuple, List, Dict, Iterator
+from ..ai.stub_analyzer import StubAnalyzer
 from ..ai.prompts_config import DiagramPrompts
+from ..ai.generation_limits import estimate_max_new_tokens
 from ..utils.json_validator import validate_pvb_json
 from ..core.mermaid_extractor import extract_mermaid_code
+from ..core.fenced_blocks import CODE, FencedBlockScanner, find_block, scan_fenced_blocks, text_without_blocks
 from ..core.mermaid_encoder import generate_mermaid_chart_url
 
 
+STREAMING_DIAGRAM_PLACEHOLDER = "⏳ Génération du diagramme en cours..."
+
+# Code blocks shown in the preview pane rather than in the chat
+DIAGRAM_BLOCK_LANGUAGES = ("mermaid", "edits")
+
+
+def render_partial_response(
+    response: str,
+    scanner: FencedBlockScanner,
+    current_diagram: str
+) -> Tuple[str, str]:
+    """
+    Split a partially generated response into chat text and diagram preview.
+
+    Only complete lines of an unfinished Mermaid block are shown in the
+    preview, so the renderer never sees a half-written node definition.
+
+    Args:
+        response: Response text generated so far
+        scanner: FencedBlockScanner fed with that text
+        current_diagram: Diagram to keep showing until a new one is available
+
+    Returns:
+        Tuple of (chat_text, diagram_preview)
+    """
+    # Chat text: everything but diagram blocks, the block being written and a fence being written
+    pieces = []
+    position = 0
+    for segment in scanner.segments:
+        if segment.kind == CODE and segment.language in DIAGRAM_BLOCK_LANGUAGES:
+            pieces.append(response[position:segment.start])
+            position = segment.end
+    if scanner.open_block is not None:
+        pieces.append(response[position:scanner.open_block.start])
+    elif scanner.fence_pending:
+        pieces.append(response[position:len(response) - len(scanner.pending_line)])
+    else:
+        pieces.append(response[position:])
+    chat_text = "".join(pieces).strip()
+
+    block = find_block(scanner.segments, "mermaid")
+    if block is None and scanner.open_block is not None and scanner.open_block.language == "mermaid":
+        block = scanner.open_block
+
+    if block is None:
+        diagram_preview = f"```mermaid\n{current_diagram}\n```" if current_diagram else "Diagram will appear here..."
+        return chat_text or STREAMING_DIAGRAM_PLACEHOLDER, diagram_preview
+
+    if not block.closed:
+        chat_text = f"{chat_text}\n\n{STREAMING_DIAGRAM_PLACEHOLDER}" if chat_text else STREAMING_DIAGRAM_PLACEHOLDER
+
+    if block.content.strip():
+        diagram_preview = f"```mermaid\n{block.content.rstrip()}\n```"
+    else:
+        diagram_preview = f"```mermaid\n{current_diagram}\n```" if current_diagram else "Diagram will appear here..."
+
+    return chat_text or STREAMING_DIAGRAM_PLACEHOLDER, diagram_preview
+
+
 def create_spaces_interface():
     """
     Create Gradio interface for Hugging Face Spaces.
@@ -20,32 +81,47 @@ def create_spaces_interface():
         Gradio Blocks demo
     """
 
-    # Initialize Qwen ZeroGPU analyzer
-    try:
-        analyzer = QwenZeroGPUAnalyzer()
-        print("✅ Qwen ZeroGPU analyzer initialized")
-    except Exception as e:
-        print(f"⚠️ Warning: Could not initialize Qwen analyzer: {e}")
-        analyzer = None
+    if os.getenv("ANALYZER_BACKEND", "auto").lower() == "stub":
+        # No model: load tests of the app plumbing on any machine
+        analyzer = StubAnalyzer(
+            responses_path=os.getenv("STUB_RESPONSES_PATH") or None,
+            time_to_first_token=float(os.getenv("STUB_TTFT_SECONDS", "0.5")),
+            tokens_per_second=float(os.getenv("STUB_TOKENS_PER_SECOND", "30")),
+            jitter=float(os.getenv("STUB_JITTER", "0"))
+        )
+    else:
+        # Initialize Qwen ZeroGPU analyzer
+        try:
+            # Imported here: needs the spaces package, which the stub does not
+            from ..ai.qwen_zerogpu_analyzer import QwenZeroGPUAnalyzer
+            analyzer = QwenZeroGPUAnalyzer()
+            # Load the weights while the UI starts instead of on the first request
+            analyzer.preload()
+            print("✅ Qwen ZeroGPU analyzer initialized (model loading in the background)")
+        except Exception as e:
+            print(f"⚠️ Warning: Could not initialize Qwen analyzer: {e}")
+            analyzer = None
 
     def handle_message(
         user_input: str,
         conversation: List[Dict[str, str]],
         current_diagram: str,
         pvb_data: Dict
-    ) -> Tuple[List[Dict[str, str]], str, List[Dict], str, Dict, str]:
-        """Handle user message and generate response."""
+    ) -> Iterator[Tuple[List[Dict[str, str]], str, List[Dict], str, Dict, str]]:
+        """Handle user message and stream the generated response."""
 
         if not analyzer:
             error_msg = "❌ Model not initialized. Please check the Space logs."
             conversation.append({"role": "user", "content": user_input})
             conversation.append({"role": "assistant", "content": error_msg})
             diagram_preview = f"```mermaid\n{current_diagram}\n```" if current_diagram else "Model not initialized"
-            return conversation, diagram_preview, conversation, current_diagram, pvb_data, ""
+            yield conversation, diagram_preview, conversation, current_diagram, pvb_data, ""
+            return
 
         if not user_input or not user_input.strip():
             diagram_preview = f"```mermaid\n{current_diagram}\n```" if current_diagram else "Diagram will appear here..."
-            return conversation, diagram_preview, conversation, current_diagram, pvb_data, ""
+            yield conversation, diagram_preview, conversation, current_diagram, pvb_data, ""
+            return
 
         # Check if this is initial PVB input or refinement
         if not pvb_data:
@@ -69,16 +145,36 @@ def create_spaces_interface():
         # Add display message to conversation
         conversation.append({"role": "user", "content": display_message})
 
+        # Create LLM conversation with the actual prompt
+        llm_conversation = conversation[:-1]  # All messages except the last one
+        llm_conversation.append({"role": "user", "content": prompt})
+
+        # Placeholder assistant message, filled in as tokens arrive
+        assistant_message = {"role": "assistant", "content": STREAMING_DIAGRAM_PLACEHOLDER}
+        conversation.append(assistant_message)
+
+        diagram_preview = f"```mermaid\n{current_diagram}\n```" if current_diagram else "Diagram will appear here..."
+        yield conversation, diagram_preview, conversation, current_diagram, pvb_data, ""
+
         try:
-            # Create LLM conversation with the actual prompt
-            llm_conversation = conversation[:-1]  # All messages except the last one
-            llm_conversation.append({"role": "user", "content": prompt})
+            # Stream response from Qwen ZeroGPU
+            response = ""
+            scanner = FencedBlockScanner()
+            # Budget sized from the diagram being refined, or from the PVB for a first diagram
+            max_tokens = estimate_max_new_tokens(current_diagram, pvb_data)
+            for chunk in analyzer.generate_response_stream(llm_conversation, max_tokens=max_tokens):
+                response += chunk
+                scanner.feed(chunk)
+                assistant_message["content"], diagram_preview = render_partial_response(
+                    response, scanner, current_diagram
+                )
+                yield conversation, diagram_preview, conversation, current_diagram, pvb_data, ""
 
-            # Generate response with Qwen ZeroGPU
-            response = analyzer.generate_response(llm_conversation)
+            response = response.strip()
 
             # Extract Mermaid code from response
-            mermaid_code, is_valid = extract_mermaid_code(response)
+            segments = scan_fenced_blocks(response)
+            mermaid_code, is_valid = extract_mermaid_code(response, segments)
 
             if is_valid and mermaid_code:
                 current_diagram = mermaid_code
@@ -87,20 +183,19 @@ def create_spaces_interface():
             diagram_preview = f"```mermaid\n{current_diagram}\n```" if current_diagram else "No diagram yet..."
 
             # For chat display: show only text without the Mermaid code block
-            import re
-            chat_response = re.sub(r'```mermaid\n.*?\n```', '', response, flags=re.DOTALL).strip()
+            chat_response = text_without_blocks(response, segments, DIAGRAM_BLOCK_LANGUAGES).strip()
 
             if not chat_response:
                 chat_response = "Diagramme généré avec succès ! Consultez le panneau de droite pour visualiser le résultat."
 
-            conversation.append({"role": "assistant", "content": chat_response})
+            assistant_message["content"] = chat_response
 
         except Exception as e:
             error_message = f"Error generating response: {str(e)}"
-            conversation.append({"role": "assistant", "content": error_message})
+            assistant_message["content"] = error_message
             diagram_preview = f"```mermaid\n{current_diagram}\n```" if current_diagram else "Error occurred"
 
-        return (
+        yield (
             conversation,
             diagram_preview,
             conversation,
@@ -124,18 +219,16 @@ def create_spaces_interface():
         """Generate Mermaid Live Editor link."""
         import time
         import hashlib
-        import re
 
         timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
 
         # Extract Mermaid code from preview
-        mermaid_pattern = r'```mermaid\n(.*?)\n```'
-        match = re.search(mermaid_pattern, diagram_preview, re.DOTALL)
+        block = find_block(scan_fenced_blocks(diagram_preview or ""), "mermaid")
 
-        if not match:
+        if block is None:
             return "⚠️ **Pas de diagramme à partager.** Veuillez d'abord générer un diagramme."
 
-        current_diagram = match.group(1).strip()
+        current_diagram = block.content.strip()
 
         if not current_diagram or not current_diagram.strip():
             return "⚠️ **Pas de diagramme à partager.** Veuillez d'abord générer un diagramme."
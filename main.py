@@ -8,8 +8,34 @@ from dotenv import load_dotenv
 # Load environment variables from .env file
 load_dotenv()
 
-from src.pvb_flow.ai.analyzer_factory import create_analyzer, print_system_info
+from src.pvb_flow.ai.analyzer_factory import (
+    create_analyzer, is_deterministic_backend, print_system_info, resolve_model_name
+)
+from src.pvb_flow.ai.analyzer_pool import AnalyzerPool
+from src.pvb_flow.ai.background_loader import BackgroundAnalyzer
+from src.pvb_flow.ai.idle_watchdog import IdleUnloadWatchdog
+from src.pvb_flow.ai.response_cache import CachedAnalyzer, ResponseCache
 from src.pvb_flow.ui.app import create_ui
+from src.pvb_flow.utils.structured_logging import configure_logging
+
+
+def parse_model_pool(value: str) -> dict:
+    """
+    Parse the MODEL_POOL setting.
+
+    Args:
+        value: Comma-separated model names, each optionally followed by
+            '=<expected size in GB>' (e.g. "org/small=8,org/large=26")
+
+    Returns:
+        Dictionary of model name -> expected size in bytes (0 if not given)
+    """
+    models = {}
+    for item in value.split(","):
+        name, _, size_gb = item.strip().partition("=")
+        if name:
+            models[name] = int(float(size_gb) * 1024 ** 3) if size_gb else 0
+    return models
 
 
 def main():
@@ -25,10 +51,42 @@ def main():
     hf_token = os.getenv("HUGGINGFACE_TOKEN")
     model_name = os.getenv("DEFAULT_MODEL")
     server_port = int(os.getenv("GRADIO_SERVER_PORT", "7860"))
+    server_name = os.getenv("GRADIO_SERVER_NAME", "127.0.0.1")
     share = os.getenv("GRADIO_SHARE", "false").lower() == "true"
+    session_cache_mb = int(os.getenv("SESSION_KV_CACHE_MB", "2048"))
+    continuous_batching = os.getenv("CONTINUOUS_BATCHING", "false").lower() == "true"
+    max_batch_size = int(os.getenv("MAX_BATCH_SIZE", "8"))
+    constrained_decoding = os.getenv("CONSTRAINED_DECODING", "false").lower() == "true"
+    cpu_precision = os.getenv("CPU_PRECISION", "fp32").lower()
+    static_kv_cache = os.getenv("STATIC_KV_CACHE", "false").lower() == "true"
+    prompt_lookup_tokens = int(os.getenv("PROMPT_LOOKUP_TOKENS", "10"))
+    analyzer_backend = os.getenv("ANALYZER_BACKEND", "auto").lower()
+    stub_options = {
+        "responses_path": os.getenv("STUB_RESPONSES_PATH") or None,
+        "time_to_first_token": float(os.getenv("STUB_TTFT_SECONDS", "0.5")),
+        "tokens_per_second": float(os.getenv("STUB_TOKENS_PER_SECOND", "30")),
+        "jitter": float(os.getenv("STUB_JITTER", "0"))
+    }
+    edit_refinements = os.getenv("EDIT_REFINEMENTS", "false").lower() == "true"
+    model_warmup = os.getenv("MODEL_WARMUP", "true").lower() == "true"
+    model_pool = parse_model_pool(os.getenv("MODEL_POOL", ""))
+    model_pool_budget_gb = float(os.getenv("MODEL_POOL_BUDGET_GB", "48"))
+    idle_unload_minutes = float(os.getenv("IDLE_UNLOAD_MINUTES", "0"))
+    response_cache_entries = int(os.getenv("RESPONSE_CACHE_ENTRIES", "0"))
+    response_cache_path = os.getenv("RESPONSE_CACHE_PATH") or None
+    response_cache_ttl_hours = float(os.getenv("RESPONSE_CACHE_TTL_HOURS", "24"))
+    prompt_token_budget = int(os.getenv("PROMPT_TOKEN_BUDGET", "3072"))
+
+    # Request logs go through a queue, written to stdout off the request path
+    configure_logging(
+        level=os.getenv("LOG_LEVEL", "INFO"),
+        fmt=os.getenv("LOG_FORMAT", "text").lower(),
+        debug_sample_rate=float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "1")),
+        max_payload_chars=int(os.getenv("LOG_MAX_PAYLOAD_CHARS", "200"))
+    )
 
     # Validate HuggingFace token for transformers backend
-    if sys.platform != "darwin" and not hf_token:
+    if sys.platform != "darwin" and not hf_token and analyzer_backend != "stub":
         print("\n⚠️  WARNING: HUGGINGFACE_TOKEN not found in environment!")
         print("For transformers backend, you need a HuggingFace token.")
         print("Get your token from: https://huggingface.co/settings/tokens")
@@ -39,36 +97,104 @@ def main():
             print("💡 Tip: Copy .env.template to .env and add your token\n")
 
     try:
-        # Create analyzer
-        print("🔧 Initializing model...")
-        analyzer = create_analyzer(
-            hf_token=hf_token,
-            model_name=model_name,
-            prefer_mlx=True  # Prefer MLX on macOS
-        )
-        print("✅ Model initialized successfully!\n")
+        # Load and warm up the model in the background so the UI is served right away
+        print("🔧 Initializing model in the background...")
+
+        def build_analyzer(name=model_name):
+            return create_analyzer(
+                hf_token=hf_token,
+                model_name=name,
+                prefer_mlx=True,  # Prefer MLX on macOS
+                session_cache_mb=session_cache_mb,
+                continuous_batching=continuous_batching,
+                max_batch_size=max_batch_size,
+                constrained_decoding=constrained_decoding,
+                cpu_precision=cpu_precision,
+                static_cache=static_kv_cache,
+                prompt_lookup_num_tokens=prompt_lookup_tokens,
+                backend=analyzer_backend,
+                stub_options=stub_options
+            )
+
+        pool = None
+        if len(model_pool) > 1:
+            # Several models on one host: load on demand, evict least recently used
+            pool = AnalyzerPool(
+                {name: (lambda name=name: build_analyzer(name)) for name in model_pool},
+                budget_bytes=int(model_pool_budget_gb * 1024 ** 3),
+                estimated_bytes=model_pool
+            )
+            print(f"📚 Analyzer pool: {', '.join(pool.model_names)} ({model_pool_budget_gb:g} GB budget)")
+        elif model_pool:
+            model_name = next(iter(model_pool))
+
+        if idle_unload_minutes > 0:
+            print(f"💤 Idle unload after {idle_unload_minutes:g} min without requests")
+
+        def build_served_analyzer():
+            served = pool if pool is not None else build_analyzer(model_name)
+            if idle_unload_minutes > 0:
+                # Free the model off-hours, reload it on the next request
+                served = IdleUnloadWatchdog(served, idle_unload_minutes * 60)
+            return served
+
+        analyzer = BackgroundAnalyzer(build_served_analyzer, warmup=model_warmup).start()
+
+        response_cache_enabled = response_cache_entries > 0 or response_cache_path
+        if response_cache_enabled and not is_deterministic_backend(analyzer_backend):
+            # MLX samples: caching would pin one random answer, retries could never differ
+            print("⚠️  Response cache disabled: the MLX backend does not decode deterministically")
+        elif response_cache_enabled:
+            # Greedy decoding: a re-submitted board gets the stored diagram
+            cache = ResponseCache(
+                max_entries=response_cache_entries,
+                path=response_cache_path,
+                ttl_seconds=response_cache_ttl_hours * 3600
+            )
+            # Every setting that changes the answer, so a restart with another
+            # configuration does not serve the previous one's diagrams
+            analyzer = CachedAnalyzer(analyzer, cache, generation_config={
+                "backend": analyzer_backend,
+                "cpu_precision": cpu_precision,
+                "constrained_decoding": constrained_decoding,
+                "static_kv_cache": static_kv_cache,
+                "continuous_batching": continuous_batching,
+                "edit_refinements": edit_refinements,
+                "prompt_token_budget": prompt_token_budget,
+                "prompt_lookup_tokens": prompt_lookup_tokens
+            }, model_name=pool.default_model if pool is not None else resolve_model_name(model_name, analyzer_backend))
+            print(f"🗃️  Response cache: {response_cache_entries} in memory"
+                  + (f", {response_cache_path} on disk" if response_cache_path else ""))
 
         # Create and launch Gradio UI
         print("🚀 Launching Gradio interface...")
-        demo = create_ui(analyzer)
-
-        # Launch configuration
-        launch_kwargs = {
-            "server_port": server_port,
-            "share": share,
-            "show_error": True,
-            "quiet": False
-        }
+        # The scheduler merges concurrent requests, so let Gradio run them in parallel
+        demo = create_ui(
+            analyzer,
+            concurrency_limit=max_batch_size if continuous_batching else 1,
+            edit_refinements=edit_refinements,
+            model_choices=list(model_pool) if len(model_pool) > 1 else None,
+            prompt_token_budget=prompt_token_budget
+        )
 
         print(f"\n📍 Server will run on: http://localhost:{server_port}")
         if share:
             print("🌐 Public sharing enabled - a public URL will be generated")
         print("\n" + "="*60)
         print("🎉 Application ready! Open the URL above in your browser")
+        print("   (the model keeps loading in the background)")
         print("="*60 + "\n")
 
-        # Launch
-        demo.launch(**launch_kwargs)
+        if share:
+            # Share links need Gradio's own launcher (no readiness probe there)
+            demo.launch(server_port=server_port, share=True, show_error=True, quiet=False)
+        else:
+            # Serve the UI with /health and /ready probes for the load balancer
+            import uvicorn
+            from src.pvb_flow.ui.server import create_server
+
+            print(f"🩺 Readiness probe: http://localhost:{server_port}/ready")
+            uvicorn.run(create_server(demo, analyzer), host=server_name, port=server_port)
 
     except KeyboardInterrupt:
         print("\n\n👋 Application stopped by user")
@@ -3,12 +3,64 @@ Factory for creating the best available analyzer based on platform and available
 """
 import sys
 import platform
+from typing import Dict, Optional
+
+
+MLX_DEFAULT_MODEL = "mlx-community/Mistral-Small-3.1-24B-Instruct-2503-8bit"
+TRANSFORMERS_DEFAULT_MODEL = "mistralai/Mistral-Small-Instruct-2409"
+
+
+def resolve_model_name(model_name: Optional[str] = None, backend: str = "auto", prefer_mlx: bool = True) -> str:
+    """
+    Name of the model create_analyzer() will serve.
+
+    Args:
+        model_name: Configured model name, None for the backend default
+        backend: "auto" or "stub"
+        prefer_mlx: If True and on macOS, MLX is tried first
+
+    Returns:
+        Model name
+    """
+    if model_name:
+        return model_name
+    if backend == "stub":
+        return "stub"
+    if sys.platform == "darwin" and prefer_mlx:
+        return MLX_DEFAULT_MODEL
+    return TRANSFORMERS_DEFAULT_MODEL
+
+
+def is_deterministic_backend(backend: str = "auto", prefer_mlx: bool = True) -> bool:
+    """
+    Whether the same request always gets the same answer.
+
+    The transformers backend decodes greedily and the stub replays fixed
+    responses; MLX samples (temperature 0.2), so it is not deterministic.
+
+    Args:
+        backend: "auto" or "stub"
+        prefer_mlx: If True and on macOS, MLX is tried first
+
+    Returns:
+        False when the MLX backend may be used
+    """
+    return backend == "stub" or not (sys.platform == "darwin" and prefer_mlx)
 
 
 def create_analyzer(
     hf_token: str = None,
     model_name: str = None,
-    prefer_mlx: bool = True
+    prefer_mlx: bool = True,
+    session_cache_mb: int = 2048,
+    continuous_batching: bool = False,
+    max_batch_size: int = 8,
+    constrained_decoding: bool = False,
+    cpu_precision: str = "fp32",
+    static_cache: bool = False,
+    prompt_lookup_num_tokens: int = 10,
+    backend: str = "auto",
+    stub_options: Optional[Dict] = None
 ):
     """
     Auto-detect best backend and create appropriate analyzer.
@@ -16,21 +68,40 @@ def create_analyzer(
     Strategy:
     1. On macOS: Try MLX first (fastest, lowest memory), fallback to transformers
     2. On Linux/Windows: Use transformers with CUDA/CPU
+    3. backend="stub": No model, replayed responses with simulated timings
 
     Args:
         hf_token: HuggingFace API token (required for transformers backend)
         model_name: Override default model name
         prefer_mlx: If True and on macOS, try MLX first
+        session_cache_mb: Memory budget (MB) for per-session KV caches (transformers backend)
+        continuous_batching: Decode concurrent requests in one shared batch (transformers backend)
+        max_batch_size: Maximum number of requests per decode batch
+        constrained_decoding: Restrict the ```mermaid``` block to the flowchart
+            grammar (transformers backend)
+        cpu_precision: Weight precision when running on CPU: "fp32", "bf16",
+            "int8" or "int4" (weight-only quantization, no bitsandbytes needed)
+        static_cache: Decode with length-bucketed static KV caches and a
+            compiled decode step (transformers backend, not with continuous batching)
+        prompt_lookup_num_tokens: Draft tokens per step when refinements use
+            prompt lookup, 0 to disable (transformers backend)
+        backend: "auto" to pick a model backend, "stub" for a StubAnalyzer
+        stub_options: Keyword arguments for StubAnalyzer (responses_path,
+            time_to_first_token, tokens_per_second, jitter, seed)
 
     Returns:
-        Analyzer instance (MistralMLXAnalyzer or MistralTextAnalyzer)
+        Analyzer instance (MistralMLXAnalyzer, MistralTextAnalyzer, ContinuousBatchScheduler
+        or StubAnalyzer)
     """
+    if backend == "stub":
+        from .stub_analyzer import StubAnalyzer
+        print("🧪 Using stub backend (no model, simulated generation)")
+        return StubAnalyzer(model_name=model_name or "stub", **(stub_options or {}))
+    if backend != "auto":
+        raise ValueError(f"Unknown analyzer backend: {backend} (expected 'auto' or 'stub')")
+
     # Determine default model name
-    if model_name is None:
-        if sys.platform == "darwin" and prefer_mlx:
-            model_name = "mlx-community/Mistral-Small-3.1-24B-Instruct-2503-8bit"
-        else:
-            model_name = "mistralai/Mistral-Small-Instruct-2409"
+    model_name = resolve_model_name(model_name, backend, prefer_mlx)
 
     # On macOS, try MLX first
     if sys.platform == "darwin" and prefer_mlx:
@@ -56,12 +127,28 @@ def create_analyzer(
         )
 
     print("🚀 Using Transformers backend (cross-platform)")
-    return MistralTextAnalyzer(
+    analyzer = MistralTextAnalyzer(
         hf_token=hf_token,
         model_name=model_name,
-        load_in_8bit=True  # Use 8-bit to reduce memory
+        load_in_8bit=True,  # Use 8-bit to reduce memory
+        session_cache_mb=session_cache_mb,
+        constrained_decoding=constrained_decoding,
+        cpu_precision=cpu_precision,
+        # The shared batch decodes outside generate(): static caches would only take memory
+        static_cache=static_cache and not continuous_batching,
+        prompt_lookup_num_tokens=prompt_lookup_num_tokens
     )
 
+    if continuous_batching:
+        from .batch_scheduler import ContinuousBatchScheduler
+        print(f"🔀 Continuous batching enabled (up to {max_batch_size} requests per batch)")
+        if static_cache:
+            print("⚠️  STATIC_KV_CACHE is not used with continuous batching")
+        print("ℹ️  Prompt-lookup drafting of refinements is not used with continuous batching")
+        return ContinuousBatchScheduler(analyzer, max_batch_size=max_batch_size)
+
+    return analyzer
+
 
 def get_system_info() -> dict:
     """
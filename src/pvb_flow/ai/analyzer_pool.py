@@ -0,0 +1,299 @@
+"""
+Pool of analyzers for several models within a memory budget.
+
+Models are loaded on first use and kept while they fit in the budget; when
+a new model needs room, the least recently used idle models are unloaded
+through their cleanup_model(). A model of unknown size is loaded only
+after every idle model has been unloaded.
+"""
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from .generation_limits import MAX_NEW_TOKENS
+
+
+def analyzer_memory_bytes(analyzer) -> int:
+    """
+    Estimate the memory held by a loaded analyzer.
+
+    Counts the model weights plus the KV-cache budget of the transformers
+    backend.
+
+    Args:
+        analyzer: Loaded analyzer (or a wrapper delegating to one)
+
+    Returns:
+        Size in bytes, 0 if unknown
+    """
+    model = getattr(analyzer, "model", None)
+    if model is None:
+        return 0
+
+    if hasattr(model, "get_memory_footprint"):
+        size = model.get_memory_footprint()
+    else:
+        try:
+            # MLX models expose their weights as a parameter tree
+            from mlx.utils import tree_flatten
+            size = sum(value.nbytes for _, value in tree_flatten(model.parameters()))
+        except (ImportError, AttributeError):
+            return 0
+
+    session_cache = getattr(analyzer, "session_cache", None)
+    if session_cache is not None:
+        size += session_cache.max_bytes
+
+    return int(size)
+
+
+class _PoolEntry:
+    """A model of the pool and its loaded analyzer, if any."""
+
+    __slots__ = ("name", "factory", "estimated_bytes", "analyzer", "nbytes", "in_use")
+
+    def __init__(self, name: str, factory: Callable[[], Any], estimated_bytes: int):
+        self.name = name
+        self.factory = factory
+        self.estimated_bytes = estimated_bytes
+        self.analyzer = None
+        self.nbytes = 0
+        self.in_use = 0
+
+
+class AnalyzerPool:
+    """
+    Serve several models, loading on demand and evicting least recently used.
+
+    Exposes the analyzer interface; generation calls take an extra `model`
+    argument naming the model to use (the default model when omitted).
+    Models in use by a running generation are never evicted.
+    """
+
+    def __init__(
+        self,
+        factories: Dict[str, Callable[[], Any]],
+        budget_bytes: int,
+        default_model: Optional[str] = None,
+        estimated_bytes: Optional[Dict[str, int]] = None
+    ):
+        """
+        Initialize an empty pool (nothing is loaded until first use).
+
+        Args:
+            factories: Model name -> callable creating its analyzer
+            budget_bytes: Memory budget for all loaded models combined
+            default_model: Model used when a request does not name one
+                (default: the first model)
+            estimated_bytes: Model name -> expected size, used to make room
+                before a first load (later loads use the measured size); without
+                it, all idle models are unloaded before the first load
+        """
+        if not factories:
+            raise ValueError("The analyzer pool needs at least one model")
+
+        estimated_bytes = estimated_bytes or {}
+        self._entries = OrderedDict(
+            (name, _PoolEntry(name, factory, estimated_bytes.get(name, 0)))
+            for name, factory in factories.items()
+        )
+        self.budget_bytes = budget_bytes
+        self.default_model = default_model or next(iter(self._entries))
+        if self.default_model not in self._entries:
+            raise ValueError(f"Unknown default model: {self.default_model}")
+
+        self._lru = OrderedDict()  # Loaded model names, least recently used first
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self.loads = 0
+        self.evictions = 0
+
+    @property
+    def model_names(self) -> List[str]:
+        """Names of the models the pool can serve."""
+        return list(self._entries)
+
+    @property
+    def model_name(self) -> str:
+        """Name of the default model."""
+        return self.default_model
+
+    def get_pool_stats(self) -> Dict:
+        """
+        Get pool counters.
+
+        Returns:
+            Dictionary with loaded models, memory use, budget, loads and evictions
+        """
+        with self._lock:
+            return {
+                "loaded": list(self._lru),
+                "bytes": sum(entry.nbytes for entry in self._entries.values()),
+                "budget_bytes": self.budget_bytes,
+                "loads": self.loads,
+                "evictions": self.evictions
+            }
+
+    def generate_response(
+        self,
+        conversation: List[Dict[str, str]],
+        max_tokens: int = MAX_NEW_TOKENS,
+        model: Optional[str] = None,
+        **kwargs
+    ) -> str:
+        """
+        Generate a response with one of the pool's models.
+
+        Args:
+            conversation: List of conversation messages with 'role' and 'content'
+            max_tokens: Maximum tokens to generate
+            model: Model name, None for the default model
+            **kwargs: Passed to the analyzer (session_id, prompt_lookup)
+
+        Returns:
+            Generated response text
+        """
+        entry = self._acquire(model)
+        try:
+            return entry.analyzer.generate_response(conversation, max_tokens=max_tokens, **kwargs)
+        finally:
+            self._release(entry)
+
+    def generate_response_stream(
+        self,
+        conversation: List[Dict[str, str]],
+        max_tokens: int = MAX_NEW_TOKENS,
+        model: Optional[str] = None,
+        **kwargs
+    ) -> Iterator[str]:
+        """
+        Stream a response from one of the pool's models.
+
+        Args:
+            conversation: List of conversation messages with 'role' and 'content'
+            max_tokens: Maximum tokens to generate
+            model: Model name, None for the default model
+            **kwargs: Passed to the analyzer (session_id, prompt_lookup)
+
+        Yields:
+            Generated text chunks
+        """
+        entry = self._acquire(model)
+        try:
+            yield from entry.analyzer.generate_response_stream(conversation, max_tokens=max_tokens, **kwargs)
+        finally:
+            self._release(entry)
+
+    def cleanup_model(self):
+        """Unload every idle model."""
+        with self._lock:
+            unloaded = [
+                self._detach(entry) for entry in self._entries.values()
+                if entry.analyzer is not None and not entry.in_use
+            ]
+        self._cleanup(unloaded)
+
+    def _acquire(self, name: Optional[str]) -> _PoolEntry:
+        """Get a model's entry, loading it if needed, and mark it in use."""
+        name = name or self.default_model
+        entry = self._entries.get(name)
+        if entry is None:
+            raise ValueError(f"Unknown model: {name}")
+
+        with self._lock:
+            if entry.analyzer is not None:
+                entry.in_use += 1
+                self._lru.move_to_end(name)
+                return entry
+
+        # One load at a time: loads are memory peaks
+        with self._load_lock:
+            unloaded = []
+            with self._lock:
+                if entry.analyzer is None:
+                    # Unknown size: assume it needs every idle model's memory
+                    unloaded = self._make_room(entry.estimated_bytes or None, keep=name)
+                    loading = True
+                else:
+                    loading = False
+                entry.in_use += 1
+            # Freed before the load, outside the lock other requests need
+            self._cleanup(unloaded)
+
+            if loading:
+                try:
+                    print(f"📦 Loading {name} into the analyzer pool...")
+                    analyzer = entry.factory()
+                except Exception:
+                    with self._lock:
+                        entry.in_use -= 1
+                    raise
+
+                with self._lock:
+                    entry.analyzer = analyzer
+                    entry.nbytes = analyzer_memory_bytes(analyzer) or entry.estimated_bytes
+                    self.loads += 1
+                    # The measured size may exceed the estimate
+                    unloaded = self._make_room(0, keep=name)
+                self._cleanup(unloaded)
+
+        with self._lock:
+            self._lru[name] = None
+            self._lru.move_to_end(name)
+        return entry
+
+    def _release(self, entry: _PoolEntry):
+        with self._lock:
+            entry.in_use -= 1
+
+    def _make_room(self, needed: Optional[int], keep: str) -> List[Any]:
+        """
+        Evict least recently used idle models until `needed` more bytes fit.
+
+        Must be called with self._lock held; the evicted analyzers are
+        returned for _cleanup() once the lock is released.
+
+        Args:
+            needed: Bytes to make room for, None if unknown (evicts every idle model)
+            keep: Model never evicted (the one being loaded)
+
+        Returns:
+            Evicted analyzers
+        """
+        used = sum(entry.nbytes for entry in self._entries.values() if entry.analyzer is not None)
+        evicted = []
+        for name in list(self._lru):
+            if needed is not None and used + needed <= self.budget_bytes:
+                break
+            entry = self._entries[name]
+            if name == keep or entry.in_use:
+                continue
+            used -= entry.nbytes
+            evicted.append(self._detach(entry))
+            self.evictions += 1
+
+        if needed is not None and used + needed > self.budget_bytes:
+            print(f"⚠️  Analyzer pool over budget ({(used + needed) / 1e9:.1f} GB, models in use)")
+        return evicted
+
+    def _detach(self, entry: _PoolEntry) -> Any:
+        """
+        Take a model out of the pool. Must be called with self._lock held.
+
+        Returns:
+            Its analyzer, to pass to _cleanup()
+        """
+        print(f"♻️  Unloading {entry.name} from the analyzer pool")
+        analyzer = entry.analyzer
+        entry.analyzer = None
+        # Remembered to make room before the next load
+        entry.estimated_bytes = entry.nbytes
+        entry.nbytes = 0
+        self._lru.pop(entry.name, None)
+        return analyzer
+
+    @staticmethod
+    def _cleanup(analyzers: List[Any]):
+        """Free detached analyzers (gc, device cache), without holding the pool lock."""
+        for analyzer in analyzers:
+            analyzer.cleanup_model()
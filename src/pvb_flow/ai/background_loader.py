@@ -0,0 +1,176 @@
+"""
+Background model loading and warm-up.
+
+Loading a 24B model takes minutes, and the first generation pays extra
+one-off costs (kernel compilation, allocator growth, lazy imports). Doing
+both in a background thread lets the UI be served immediately and report a
+"warming up" state, while a readiness probe tells the load balancer when to
+route traffic to the instance.
+"""
+import threading
+import time
+from contextlib import nullcontext
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from .generation_limits import MAX_NEW_TOKENS
+from .prompts_config import DiagramPrompts
+from ..utils.metrics import QUEUE_DEPTH
+
+
+# Enough to run prefill and a few decode steps
+WARMUP_MAX_NEW_TOKENS = 8
+
+LOADING = "loading"
+WARMING_UP = "warming_up"
+READY = "ready"
+FAILED = "failed"
+
+
+def warm_up_analyzer(analyzer) -> None:
+    """
+    Run a dummy generation on the system prompt.
+
+    Args:
+        analyzer: Analyzer to warm up (loads lazily-loaded models as a side effect)
+    """
+    # Not a user request: keep it out of the cache hit counters
+    uncounted = getattr(analyzer, "uncounted_cache_lookups", None)
+    with uncounted() if uncounted is not None else nullcontext():
+        analyzer.generate_response(
+            [{"role": "user", "content": DiagramPrompts.SYSTEM_PROMPT}],
+            max_tokens=WARMUP_MAX_NEW_TOKENS
+        )
+
+
+class BackgroundAnalyzer:
+    """
+    Analyzer proxy that loads and warms up the real analyzer in a thread.
+
+    Exposes the analyzer interface right away; generation calls made before
+    the model is ready wait for it. Other attributes are delegated to the
+    loaded analyzer.
+    """
+
+    def __init__(self, factory: Callable[[], Any], warmup: bool = True):
+        """
+        Initialize the proxy (call start() to begin loading).
+
+        Args:
+            factory: Callable creating the analyzer, e.g. a create_analyzer() closure
+            warmup: Whether to run a dummy generation once the model is loaded
+                (lazily-loading backends such as MLX then load on first use)
+        """
+        self.factory = factory
+        self.warmup = warmup
+
+        self.analyzer = None
+        self.status = LOADING
+        self.error: Optional[BaseException] = None
+        self.load_seconds = None
+        self.warmup_seconds = None
+
+        self._ready = threading.Event()
+        self._thread = None
+
+    def __getattr__(self, name):
+        analyzer = self.__dict__.get("analyzer")
+        if analyzer is None:
+            raise AttributeError(name)
+        return getattr(analyzer, name)
+
+    def start(self) -> "BackgroundAnalyzer":
+        """Start loading in a daemon thread."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._load, name="model-loader", daemon=True)
+            self._thread.start()
+        return self
+
+    @property
+    def is_ready(self) -> bool:
+        """Whether the analyzer is loaded and warmed up."""
+        return self.status == READY
+
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        """
+        Block until loading finished (successfully or not).
+
+        Args:
+            timeout: Maximum seconds to wait, None to wait forever
+
+        Returns:
+            True if loading finished within the timeout
+        """
+        return self._ready.wait(timeout)
+
+    def get_readiness(self) -> Dict:
+        """
+        Get the loading state for the readiness probe.
+
+        Returns:
+            Dictionary with status, ready flag, load and warm-up durations and error
+        """
+        return {
+            "status": self.status,
+            "ready": self.is_ready,
+            "load_seconds": self.load_seconds,
+            "warmup_seconds": self.warmup_seconds,
+            "error": str(self.error) if self.error else None
+        }
+
+    def generate_response(
+        self,
+        conversation: List[Dict[str, str]],
+        max_tokens: int = MAX_NEW_TOKENS,
+        **kwargs
+    ) -> str:
+        """Generate a response, waiting for the model if it is still loading."""
+        return self._loaded_analyzer().generate_response(conversation, max_tokens=max_tokens, **kwargs)
+
+    def generate_response_stream(
+        self,
+        conversation: List[Dict[str, str]],
+        max_tokens: int = MAX_NEW_TOKENS,
+        **kwargs
+    ) -> Iterator[str]:
+        """Stream a response, waiting for the model if it is still loading."""
+        return self._loaded_analyzer().generate_response_stream(conversation, max_tokens=max_tokens, **kwargs)
+
+    def cleanup_model(self):
+        """Free the loaded model, if any."""
+        if self.analyzer is not None:
+            self.analyzer.cleanup_model()
+
+    def _loaded_analyzer(self):
+        if not self._ready.is_set():
+            QUEUE_DEPTH.inc()
+            try:
+                self._ready.wait()
+            finally:
+                QUEUE_DEPTH.dec()
+        if self.analyzer is None:
+            raise RuntimeError(f"Model failed to load: {self.error}")
+        return self.analyzer
+
+    def _load(self):
+        """Load, then warm up, the analyzer."""
+        try:
+            start = time.perf_counter()
+            analyzer = self.factory()
+            self.load_seconds = time.perf_counter() - start
+            print(f"✓ Model created in {self.load_seconds:.1f}s")
+
+            if self.warmup:
+                self.status = WARMING_UP
+                start = time.perf_counter()
+                warm_up_analyzer(analyzer)
+                self.warmup_seconds = time.perf_counter() - start
+                print(f"✓ Model warmed up in {self.warmup_seconds:.1f}s")
+
+            self.analyzer = analyzer
+            self.status = READY
+        except Exception as e:
+            self.error = e
+            self.status = FAILED
+            print(f"❌ Model loading failed: {e}")
+        finally:
+            self._ready.set()
@@ -0,0 +1,463 @@
+"""
+Continuous-batching scheduler for the transformers backend.
+
+All Gradio sessions share one analyzer. Instead of running one
+model.generate() per request, the scheduler keeps a single decode batch:
+requests join it as soon as their prompt is prefilled and leave it as soon
+as they finish, so every forward pass advances all in-flight requests by
+one token.
+
+Rows decode without generate(): the grammar constraint is applied to each
+row here, while static KV caches and prompt-lookup drafting, which need a
+generate() call per request, are not used.
+"""
+import queue
+import threading
+import time
+from typing import List, Dict, Iterator, Optional
+
+import torch
+import torch.nn.functional as F
+from transformers import DynamicCache
+
+from .generation_limits import MAX_NEW_TOKENS, AnswerBlockWatcher
+from .grammar_constraint import MermaidGrammarLogitsProcessor
+from .kv_cache import cache_tensors, cache_from_tensors
+from ..utils.metrics import QUEUE_DEPTH, REQUEST_STAGE_SECONDS
+
+
+# Sentinel closing a request's chunk queue
+_DONE = object()
+
+
+class _Request:
+    """State of one in-flight generation request."""
+
+    __slots__ = (
+        "input_ids", "max_tokens", "session_id", "chunks", "cancelled", "terminated",
+        "generated", "prefix_offset", "read_offset", "block", "next_token", "length", "layers", "prefilled_at",
+        "grammar"
+    )
+
+    def __init__(
+        self,
+        input_ids: torch.Tensor,
+        max_tokens: int,
+        session_id: Optional[str],
+        grammar: Optional[MermaidGrammarLogitsProcessor] = None
+    ):
+        self.input_ids = input_ids
+        self.max_tokens = max_tokens
+        self.session_id = session_id
+        self.chunks = queue.Queue()
+        self.cancelled = threading.Event()
+        self.terminated = False  # _DONE or an error was queued
+        self.generated = []
+        # Incremental detokenization: generated[prefix_offset:read_offset] is
+        # already streamed and only gives the context for decoding the rest
+        self.prefix_offset = 0
+        self.read_offset = 0
+        self.block = AnswerBlockWatcher()
+        self.next_token = None  # Sampled token not yet fed to the model
+        self.length = 0  # Tokens held in the KV cache
+        self.layers = None  # Per-layer (keys, values) while outside the batch
+        self.prefilled_at = None  # perf_counter() when the first token was sampled
+        self.grammar = grammar  # Constraint on the ```mermaid``` block, if enabled
+
+
+class ContinuousBatchScheduler:
+    """
+    Token-level batching front-end for a MistralTextAnalyzer.
+
+    Exposes the same generate_response / generate_response_stream interface
+    as the analyzers, so it can be handed to the UI in their place. A single
+    worker thread owns the model: it prefills newly arrived requests, merges
+    their KV caches into the running batch (left-padded to a common length)
+    and decodes all rows greedily, one token per forward pass. The batch is
+    only re-packed when a request joins or leaves.
+    """
+
+    def __init__(self, analyzer, max_batch_size: int = 8):
+        """
+        Initialize the scheduler.
+
+        Args:
+            analyzer: MistralTextAnalyzer instance (model and tokenizer loaded)
+            max_batch_size: Maximum number of requests decoded together
+        """
+        self.analyzer = analyzer
+        self.max_batch_size = max_batch_size
+        self.eos_token_ids = self._eos_token_ids(analyzer)
+
+        self._pending = queue.Queue()
+        self._rows: List[_Request] = []
+        self._batch = None  # DynamicCache of the running batch
+        self._mask = None  # Attention mask [rows, cached tokens] of the running batch
+        self._worker = None
+        self._worker_lock = threading.Lock()
+
+        self.steps = 0
+        self.decoded_tokens = 0
+        self.completed = 0
+
+    def __getattr__(self, name):
+        # Everything else (model_name, cache stats, cleanup_model...) is the analyzer's
+        if name == "analyzer":
+            raise AttributeError(name)
+        return getattr(self.analyzer, name)
+
+    def generate_response(
+        self,
+        conversation: List[Dict[str, str]],
+        max_tokens: int = MAX_NEW_TOKENS,
+        session_id: Optional[str] = None,
+        prompt_lookup: bool = False
+    ) -> str:
+        """
+        Generate response from conversation history.
+
+        Args:
+            conversation: List of conversation messages with 'role' and 'content'
+            max_tokens: Maximum tokens to generate
+            session_id: Optional session identifier, enables KV-cache reuse across turns
+            prompt_lookup: Ignored, every row of the shared batch decodes one token per step
+
+        Returns:
+            Generated response text
+        """
+        return "".join(self.generate_response_stream(conversation, max_tokens, session_id, prompt_lookup)).strip()
+
+    def generate_response_stream(
+        self,
+        conversation: List[Dict[str, str]],
+        max_tokens: int = MAX_NEW_TOKENS,
+        session_id: Optional[str] = None,
+        prompt_lookup: bool = False
+    ) -> Iterator[str]:
+        """
+        Queue a request for the shared decode batch and stream its text chunks.
+
+        Args:
+            conversation: List of conversation messages with 'role' and 'content'
+            max_tokens: Maximum tokens to generate
+            session_id: Optional session identifier, enables KV-cache reuse across turns
+            prompt_lookup: Ignored, every row of the shared batch decodes one token per step
+
+        Yields:
+            Newly decoded text chunks, in order
+        """
+        inputs = self.analyzer.prepare_inputs(conversation)
+        grammar = None
+        if self.analyzer.constrained_decoding:
+            # Fed the generated tokens only, hence no prompt length
+            grammar = MermaidGrammarLogitsProcessor(self.analyzer.tokenizer, 0, self.analyzer.token_pieces)
+        request = _Request(inputs["input_ids"][0], max_tokens, session_id, grammar)
+
+        self._ensure_worker()
+        self._pending.put(request)
+        QUEUE_DEPTH.inc()
+
+        try:
+            while True:
+                chunk = request.chunks.get()
+                if chunk is _DONE:
+                    break
+                if isinstance(chunk, Exception):
+                    raise chunk
+                yield chunk
+        finally:
+            # Lets the worker drop the row if the consumer stopped early
+            request.cancelled.set()
+
+    def get_scheduler_stats(self) -> Dict:
+        """
+        Get batching counters.
+
+        Returns:
+            Dictionary with active and pending requests, decode steps and mean batch size
+        """
+        return {
+            "active": len(self._rows),
+            "pending": self._pending.qsize(),
+            "steps": self.steps,
+            "decoded_tokens": self.decoded_tokens,
+            "mean_batch_size": self.decoded_tokens / self.steps if self.steps else 0.0,
+            "completed": self.completed
+        }
+
+    def _ensure_worker(self):
+        """Start the decode loop on first use."""
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        """Decode loop: admit new requests, then advance the batch by one token."""
+        while True:
+            joined = self._admit()
+
+            try:
+                if joined:
+                    self._repack(self._rows + joined)
+                if self._rows:
+                    self._step()
+            except Exception as e:
+                # A failure in _repack() can leave a request in both lists
+                for request in dict.fromkeys(self._rows + joined):
+                    self._terminate(request, e)
+                self._rows = []
+                self._batch = None
+                self._mask = None
+
+    def _admit(self) -> List[_Request]:
+        """
+        Prefill pending requests while the batch has room.
+
+        Blocks when nothing is running, so an idle scheduler costs nothing.
+
+        Returns:
+            Prefilled requests ready to join the batch
+        """
+        joined = []
+
+        while len(self._rows) + len(joined) < self.max_batch_size:
+            idle = not self._rows and not joined
+            try:
+                request = self._pending.get(block=idle)
+            except queue.Empty:
+                break
+            QUEUE_DEPTH.dec()
+
+            if request.cancelled.is_set():
+                self._terminate(request, _DONE)
+                continue
+
+            try:
+                finished = self._prefill(request)
+            except Exception as e:
+                self._terminate(request, e)
+                continue
+
+            if finished:
+                self._finish(request)
+            else:
+                joined.append(request)
+
+        return joined
+
+    def _prefill(self, request: _Request) -> bool:
+        """
+        Run the prompt of a single request and sample its first token.
+
+        Args:
+            request: Newly admitted request
+
+        Returns:
+            True if the request is already finished
+        """
+        model = self.analyzer.model
+        cache = self.analyzer.lookup_cache(request.input_ids, request.session_id)
+        if cache is None:
+            cache = DynamicCache()
+
+        cached_length = cache.get_seq_length()
+        with REQUEST_STAGE_SECONDS.timer(stage="prefill"), torch.no_grad():
+            outputs = model(
+                input_ids=request.input_ids[cached_length:].unsqueeze(0),
+                past_key_values=cache,
+                use_cache=True
+            )
+        request.prefilled_at = time.perf_counter()
+
+        request.layers = cache_tensors(cache)
+        request.length = request.input_ids.shape[0]
+        return self._accept(request, self._sample(request, outputs.logits[0, -1]))
+
+    def _step(self):
+        """Feed every row its last sampled token and sample the next one."""
+        model = self.analyzer.model
+        device = self._mask.device
+        rows = self._rows
+
+        input_ids = torch.tensor([[request.next_token] for request in rows], device=device)
+        position_ids = torch.tensor([[request.length] for request in rows], device=device)
+        cache_position = torch.tensor([self._mask.shape[1]], device=device)
+        self._mask = torch.cat([self._mask, self._mask.new_ones(len(rows), 1)], dim=1)
+
+        with torch.no_grad():
+            outputs = model(
+                input_ids=input_ids,
+                attention_mask=self._mask,
+                position_ids=position_ids,
+                cache_position=cache_position,
+                past_key_values=self._batch,
+                use_cache=True
+            )
+
+        self.steps += 1
+        self.decoded_tokens += len(rows)
+
+        next_tokens = [self._sample(request, logits) for request, logits in zip(rows, outputs.logits[:, -1])]
+        finished = []
+        for request, token in zip(rows, next_tokens):
+            request.length += 1
+            if self._accept(request, token):
+                finished.append(request)
+
+        if finished:
+            self._repack([request for request in rows if request not in finished], finished)
+
+    @staticmethod
+    def _sample(request: _Request, logits: torch.Tensor) -> int:
+        """
+        Pick a row's next token greedily, within the grammar when it is enabled.
+
+        Args:
+            request: Request the logits belong to
+            logits: Next-token logits of the row
+
+        Returns:
+            Sampled token id
+        """
+        if request.grammar is not None:
+            generated = torch.tensor([request.generated], dtype=torch.long)
+            logits = request.grammar(generated, logits.unsqueeze(0).clone())[0]
+        return int(logits.argmax())
+
+    def _accept(self, request: _Request, token: int) -> bool:
+        """
+        Record a sampled token and stream the newly decodable text.
+
+        Args:
+            request: Request the token belongs to
+            token: Sampled token id
+
+        Returns:
+            True if the request is finished
+        """
+        request.generated.append(token)
+        request.next_token = token
+
+        delta = self._decode_delta(request)
+        if delta:
+            request.chunks.put(delta)
+
+        return (
+            token in self.eos_token_ids
+            or len(request.generated) >= request.max_tokens
+            or (bool(delta) and request.block.feed(delta))
+            or request.cancelled.is_set()
+        )
+
+    def _decode_delta(self, request: _Request) -> str:
+        """
+        Text added by the tokens not streamed yet.
+
+        Only the last few tokens are decoded, with the previously streamed
+        ones as context (a token's leading space depends on its neighbour).
+
+        Returns:
+            New text, empty while it ends with an incomplete multi-byte character
+        """
+        tokenizer = self.analyzer.tokenizer
+        tokens = request.generated
+        context = tokenizer.decode(tokens[request.prefix_offset:request.read_offset], skip_special_tokens=True)
+        text = tokenizer.decode(tokens[request.prefix_offset:], skip_special_tokens=True)
+        if len(text) <= len(context) or text.endswith("\ufffd"):
+            return ""
+        request.prefix_offset = request.read_offset
+        request.read_offset = len(tokens)
+        return text[len(context):]
+
+    @staticmethod
+    def _eos_token_ids(analyzer) -> set:
+        """End-of-sequence token ids of the analyzer's model."""
+        eos = analyzer.model.generation_config.eos_token_id
+        if eos is None:
+            eos = analyzer.tokenizer.eos_token_id
+        return set(eos) if isinstance(eos, (list, tuple)) else {eos}
+
+    def _repack(self, rows: List[_Request], finished: List[_Request] = ()):
+        """
+        Rebuild the batch for a new set of rows.
+
+        Args:
+            rows: Requests that make up the new batch (running and joining)
+            finished: Requests leaving the batch
+        """
+        # Unpack the running batch into per-request caches, dropping left padding
+        if self._batch is not None:
+            total = self._mask.shape[1]
+            batch_layers = cache_tensors(self._batch)
+            for i, request in enumerate(self._rows):
+                start = total - request.length
+                request.layers = [
+                    (keys[i:i + 1, :, start:], values[i:i + 1, :, start:])
+                    for keys, values in batch_layers
+                ]
+
+        for request in finished:
+            self._finish(request)
+
+        self._rows = list(rows)
+        if not rows:
+            self._batch = None
+            self._mask = None
+            return
+
+        longest = max(request.length for request in rows)
+        layers = []
+        for layer_idx in range(len(rows[0].layers)):
+            keys = torch.cat([
+                F.pad(request.layers[layer_idx][0], (0, 0, longest - request.length, 0))
+                for request in rows
+            ])
+            values = torch.cat([
+                F.pad(request.layers[layer_idx][1], (0, 0, longest - request.length, 0))
+                for request in rows
+            ])
+            layers.append((keys, values))
+
+        device = layers[0][0].device
+        self._mask = torch.stack([
+            torch.cat([
+                torch.zeros(longest - request.length, dtype=torch.long, device=device),
+                torch.ones(request.length, dtype=torch.long, device=device)
+            ])
+            for request in rows
+        ])
+        self._batch = cache_from_tensors(layers)
+
+        for request in rows:
+            request.layers = None
+
+    def _finish(self, request: _Request):
+        """
+        Close a request, keeping its KV cache for the session's next turn.
+
+        Args:
+            request: Finished request
+        """
+        if request.session_id is not None and request.layers is not None and not request.cancelled.is_set():
+            # Copy out of the batch tensors so they can be freed
+            cache = cache_from_tensors([(keys.clone(), values.clone()) for keys, values in request.layers])
+            token_ids = torch.cat([
+                request.input_ids,
+                torch.tensor(request.generated, dtype=request.input_ids.dtype, device=request.input_ids.device)
+            ])
+            self.analyzer.store_session_cache(request.session_id, token_ids, cache)
+
+        if request.prefilled_at is not None:
+            REQUEST_STAGE_SECONDS.observe(time.perf_counter() - request.prefilled_at, stage="decode")
+
+        request.layers = None
+        self._terminate(request, _DONE)
+        self.completed += 1
+
+    @staticmethod
+    def _terminate(request: _Request, item):
+        """Queue the last item of a request (_DONE or an error), once."""
+        if not request.terminated:
+            request.terminated = True
+            request.chunks.put(item)
@@ -0,0 +1,96 @@
+"""
+Per-session record of the conversation the model actually saw.
+
+The chat shows short display messages and cleaned answers, while the model
+was given full prompts and produced raw answers. Building the next turn
+from the display history makes its tokens differ from the session's cached
+KV entries right after the first message, so almost nothing is reused.
+Replaying the recorded prompts and raw answers instead keeps the previous
+turn a token-level prefix of the next one.
+"""
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+
+# Sessions whose history is kept
+HISTORY_SESSIONS = 256
+
+# Exchanges replayed before the history restarts from the last one (every
+# prompt repeats the board and the diagram, so a long history mostly grows prefill)
+MAX_HISTORY_EXCHANGES = 4
+
+
+class ConversationHistory:
+    """
+    LLM-side conversations by session.
+
+    Usage:
+        history = ConversationHistory()
+        messages = history.get(session_id, len(conversation)) or display_messages
+        ...
+        history.record(session_id, len(conversation), messages + [prompt, answer])
+    """
+
+    def __init__(self, max_sessions: int = HISTORY_SESSIONS, max_exchanges: int = MAX_HISTORY_EXCHANGES):
+        """
+        Initialize an empty history.
+
+        Args:
+            max_sessions: Sessions kept, least recently used are dropped
+            max_exchanges: User/assistant exchanges replayed per session
+        """
+        self.max_sessions = max_sessions
+        self.max_exchanges = max_exchanges
+        self._entries = OrderedDict()  # session_id -> (display messages, LLM messages)
+        self._lock = threading.Lock()
+
+    def get(self, session_id: Optional[str], display_length: int) -> Optional[List[Dict[str, str]]]:
+        """
+        Get the messages the model saw for a session's displayed conversation.
+
+        Args:
+            session_id: Session identifier
+            display_length: Number of messages in the displayed conversation;
+                a different count (cleared chat, other tab) invalidates the record
+
+        Returns:
+            Copy of the recorded messages, or None if there is no matching record
+        """
+        if session_id is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None or entry[0] != display_length:
+                return None
+            self._entries.move_to_end(session_id)
+            return list(entry[1])
+
+    def record(self, session_id: Optional[str], display_length: int, messages: List[Dict[str, str]]):
+        """
+        Store the messages of a finished turn.
+
+        Args:
+            session_id: Session identifier
+            display_length: Number of messages in the displayed conversation after the turn
+            messages: Messages the model saw, its last answer included
+        """
+        if session_id is None or self.max_sessions <= 0:
+            return
+        if len(messages) > 2 * self.max_exchanges:
+            # Restart from the last exchange: one turn misses the session cache,
+            # the following ones extend the new history again
+            messages = messages[-2:]
+        with self._lock:
+            self._entries[session_id] = (display_length, list(messages))
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self.max_sessions:
+                self._entries.popitem(last=False)
+
+    def clear(self, session_id: Optional[str] = None):
+        """Forget one session, or every session."""
+        with self._lock:
+            if session_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(session_id, None)
@@ -0,0 +1,141 @@
+"""
+Generation budget helpers.
+
+The prompts ask for a single ```mermaid``` block (or ```edits``` block in
+edit mode), so everything generated after its closing fence is discarded. These
+helpers size max_new_tokens from the expected diagram size and detect the
+end of the block so decoding can stop there.
+"""
+import re
+from typing import Dict, Optional
+
+
+# Hard ceiling kept from the original fixed budget
+MAX_NEW_TOKENS = 4000
+MIN_NEW_TOKENS = 512
+
+# Mermaid with French labels, <br/> tags and emojis averages ~3 chars per token
+CHARS_PER_TOKEN = 3
+
+# Initial diagrams: fixed cost (header, Légende, style lines) plus per PVB entry
+INITIAL_BASE_TOKENS = 768
+TOKENS_PER_PVB_ITEM = 160
+
+# Refinements may grow the diagram ("plus de détails"), leave room for that
+REFINEMENT_GROWTH = 2.0
+REFINEMENT_MARGIN_TOKENS = 256
+
+# Edit-mode refinements only list the changes
+EDIT_MAX_NEW_TOKENS = 512
+
+# Targeted repairs only rewrite a few lines around a syntax error
+REPAIR_MAX_NEW_TOKENS = 384
+
+MERMAID_OPEN_FENCE = "```mermaid"
+EDITS_OPEN_FENCE = "```edits"
+ANSWER_OPEN_FENCES = (MERMAID_OPEN_FENCE, EDITS_OPEN_FENCE)
+MERMAID_CLOSE_FENCE_PATTERN = re.compile(r"\r?\n[ \t]*```")
+
+
+def estimate_max_new_tokens(
+    current_diagram: Optional[str] = None,
+    pvb_data: Optional[Dict] = None
+) -> int:
+    """
+    Size the generation budget for a request.
+
+    Refinements are sized from the diagram being edited, initial requests
+    from the number of Product Vision Board entries.
+
+    Args:
+        current_diagram: Diagram being refined, if any
+        pvb_data: Product Vision Board of an initial request, if any
+
+    Returns:
+        max_new_tokens to use, between MIN_NEW_TOKENS and MAX_NEW_TOKENS
+    """
+    if current_diagram:
+        diagram_tokens = len(current_diagram) / CHARS_PER_TOKEN
+        estimate = diagram_tokens * REFINEMENT_GROWTH + REFINEMENT_MARGIN_TOKENS
+    elif pvb_data:
+        items = sum(len(value) if isinstance(value, list) else 1 for value in pvb_data.values())
+        estimate = INITIAL_BASE_TOKENS + TOKENS_PER_PVB_ITEM * items
+    else:
+        return MAX_NEW_TOKENS
+
+    return int(min(MAX_NEW_TOKENS, max(MIN_NEW_TOKENS, estimate)))
+
+
+def find_mermaid_block_end(text: str) -> int:
+    """
+    Find where the first ```mermaid``` (or ```edits```) block of a response closes.
+
+    Args:
+        text: Response text (possibly partial)
+
+    Returns:
+        Index just after the closing fence, or -1 if the block is not closed yet
+    """
+    starts = [(text.find(fence), fence) for fence in ANSWER_OPEN_FENCES if fence in text]
+    if not starts:
+        return -1
+
+    start, fence = min(starts)
+    match = MERMAID_CLOSE_FENCE_PATTERN.search(text, start + len(fence))
+    return match.end() if match else -1
+
+
+def has_closed_mermaid_block(text: str) -> bool:
+    """Whether a response already contains a complete ```mermaid``` (or ```edits```) block."""
+    return find_mermaid_block_end(text) != -1
+
+
+
+class AnswerBlockWatcher:
+    """
+    Detect the end of the ```mermaid``` (or ```edits```) block of a streamed text.
+
+    Equivalent to has_closed_mermaid_block() on the concatenated chunks, but
+    only the new chunk and the line it continues are scanned, so following
+    a long answer token by token stays linear.
+    """
+
+    __slots__ = ("_opened", "_tail", "closed")
+
+    # An opening fence may straddle two chunks
+    _OVERLAP = max(len(fence) for fence in ANSWER_OPEN_FENCES) - 1
+
+    def __init__(self):
+        self._opened = False
+        self._tail = ""  # End of the text fed so far that a fence may continue
+        self.closed = False
+
+    def feed(self, chunk: str) -> bool:
+        """
+        Scan newly generated text.
+
+        Args:
+            chunk: Text following what was fed so far
+
+        Returns:
+            True once the block has been closed
+        """
+        if self.closed:
+            return True
+        text = self._tail + chunk
+
+        if not self._opened:
+            starts = [(text.find(fence), fence) for fence in ANSWER_OPEN_FENCES]
+            starts = [(index, fence) for index, fence in starts if index != -1]
+            if not starts:
+                self._tail = text[-self._OVERLAP:]
+                return False
+            index, fence = min(starts)
+            self._opened = True
+            text = text[index + len(fence):]
+
+        self.closed = MERMAID_CLOSE_FENCE_PATTERN.search(text) is not None
+        # Keep the line being written, a closing fence may follow on it
+        newline = text.rfind("\n")
+        self._tail = text[newline:] if newline != -1 else text
+        return self.closed
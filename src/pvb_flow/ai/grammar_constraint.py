@@ -0,0 +1,284 @@
+"""
+Grammar-constrained decoding for transformers generate().
+
+Inside the ```mermaid``` block of the answer, candidate tokens that would
+make the current line invalid flowchart syntax are masked out, so the
+model cannot emit a diagram that fails to render.
+"""
+from typing import List, Optional
+
+import torch
+from transformers import LogitsProcessor
+
+from .generation_limits import MERMAID_OPEN_FENCE
+from ..core.mermaid_grammar import COMPLETE, INVALID, FlowchartGrammarState, is_fence_prefix
+from ..utils.metrics import REGISTRY
+
+
+GRAMMAR_FALLBACKS = REGISTRY.counter(
+    "pvb_grammar_fallbacks_total", "Decoding steps left unconstrained because no candidate token fits the grammar"
+)
+
+
+class TokenPieces:
+    """
+    Text each vocabulary token adds after other tokens, decoded once per tokenizer.
+
+    Tokens are decoded after an anchor token so that leading spaces are kept
+    (SentencePiece drops them at the start of a text). Byte-fallback tokens
+    give "\ufffd": the bytes of one character only decode together.
+    """
+
+    def __init__(self, tokenizer):
+        """
+        Decode the vocabulary.
+
+        Args:
+            tokenizer: Tokenizer of the model
+        """
+        self.tokenizer = tokenizer
+        self.anchor_ids = tokenizer.encode("\n", add_special_tokens=False)[-1:]
+        self.anchor = tokenizer.decode(self.anchor_ids, skip_special_tokens=True)
+        token_ids = range(len(tokenizer))
+        texts = tokenizer.batch_decode([self.anchor_ids + [token_id] for token_id in token_ids], skip_special_tokens=True)
+        self.pieces = [
+            text[len(self.anchor):] if text.startswith(self.anchor)
+            else tokenizer.decode([token_id], skip_special_tokens=True)
+            for token_id, text in zip(token_ids, texts)
+        ]
+
+    def __getitem__(self, token_id: int) -> str:
+        # Ids past the tokenizer (padded embedding rows) have no text
+        return self.pieces[token_id] if token_id < len(self.pieces) else ""
+
+    def complete(self, token_id: int) -> bool:
+        """Whether the token's text stands on its own (not part of a multi-byte character)."""
+        return "\ufffd" not in self[token_id]
+
+    def decode(self, token_ids: List[int]) -> str:
+        """Text of consecutive tokens, as it would follow other tokens."""
+        text = self.tokenizer.decode(self.anchor_ids + token_ids, skip_special_tokens=True)
+        return text[len(self.anchor):] if text.startswith(self.anchor) else text
+
+
+class _RowState:
+    """Grammar progress of one generated sequence, updated token by token."""
+
+    __slots__ = (
+        "tokens", "marks", "read_offset", "text", "scanned",
+        "block_start", "line_start", "grammar", "closed"
+    )
+
+    def __init__(self):
+        self.tokens = []  # Generated token ids seen so far
+        # (read_offset, len(text)) after each decoded delta, to roll back to
+        self.marks = []
+        # tokens[:read_offset] are in text, the rest end mid-character
+        self.read_offset = 0
+        self.text = ""
+        self.scanned = 0  # Offset up to which the opening fence was looked for
+        self.reset_grammar()
+
+    def reset_grammar(self):
+        self.block_start = -1  # Offset of the first diagram line, -1 before the fence
+        self.line_start = -1  # Offset of the line being generated
+        self.grammar = FlowchartGrammarState()
+        self.closed = False
+
+
+class MermaidGrammarLogitsProcessor(LogitsProcessor):
+    """
+    Restrict the ```mermaid``` block to the flowchart grammar.
+
+    The TOP_K best candidates are checked at each step and the others are
+    masked. When none of them is valid, the following candidates (up to
+    MAX_CANDIDATES) are checked too, and if there is still no valid one the
+    scores are left untouched rather than leaving the row without a legal
+    token (counted in fallback_steps and pvb_grammar_fallbacks_total). Text
+    outside the block is left unconstrained.
+
+    Each row keeps its text and grammar state, extended with the text of
+    the new tokens, and candidates are checked with their precomputed text:
+    the tokenizer only decodes the bytes of multi-byte characters.
+    """
+
+    TOP_K = 24
+    MAX_CANDIDATES = 96
+
+    # Recent tokens compared with the previous call: assisted decoding
+    # (prompt lookup) rolls back the draft tokens it rejects
+    ROLLBACK_TOKENS = 32
+
+    def __init__(self, tokenizer, prompt_length: int, token_pieces: Optional[TokenPieces] = None):
+        """
+        Initialize the processor.
+
+        Args:
+            tokenizer: Tokenizer used to decode generated tokens
+            prompt_length: Number of prompt tokens at the start of input_ids
+            token_pieces: Decoded vocabulary of the tokenizer, built here if
+                not given (keep one per model, decoding it takes a moment)
+        """
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.token_pieces = token_pieces if token_pieces is not None else TokenPieces(tokenizer)
+        self._rows = {}  # row -> _RowState
+        self.masked_steps = 0
+        self.fallback_steps = 0
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        for row in range(input_ids.shape[0]):
+            self._constrain_row(row, input_ids[row], scores[row])
+        return scores
+
+    def _constrain_row(self, row: int, ids: torch.LongTensor, scores: torch.FloatTensor):
+        state = self._update_state(row, ids[self.prompt_length:])
+        # Also while a multi-byte character is incomplete: it cannot be judged yet
+        if state.block_start == -1 or state.closed or state.read_offset < len(state.tokens):
+            return
+
+        partial_line = state.text[state.line_start:]
+        candidates = torch.topk(scores, min(self.MAX_CANDIDATES, scores.shape[0])).indices.tolist()
+        allowed = []
+        for index, token_id in enumerate(candidates):
+            if allowed and index >= self.TOP_K:
+                break
+            if self._is_viable(state.grammar, partial_line + self.token_pieces[token_id]):
+                allowed.append(token_id)
+
+        if not allowed:
+            self.fallback_steps += 1
+            GRAMMAR_FALLBACKS.inc()
+            return
+        if len(allowed) == scores.shape[0]:
+            return
+
+        kept = scores[allowed].clone()
+        scores.fill_(-float("inf"))
+        scores[allowed] = kept
+        self.masked_steps += 1
+
+    def _update_state(self, row: int, generated: torch.LongTensor) -> _RowState:
+        """
+        Bring a row's text and grammar state up to date with its tokens.
+
+        Args:
+            row: Batch row
+            generated: Tokens generated for the row so far
+
+        Returns:
+            Up-to-date row state
+        """
+        state = self._rows.get(row)
+        if state is None:
+            state = self._rows[row] = _RowState()
+
+        length = generated.shape[0]
+        known = len(state.tokens)
+        overlap = min(length, known)
+        start = max(0, overlap - self.ROLLBACK_TOKENS)
+        recent = generated[start:overlap].tolist()
+        keep = start
+        while keep < overlap and recent[keep - start] == state.tokens[keep]:
+            keep += 1
+        if keep < known:
+            if keep == start and start > 0:
+                # Rolled back further than the compared tokens: start over
+                state = self._rows[row] = _RowState()
+                keep = 0
+            else:
+                self._roll_back(state, keep)
+        state.tokens.extend(generated[keep:].tolist())
+
+        self._decode_new_tokens(state)
+        self._advance_lines(state)
+        return state
+
+    def _roll_back(self, state: _RowState, keep: int):
+        """Forget the tokens after the first `keep` ones."""
+        del state.tokens[keep:]
+        while state.marks and state.marks[-1][0] > keep:
+            state.marks.pop()
+        state.read_offset, text_length = state.marks[-1] if state.marks else (0, 0)
+        state.text = state.text[:text_length]
+        state.scanned = min(state.scanned, text_length)
+        if text_length < state.line_start:
+            # Completed lines were removed: check the block again from its start
+            state.reset_grammar()
+
+    def _decode_new_tokens(self, state: _RowState):
+        """Append the text of the tokens not decoded yet (held back while it ends mid-character)."""
+        pieces = self.token_pieces
+        while state.read_offset < len(state.tokens):
+            token_id = state.tokens[state.read_offset]
+            if pieces.complete(token_id):
+                state.text += pieces[token_id]
+                state.read_offset += 1
+            else:
+                # Bytes of a multi-byte character: decode them together once complete
+                end = state.read_offset + 1
+                while end < len(state.tokens) and not pieces.complete(state.tokens[end]):
+                    end += 1
+                text = pieces.decode(state.tokens[state.read_offset:end])
+                if text.endswith("\ufffd") and end == len(state.tokens):
+                    return
+                state.text += text
+                state.read_offset = end
+            state.marks.append((state.read_offset, len(state.text)))
+
+    @staticmethod
+    def _advance_lines(state: _RowState):
+        """Feed the grammar the diagram lines completed since the last step."""
+        text = state.text
+        if state.block_start == -1:
+            fence = text.find(MERMAID_OPEN_FENCE, max(0, state.scanned - len(MERMAID_OPEN_FENCE)))
+            if fence == -1:
+                state.scanned = len(text)
+                return
+            state.scanned = fence
+            newline = text.find("\n", fence + len(MERMAID_OPEN_FENCE))
+            if newline == -1:
+                return
+            state.block_start = state.line_start = newline + 1
+
+        while not state.closed:
+            newline = text.find("\n", state.line_start)
+            if newline == -1:
+                break
+            line = text[state.line_start:newline].rstrip("\r")
+            if is_fence_prefix(line):
+                state.closed = True
+            else:
+                state.grammar.advance(line)
+            state.line_start = newline + 1
+
+    @staticmethod
+    def _is_viable(grammar: FlowchartGrammarState, text: str) -> bool:
+        """
+        Whether the text of the current line plus a candidate can still be valid.
+
+        Args:
+            grammar: State before the current line
+            text: Current line followed by the candidate's text
+
+        Returns:
+            True if the candidate keeps the diagram valid
+        """
+        # Incomplete multi-byte characters (emojis) cannot be judged yet
+        if text.endswith("\ufffd"):
+            return True
+
+        grammar = grammar.copy()
+        lines = text.split("\n")
+        for line in lines[:-1]:
+            line = line.rstrip("\r")
+            if is_fence_prefix(line):
+                return line.strip() == "```" and grammar.can_close()
+            if grammar.check(line)[0] != COMPLETE:
+                return False
+            grammar.advance(line)
+
+        last_line = lines[-1]
+        if is_fence_prefix(last_line):
+            return grammar.can_close()
+        return grammar.check(last_line)[0] != INVALID
@@ -0,0 +1,178 @@
+"""
+Unload the model when the instance is idle, reload it on the next request.
+
+A 24B model held overnight without traffic blocks memory other workloads
+could use. The watchdog frees it through cleanup_model() after a period
+without requests; the next request reloads it (from the local snapshot,
+so without Hub round-trips) before generating.
+"""
+import threading
+import time
+from typing import Dict, Iterator, List, Optional
+
+from .generation_limits import MAX_NEW_TOKENS
+from ..utils.metrics import QUEUE_DEPTH, REGISTRY
+
+
+MODEL_LOADED = REGISTRY.gauge(
+    "pvb_model_loaded", "Whether the model is in memory (idle watchdog)"
+)
+MODEL_UNLOADS = REGISTRY.counter(
+    "pvb_model_unloads_total", "Models unloaded after an idle period"
+)
+MODEL_RELOADS = REGISTRY.counter(
+    "pvb_model_reloads_total", "Models reloaded by a request after an idle unload"
+)
+MODEL_UNLOAD_SECONDS = REGISTRY.histogram(
+    "pvb_model_unload_seconds", "Time to free the model"
+)
+MODEL_RELOAD_SECONDS = REGISTRY.histogram(
+    "pvb_model_reload_seconds", "Time to reload the model, paid by the first request after an unload"
+)
+
+
+class IdleUnloadWatchdog:
+    """
+    Analyzer wrapper that frees the model after `idle_timeout` seconds without traffic.
+
+    Generation calls count as traffic for their whole duration, so a model
+    is never unloaded mid-generation. Analyzers providing reload_model()
+    (transformers, MLX) are reloaded explicitly; others, such as an
+    AnalyzerPool, reload by themselves on their next request.
+    """
+
+    def __init__(self, analyzer, idle_timeout: float, check_interval: Optional[float] = None):
+        """
+        Initialize the watchdog and start its thread.
+
+        Args:
+            analyzer: Analyzer to manage
+            idle_timeout: Seconds without requests before unloading
+            check_interval: Seconds between idle checks (default: a tenth of
+                the timeout, at most a minute)
+        """
+        self.analyzer = analyzer
+        self.idle_timeout = idle_timeout
+        self.check_interval = check_interval or min(60.0, idle_timeout / 10)
+
+        self.loaded = True
+        self._in_flight = 0
+        self._last_activity = time.monotonic()
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        MODEL_LOADED.set(1)
+
+        self._thread = threading.Thread(target=self._watch, name="idle-watchdog", daemon=True)
+        self._thread.start()
+
+    def __getattr__(self, name):
+        if name == "analyzer":
+            raise AttributeError(name)
+        return getattr(self.analyzer, name)
+
+    def generate_response(
+        self,
+        conversation: List[Dict[str, str]],
+        max_tokens: int = MAX_NEW_TOKENS,
+        **kwargs
+    ) -> str:
+        """Generate a response, reloading the model first if it was unloaded."""
+        self._begin_request()
+        try:
+            return self.analyzer.generate_response(conversation, max_tokens=max_tokens, **kwargs)
+        finally:
+            self._end_request()
+
+    def generate_response_stream(
+        self,
+        conversation: List[Dict[str, str]],
+        max_tokens: int = MAX_NEW_TOKENS,
+        **kwargs
+    ) -> Iterator[str]:
+        """Stream a response, reloading the model first if it was unloaded."""
+        self._begin_request()
+        try:
+            yield from self.analyzer.generate_response_stream(conversation, max_tokens=max_tokens, **kwargs)
+        finally:
+            self._end_request()
+
+    def get_watchdog_stats(self) -> Dict:
+        """
+        Get the idle state.
+
+        Returns:
+            Dictionary with loaded flag, in-flight requests, idle seconds and unload/reload counts
+        """
+        with self._lock:
+            return {
+                "loaded": self.loaded,
+                "in_flight": self._in_flight,
+                "idle_seconds": time.monotonic() - self._last_activity if not self._in_flight else 0.0,
+                "unloads": MODEL_UNLOADS.value(),
+                "reloads": MODEL_RELOADS.value()
+            }
+
+    def _begin_request(self):
+        with self._lock:
+            self._in_flight += 1
+            self._last_activity = time.monotonic()
+
+        if not self.loaded:
+            QUEUE_DEPTH.inc()
+            try:
+                self._reload()
+            except Exception:
+                self._end_request()
+                raise
+            finally:
+                QUEUE_DEPTH.dec()
+
+    def _end_request(self):
+        with self._lock:
+            self._in_flight -= 1
+            self._last_activity = time.monotonic()
+
+    def _reload(self):
+        """Bring the model back, once even if several requests arrive together."""
+        with self._reload_lock:
+            if self.loaded:
+                return
+
+            start = time.perf_counter()
+            if hasattr(self.analyzer, "reload_model"):
+                self.analyzer.reload_model()
+            elapsed = time.perf_counter() - start
+
+            self.loaded = True
+            MODEL_LOADED.set(1)
+            MODEL_RELOADS.inc()
+            MODEL_RELOAD_SECONDS.observe(elapsed)
+            print(f"✓ Model reloaded after idle unload in {elapsed:.1f}s")
+
+    def _watch(self):
+        """Unload the model once it has been idle for idle_timeout seconds."""
+        while True:
+            time.sleep(self.check_interval)
+
+            # Hold the reload lock so a request cannot reload mid-unload
+            with self._reload_lock:
+                with self._lock:
+                    idle = (
+                        self.loaded
+                        and self._in_flight == 0
+                        and time.monotonic() - self._last_activity >= self.idle_timeout
+                    )
+                    if idle:
+                        # New requests now wait for the reload lock, then reload
+                        self.loaded = False
+                if not idle:
+                    continue
+
+                start = time.perf_counter()
+                self.analyzer.cleanup_model()
+                elapsed = time.perf_counter() - start
+
+                MODEL_LOADED.set(0)
+                MODEL_UNLOADS.inc()
+                MODEL_UNLOAD_SECONDS.observe(elapsed)
+                print(f"💤 Model unloaded after {self.idle_timeout:.0f}s without requests")
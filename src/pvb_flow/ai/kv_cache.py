@@ -0,0 +1,352 @@
+"""
+KV-cache reuse helpers for the transformers backend.
+
+Prefill of a long, repeated prompt prefix is the dominant cost on CPU.
+These helpers keep the past key/values of already processed tokens so
+that generate() only has to prefill the part of the prompt that changed.
+"""
+import copy
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Tuple
+
+import torch
+from transformers import DynamicCache
+
+
+def common_prefix_length(a: torch.Tensor, b: torch.Tensor) -> int:
+    """
+    Length of the common prefix of two 1-D token id tensors.
+
+    Args:
+        a: First token id sequence
+        b: Second token id sequence
+
+    Returns:
+        Number of leading positions where both sequences are equal
+    """
+    length = min(a.shape[0], b.shape[0])
+    if length == 0:
+        return 0
+
+    mismatches = (a[:length] != b[:length]).nonzero()
+    if mismatches.shape[0] == 0:
+        return length
+    return int(mismatches[0, 0])
+
+
+def crop_cache(cache: DynamicCache, length: int):
+    """
+    Truncate a cache in place to its first `length` tokens.
+
+    Args:
+        cache: DynamicCache instance
+        length: Number of tokens to keep
+    """
+    excess = cache.get_seq_length() - length
+    if excess > 0:
+        # Negative values remove tokens from the end (accepted by all versions)
+        cache.crop(-excess)
+
+
+def cache_tensors(cache: DynamicCache) -> List[Tuple[torch.Tensor, torch.Tensor]]:
+    """
+    Per-layer (keys, values) tensors of a cache.
+
+    Args:
+        cache: DynamicCache instance
+
+    Returns:
+        List of (keys, values) tuples, shaped [batch, heads, seq, head_dim]
+    """
+    if hasattr(cache, "layers"):
+        return [(layer.keys, layer.values) for layer in cache.layers]
+
+    # transformers < 4.54 keeps flat per-layer lists
+    return list(zip(cache.key_cache, cache.value_cache))
+
+
+def cache_from_tensors(layers: List[Tuple[torch.Tensor, torch.Tensor]]) -> DynamicCache:
+    """
+    Build a DynamicCache from per-layer (keys, values) tensors.
+
+    Args:
+        layers: List of (keys, values) tuples, shaped [batch, heads, seq, head_dim]
+
+    Returns:
+        DynamicCache holding the given tensors
+    """
+    cache = DynamicCache()
+    for layer_idx, (keys, values) in enumerate(layers):
+        cache.update(keys, values, layer_idx)
+    return cache
+
+
+def cache_nbytes(cache: DynamicCache) -> int:
+    """
+    Memory held by the key/value tensors of a cache.
+
+    Args:
+        cache: DynamicCache instance
+
+    Returns:
+        Size in bytes
+    """
+    return sum(
+        t.numel() * t.element_size()
+        for layer in cache_tensors(cache)
+        for t in layer
+        if t is not None
+    )
+
+
+class PrefixKVCache:
+    """
+    Past key/values of a static prompt prefix shared by many requests.
+
+    The cache is built once per loaded model. Each hit hands out a private
+    copy cropped to the matched length, since generate() extends the cache
+    it is given in place.
+    """
+
+    def __init__(self, min_match_ratio: float = 0.9):
+        """
+        Initialize an empty prefix cache.
+
+        Args:
+            min_match_ratio: Minimum share of the cached prefix a request must
+                match for the cache to be used
+        """
+        self.min_match_ratio = min_match_ratio
+        self.prefix_ids = None
+        self.cache = None
+        self.hits = 0
+        self.misses = 0
+        self._counting = True
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def uncounted(self) -> Iterator[None]:
+        """Leave the hit/miss counters alone for the lookups of the block (warm-up generations)."""
+        self._counting = False
+        try:
+            yield
+        finally:
+            self._counting = True
+
+    @property
+    def is_ready(self) -> bool:
+        """Whether a prefix has been prefilled."""
+        return self.cache is not None
+
+    @property
+    def prefix_length(self) -> int:
+        """Number of cached prefix tokens."""
+        return int(self.prefix_ids.shape[0]) if self.prefix_ids is not None else 0
+
+    def build(self, model, prefix_ids: torch.Tensor):
+        """
+        Prefill the prefix once and keep its past key/values.
+
+        Args:
+            model: Loaded causal LM
+            prefix_ids: 1-D tensor of prefix token ids on the model device
+        """
+        cache = DynamicCache()
+        with torch.no_grad():
+            model(
+                input_ids=prefix_ids.unsqueeze(0),
+                past_key_values=cache,
+                use_cache=True
+            )
+
+        self.prefix_ids = prefix_ids
+        self.cache = cache
+
+    def lookup(self, input_ids: torch.Tensor) -> Optional[DynamicCache]:
+        """
+        Get a private copy of the cache for a request, if its prompt shares the prefix.
+
+        Args:
+            input_ids: 1-D tensor of the request token ids
+
+        Returns:
+            DynamicCache covering the matched prefix, or None on a miss
+        """
+        if not self.is_ready:
+            return None
+
+        matched = common_prefix_length(self.prefix_ids, input_ids)
+
+        # generate() needs at least one uncached token to produce logits
+        if matched >= input_ids.shape[0]:
+            matched = input_ids.shape[0] - 1
+
+        if matched < self.min_match_ratio * self.prefix_ids.shape[0]:
+            if self._counting:
+                with self._lock:
+                    self.misses += 1
+            return None
+
+        cache = copy.deepcopy(self.cache)
+        crop_cache(cache, matched)
+
+        if self._counting:
+            with self._lock:
+                self.hits += 1
+        return cache
+
+    def stats(self) -> dict:
+        """
+        Get hit/miss counters.
+
+        Returns:
+            Dictionary with prefix length, hits, misses and hit rate
+        """
+        total = self.hits + self.misses
+        return {
+            "prefix_tokens": self.prefix_length,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
+
+    def clear(self):
+        """Drop the cached prefix (counters are kept)."""
+        self.prefix_ids = None
+        self.cache = None
+
+
+class SessionKVCache:
+    """
+    Per-session KV caches kept between conversation turns.
+
+    Each session stores the cache of the tokens it already processed (prompt
+    and generated answer). On the next turn the cache is cropped to the
+    prefix shared with the new prompt, so only the new suffix is prefilled.
+    Entries are evicted least-recently-used first to stay within a memory
+    budget.
+    """
+
+    def __init__(self, max_bytes: int):
+        """
+        Initialize an empty session cache.
+
+        Args:
+            max_bytes: Memory budget for all sessions combined
+        """
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # session_id -> (token_ids, cache, nbytes)
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.reused_tokens = 0
+        self._lock = threading.Lock()
+
+    def take(
+        self,
+        session_id: str,
+        input_ids: torch.Tensor,
+        min_tokens: int = 1
+    ) -> Tuple[Optional[DynamicCache], int]:
+        """
+        Remove a session's cache and crop it to the prefix shared with a new prompt.
+
+        The cache is handed over rather than copied: generate() extends it in
+        place and the caller puts it back afterwards.
+
+        Args:
+            session_id: Session identifier
+            input_ids: 1-D tensor of the new prompt token ids
+            min_tokens: Shortest shared prefix counted as a hit (e.g. more
+                than the shared system prompt cache already covers)
+
+        Returns:
+            Tuple of (cache or None, number of reused tokens)
+        """
+        with self._lock:
+            entry = self._entries.pop(session_id, None)
+            if entry is not None:
+                self._total_bytes -= entry[2]
+
+        if entry is None:
+            with self._lock:
+                self.misses += 1
+            return None, 0
+
+        token_ids, cache, _ = entry
+        # generate() needs at least one uncached token to produce logits
+        matched = min(common_prefix_length(token_ids, input_ids), input_ids.shape[0] - 1)
+
+        if matched < max(min_tokens, 1):
+            with self._lock:
+                self.misses += 1
+            return None, 0
+
+        crop_cache(cache, matched)
+        with self._lock:
+            self.hits += 1
+            self.reused_tokens += matched
+        return cache, matched
+
+    def put(self, session_id: str, token_ids: torch.Tensor, cache: DynamicCache):
+        """
+        Store the cache of a finished turn, evicting old sessions if needed.
+
+        Args:
+            session_id: Session identifier
+            token_ids: 1-D tensor of all tokens of the turn (prompt and answer)
+            cache: Cache produced by generate() for those tokens
+        """
+        # The last generated token is never fed back, so the cache may be shorter
+        token_ids = token_ids[:cache.get_seq_length()]
+        nbytes = cache_nbytes(cache)
+
+        if nbytes > self.max_bytes:
+            return
+
+        with self._lock:
+            previous = self._entries.pop(session_id, None)
+            if previous is not None:
+                self._total_bytes -= previous[2]
+
+            self._entries[session_id] = (token_ids, cache, nbytes)
+            self._total_bytes += nbytes
+
+            while self._total_bytes > self.max_bytes:
+                _, (_, _, evicted_bytes) = self._entries.popitem(last=False)
+                self._total_bytes -= evicted_bytes
+                self.evictions += 1
+
+    def drop(self, session_id: str):
+        """Forget a session's cache."""
+        with self._lock:
+            entry = self._entries.pop(session_id, None)
+            if entry is not None:
+                self._total_bytes -= entry[2]
+
+    def stats(self) -> dict:
+        """
+        Get cache counters.
+
+        Returns:
+            Dictionary with sessions, memory use, hits, misses, evictions and reused tokens
+        """
+        with self._lock:
+            return {
+                "sessions": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "reused_tokens": self.reused_tokens
+            }
+
+    def clear(self):
+        """Drop all sessions (counters are kept)."""
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
@@ -3,7 +3,9 @@ MLX-based Mistral analyzer for Apple Silicon (M1/M2/M3).
 Optimized for fast inference with lower memory usage.
 """
 import gc
-from typing import List, Dict
+from typing import List, Dict, Iterator, Optional
+from .generation_limits import MAX_NEW_TOKENS, has_closed_mermaid_block
+from ..utils.metrics import REQUEST_STAGE_SECONDS
 
 
 class MistralMLXAnalyzer:
@@ -23,14 +25,19 @@ class MistralMLXAnalyzer:
         self.model = None
         self.tokenizer = None
 
-    def _load_model(self):
-        """Lazy load the model and tokenizer."""
+    def _load_model(self, path: Optional[str] = None):
+        """
+        Lazy load the model and tokenizer.
+
+        Args:
+            path: Local snapshot directory to load from instead of the model name
+        """
         if self.model is None or self.tokenizer is None:
             try:
                 from mlx_lm import load
                 # Load model with tokenizer config
                 self.model, self.tokenizer = load(
-                    self.model_name,
+                    path or self.model_name,
                     tokenizer_config={"fix_mistral_regex": True}
                 )
                 print(f"✓ MLX model loaded: {self.model_name}")
@@ -40,47 +47,121 @@ class MistralMLXAnalyzer:
                     "Note: MLX only works on Apple Silicon (M1/M2/M3)"
                 ) from e
 
-    def generate_response(self, conversation: List[Dict[str, str]], max_tokens: int = 4000) -> str:
+    @property
+    def is_loaded(self) -> bool:
+        """Whether the model is in memory."""
+        return self.model is not None
+
+    def reload_model(self):
+        """Load the model again after cleanup_model(), from the local snapshot when possible."""
+        try:
+            from huggingface_hub import snapshot_download
+            # The snapshot downloaded on first load is still on disk: skip Hub round-trips
+            path = snapshot_download(self.model_name, local_files_only=True)
+        except Exception:
+            path = None
+        self._load_model(path)
+
+    def _build_prompt(self, conversation: List[Dict[str, str]]) -> str:
         """
-        Generate response from conversation history.
+        Build the prompt string for a conversation.
 
         Args:
             conversation: List of conversation messages with 'role' and 'content'
-            max_tokens: Maximum tokens to generate
 
         Returns:
-            Generated response text
+            Prompt ready to be passed to mlx-lm
         """
-        self._load_model()
-
-        from mlx_lm import generate
-        from mlx_lm.sample_utils import make_sampler
-
         # Try to use apply_chat_template if available
         try:
-            prompt = self.tokenizer.apply_chat_template(
+            return self.tokenizer.apply_chat_template(
                 conversation,
                 tokenize=False,
                 add_generation_prompt=True
             )
         except (AttributeError, ValueError):
             # Fallback: manual Mistral Instruct format
-            prompt = self._format_mistral_chat(conversation)
+            return self._format_mistral_chat(conversation)
+
+    def generate_response(
+        self,
+        conversation: List[Dict[str, str]],
+        max_tokens: int = MAX_NEW_TOKENS,
+        session_id: Optional[str] = None,
+        prompt_lookup: bool = False
+    ) -> str:
+        """
+        Generate response from conversation history.
+
+        Args:
+            conversation: List of conversation messages with 'role' and 'content'
+            max_tokens: Maximum tokens to generate
+            session_id: Unused by this backend, accepted for interface compatibility
+            prompt_lookup: Unused by this backend, accepted for interface compatibility
+
+        Returns:
+            Generated response text
+        """
+        return "".join(self.generate_response_stream(conversation, max_tokens, session_id, prompt_lookup)).strip()
+
+    def generate_response_stream(
+        self,
+        conversation: List[Dict[str, str]],
+        max_tokens: int = MAX_NEW_TOKENS,
+        session_id: Optional[str] = None,
+        prompt_lookup: bool = False
+    ) -> Iterator[str]:
+        """
+        Stream the response to a conversation as text chunks.
+
+        Args:
+            conversation: List of conversation messages with 'role' and 'content'
+            max_tokens: Maximum tokens to generate
+            session_id: Unused by this backend, accepted for interface compatibility
+            prompt_lookup: Unused by this backend, accepted for interface compatibility
+
+        Yields:
+            Newly decoded text chunks, in order
+        """
+        self._load_model()
+
+        from mlx_lm import stream_generate
+        from mlx_lm.sample_utils import make_sampler
+
+        with REQUEST_STAGE_SECONDS.timer(stage="chat_template"):
+            prompt = self._build_prompt(conversation)
+
+        # Tokenize here (as stream_generate would) so that it is timed separately
+        with REQUEST_STAGE_SECONDS.timer(stage="tokenization"):
+            bos_token = self.tokenizer.bos_token
+            add_special_tokens = bos_token is None or not prompt.startswith(bos_token)
+            prompt_tokens = self.tokenizer.encode(prompt, add_special_tokens=add_special_tokens)
 
-        # Create sampler with low temperature for consistent diagram generation
         sampler = make_sampler(temp=0.2)
 
-        # Generate response
-        response = generate(
-            self.model,
-            self.tokenizer,
-            prompt=prompt,
-            max_tokens=max_tokens,
-            sampler=sampler,
-            verbose=False
-        )
-
-        return response.strip()
+        response = ""
+        chunk = None
+        try:
+            for chunk in stream_generate(
+                self.model,
+                self.tokenizer,
+                prompt=prompt_tokens,
+                max_tokens=max_tokens,
+                sampler=sampler
+            ):
+                if chunk.text:
+                    response += chunk.text
+                    yield chunk.text
+
+                # Stop right after the ```mermaid``` block instead of running to EOS
+                if has_closed_mermaid_block(response):
+                    break
+        finally:
+            # mlx-lm's own throughput figures exclude the time spent by our consumer
+            if chunk is not None and chunk.prompt_tps > 0:
+                REQUEST_STAGE_SECONDS.observe(chunk.prompt_tokens / chunk.prompt_tps, stage="prefill")
+                if chunk.generation_tps > 0:
+                    REQUEST_STAGE_SECONDS.observe(chunk.generation_tokens / chunk.generation_tps, stage="decode")
 
     def _format_mistral_chat(self, conversation: List[Dict[str, str]]) -> str:
         """
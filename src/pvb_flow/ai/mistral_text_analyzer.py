@@ -3,9 +3,23 @@ Transformers-based Mistral analyzer for cross-platform support.
 Works on CPU, CUDA, and MPS (Apple Silicon).
 """
 import gc
+import time
 import torch
-from typing import List, Dict
-from transformers import AutoTokenizer, AutoModelForCausalLM
+from contextlib import nullcontext
+from threading import Event, Thread
+from typing import List, Dict, Iterator, Optional
+from transformers import (
+    AutoTokenizer, AutoModelForCausalLM, TextIteratorStreamer, DynamicCache, StaticCache,
+    StoppingCriteriaList, LogitsProcessorList
+)
+from .cpu_quantization import cpu_dtype, quantize_model
+from .generation_limits import MAX_NEW_TOKENS
+from .grammar_constraint import MermaidGrammarLogitsProcessor, TokenPieces
+from .kv_cache import PrefixKVCache, SessionKVCache, common_prefix_length
+from .prompts_config import DiagramPrompts
+from .static_cache import StaticCachePool, fill_static_cache, static_to_dynamic_cache
+from .stopping_criteria import CancelledStoppingCriteria, FirstTokenTimer, MermaidFenceStoppingCriteria
+from ..utils.metrics import REQUEST_STAGE_SECONDS
 
 
 class MistralTextAnalyzer:
@@ -18,7 +32,13 @@ class MistralTextAnalyzer:
         self,
         hf_token: str,
         model_name: str = "mistralai/Mistral-Small-Instruct-2409",
-        load_in_8bit: bool = False
+        load_in_8bit: bool = False,
+        use_prefix_cache: bool = True,
+        session_cache_mb: int = 2048,
+        prompt_lookup_num_tokens: int = 10,
+        constrained_decoding: bool = False,
+        cpu_precision: str = "fp32",
+        static_cache: bool = False
     ):
         """
         Initialize the Transformers Mistral analyzer.
@@ -27,10 +47,30 @@ class MistralTextAnalyzer:
             hf_token: HuggingFace API token
             model_name: HuggingFace model ID
             load_in_8bit: Whether to load model in 8-bit mode (reduces memory)
+            use_prefix_cache: Whether to prefill the shared system prompt once
+                and reuse its KV cache for every request starting with it
+            session_cache_mb: Memory budget (MB) for KV caches kept between the
+                turns of each session, 0 to disable
+            prompt_lookup_num_tokens: Draft tokens copied from prompt n-gram
+                matches per step in prompt-lookup mode, 0 to disable
+            constrained_decoding: Mask tokens that would break the Mermaid
+                flowchart grammar inside the ```mermaid``` block
+            cpu_precision: Weight precision on CPU: "fp32", "bf16", or the
+                weight-only quantized "int8"/"int4" (bf16 activations)
+            static_cache: Decode with preallocated, length-bucketed static KV
+                caches and a torch.compile'd decode step (compiled at load)
         """
         self.model_name = model_name
         self.hf_token = hf_token
         self.load_in_8bit = load_in_8bit
+        self.prefix_cache = PrefixKVCache() if use_prefix_cache else None
+        self.session_cache = SessionKVCache(session_cache_mb * 1024 * 1024) if session_cache_mb > 0 else None
+        self.prompt_lookup_num_tokens = prompt_lookup_num_tokens
+        self.constrained_decoding = constrained_decoding
+        self.cpu_precision = cpu_precision
+        self.static_cache = static_cache
+        self.static_caches = None
+        self.compile_config = None
 
         # Detect device and dtype
         if torch.backends.mps.is_available():
@@ -43,20 +83,27 @@ class MistralTextAnalyzer:
             print(f"✓ Using CUDA backend on {torch.cuda.get_device_name(0)}")
         else:
             self.device = torch.device("cpu")
-            self.dtype = torch.float32
-            print("✓ Using CPU backend (slower)")
+            self.dtype = cpu_dtype(cpu_precision)
+            print(f"✓ Using CPU backend ({cpu_precision} weights)")
 
         # Load tokenizer and model
         self._load_model()
 
-    def _load_model(self):
-        """Load the model and tokenizer."""
+    def _load_model(self, local_files_only: bool = False):
+        """
+        Load the model and tokenizer.
+
+        Args:
+            local_files_only: Load from the local Hugging Face cache without
+                contacting the Hub
+        """
         print(f"Loading model: {self.model_name}...")
 
         # Load tokenizer
         self.tokenizer = AutoTokenizer.from_pretrained(
             self.model_name,
-            token=self.hf_token
+            token=self.hf_token,
+            local_files_only=local_files_only
         )
 
         # Load model
@@ -66,7 +113,8 @@ class MistralTextAnalyzer:
                 self.model_name,
                 token=self.hf_token,
                 load_in_8bit=True,
-                device_map="auto"
+                device_map="auto",
+                local_files_only=local_files_only
             )
         else:
             # Standard loading
@@ -74,44 +122,319 @@ class MistralTextAnalyzer:
                 self.model_name,
                 token=self.hf_token,
                 torch_dtype=self.dtype,
-                device_map="auto" if self.device.type != "cpu" else None
+                device_map="auto" if self.device.type != "cpu" else None,
+                local_files_only=local_files_only
             )
             if self.device.type == "cpu":
                 self.model = self.model.to(self.device)
+                quantized = quantize_model(self.model, self.cpu_precision)
+                if quantized:
+                    print(f"✓ {quantized} linear layers quantized to {self.cpu_precision}")
 
         print(f"✓ Model loaded on {self.device}")
 
-    def generate_response(self, conversation: List[Dict[str, str]], max_tokens: int = 4000) -> str:
+        # Text of every token, decoded once for grammar-constrained decoding
+        self.token_pieces = TokenPieces(self.tokenizer) if self.constrained_decoding else None
+
+        if self.prefix_cache is not None:
+            self._build_prefix_cache()
+
+        if self.static_cache:
+            self._setup_static_decode()
+
+    @property
+    def is_loaded(self) -> bool:
+        """Whether the model is in memory (False after cleanup_model())."""
+        return getattr(self, "model", None) is not None
+
+    def reload_model(self):
+        """Load the model again after cleanup_model(), from the local cache when possible."""
+        try:
+            # The snapshot downloaded at startup is still on disk: skip Hub round-trips
+            self._load_model(local_files_only=True)
+        except OSError:
+            self._load_model()
+
+    def _build_prefix_cache(self):
+        """Prefill the static system prompt shared by all initial requests."""
+        # Template two probes that only differ after the system prompt: their
+        # common tokens are exactly the prefix every initial request starts with
+        probes = [
+            self.prepare_inputs([
+                {"role": "user", "content": f"{DiagramPrompts.SYSTEM_PROMPT}\n\n{marker}"}
+            ])["input_ids"][0]
+            for marker in ("A", "B")
+        ]
+        prefix_length = common_prefix_length(*probes)
+
+        self.prefix_cache.build(self.model, probes[0][:prefix_length])
+        print(f"✓ System prompt prefix cached ({prefix_length} tokens)")
+
+    def _setup_static_decode(self):
+        """Create the static cache pool and compile the decode step of initial requests."""
+        from transformers import CompileConfig
+
+        self.static_caches = StaticCachePool(self.model.config)
+        # One config object for every request: generate() recompiles when it changes
+        self.compile_config = CompileConfig(fullgraph=False, dynamic=False)
+        if self.device.type == "cpu":
+            # generate() only auto-compiles on accelerators unless told otherwise. There
+            # is no public switch: set the attribute generate() reads, if this version has it
+            if hasattr(self.compile_config, "_compile_all_devices"):
+                self.compile_config._compile_all_devices = True
+            else:
+                print("⚠️  This transformers version does not compile on CPU: static caches decode eagerly")
+
+        # Initial requests (system prompt + PVB + full answer) all fall in the
+        # same bucket: compile it now rather than on the first user request
+        inputs = self.prepare_inputs([{"role": "user", "content": DiagramPrompts.SYSTEM_PROMPT}])
+        generate_kwargs = self._generation_kwargs(inputs, MAX_NEW_TOKENS)
+        generate_kwargs["max_new_tokens"] = 3
+
+        start = time.perf_counter()
+        try:
+            with torch.no_grad(), self.uncounted_cache_lookups():
+                self.model.generate(**generate_kwargs)
+        finally:
+            self._release_static_cache(generate_kwargs)
+        print(f"✓ Static-cache decode step compiled in {time.perf_counter() - start:.1f}s")
+
+    def get_static_cache_stats(self) -> Dict:
         """
-        Generate response from conversation history.
+        Get static KV cache pool counters.
+
+        Returns:
+            Dictionary with buckets, allocated, reused and dropped caches
+        """
+        if self.static_caches is None:
+            return {"enabled": False}
+        return {"enabled": True, **self.static_caches.stats()}
+
+    def uncounted_cache_lookups(self):
+        """Context manager keeping warm-up generations out of the prefix cache counters."""
+        return self.prefix_cache.uncounted() if self.prefix_cache is not None else nullcontext()
+
+    def get_prefix_cache_stats(self) -> Dict:
+        """
+        Get system-prompt prefix cache counters.
+
+        Returns:
+            Dictionary with prefix length, hits, misses and hit rate
+        """
+        if self.prefix_cache is None:
+            return {"enabled": False}
+        return {"enabled": True, **self.prefix_cache.stats()}
+
+    def get_session_cache_stats(self) -> Dict:
+        """
+        Get per-session KV cache counters.
+
+        Returns:
+            Dictionary with sessions, memory use, hits, misses, evictions and reused tokens
+        """
+        if self.session_cache is None:
+            return {"enabled": False}
+        return {"enabled": True, **self.session_cache.stats()}
+
+    def prepare_inputs(self, conversation: List[Dict[str, str]]) -> Dict[str, torch.Tensor]:
+        """
+        Apply the chat template and tokenize a conversation.
 
         Args:
             conversation: List of conversation messages with 'role' and 'content'
-            max_tokens: Maximum tokens to generate
 
         Returns:
-            Generated response text
+            Dictionary of input tensors on the model device
         """
         # Apply chat template
-        prompt = self.tokenizer.apply_chat_template(
-            conversation,
-            tokenize=False,
-            add_generation_prompt=True
-        )
+        with REQUEST_STAGE_SECONDS.timer(stage="chat_template"):
+            prompt = self.tokenizer.apply_chat_template(
+                conversation,
+                tokenize=False,
+                add_generation_prompt=True
+            )
 
         # Tokenize
-        inputs = self.tokenizer(prompt, return_tensors="pt")
-        inputs = {k: v.to(self.device) for k, v in inputs.items()}
+        with REQUEST_STAGE_SECONDS.timer(stage="tokenization"):
+            inputs = self.tokenizer(prompt, return_tensors="pt")
+        return {k: v.to(self.device) for k, v in inputs.items()}
 
-        # Generate
+    def _generation_kwargs(
+        self,
+        inputs: Dict[str, torch.Tensor],
+        max_tokens: int,
+        session_id: Optional[str] = None,
+        prompt_lookup: bool = False
+    ) -> Dict:
+        """
+        Build generate() arguments shared by blocking and streaming generation.
+
+        Args:
+            inputs: Tokenized prompt
+            max_tokens: Maximum tokens to generate
+            session_id: Session whose cached tokens may be reused
+            prompt_lookup: Draft tokens from n-gram matches in the prompt and
+                verify them in one forward pass (assisted generation)
+
+        Returns:
+            Keyword arguments for model.generate()
+        """
+        kwargs = {
+            **inputs,
+            "max_new_tokens": max_tokens,
+            "temperature": 0.2,  # Low temperature for consistent diagrams
+            "do_sample": False,  # Greedy decoding for deterministic output
+            "pad_token_id": self.tokenizer.eos_token_id,
+            # Stop right after the ```mermaid``` block instead of running to EOS
+            "stopping_criteria": StoppingCriteriaList([
+                MermaidFenceStoppingCriteria(self.tokenizer, inputs["input_ids"].shape[1])
+            ])
+        }
+
+        if self.constrained_decoding:
+            kwargs["logits_processor"] = LogitsProcessorList([
+                MermaidGrammarLogitsProcessor(self.tokenizer, inputs["input_ids"].shape[1], self.token_pieces)
+            ])
+
+        # Refinement answers mostly copy the CURRENT DIAGRAM from the prompt:
+        # drafting from it lets one forward pass accept several tokens
+        if prompt_lookup and self.prompt_lookup_num_tokens > 0:
+            kwargs["prompt_lookup_num_tokens"] = self.prompt_lookup_num_tokens
+
+        # Fixed-shape cache so that the decode step runs compiled (not with
+        # prompt lookup: assisted generation crops its cache, static caches cannot)
+        static_cache = None
+        if self.static_caches is not None and "prompt_lookup_num_tokens" not in kwargs:
+            static_cache = self.static_caches.acquire(inputs["input_ids"].shape[1] + max_tokens)
+
+        past_key_values = self.lookup_cache(inputs["input_ids"][0], session_id)
+
+        if static_cache is not None:
+            if past_key_values is not None:
+                fill_static_cache(static_cache, past_key_values)
+            kwargs["past_key_values"] = static_cache
+            kwargs["compile_config"] = self.compile_config
+            return kwargs
+
+        # Always hand generate() a cache we own so it can be kept for the session
+        if past_key_values is None and self.session_cache is not None and session_id is not None:
+            past_key_values = DynamicCache()
+
+        if past_key_values is not None:
+            kwargs["past_key_values"] = past_key_values
+
+        return kwargs
+
+    def lookup_cache(self, input_ids: torch.Tensor, session_id: Optional[str] = None) -> Optional[DynamicCache]:
+        """
+        Find the longest reusable KV cache for a prompt.
+
+        Args:
+            input_ids: 1-D tensor of prompt token ids
+            session_id: Session whose cached tokens may be reused
+
+        Returns:
+            Private DynamicCache covering a prefix of the prompt, or None
+        """
+        past_key_values = None
+
+        # Reuse what this session already processed on previous turns, when it
+        # covers more than the shared system prompt
+        if self.session_cache is not None and session_id is not None:
+            min_tokens = self.prefix_cache.prefix_length + 1 if self.prefix_cache is not None else 1
+            past_key_values, _ = self.session_cache.take(session_id, input_ids, min_tokens)
+
+        # Fall back to the shared system prompt when it covers more tokens
+        if self.prefix_cache is not None and (
+            past_key_values is None
+            or past_key_values.get_seq_length() < self.prefix_cache.prefix_length
+        ):
+            prefix_key_values = self.prefix_cache.lookup(input_ids)
+            if prefix_key_values is not None and (
+                past_key_values is None
+                or prefix_key_values.get_seq_length() > past_key_values.get_seq_length()
+            ):
+                past_key_values = prefix_key_values
+
+        return past_key_values
+
+    def _release_static_cache(self, generate_kwargs: Dict):
+        """Return the static cache lent to a generation, if any, to the pool."""
+        past_key_values = generate_kwargs.get("past_key_values")
+        if self.static_caches is not None and isinstance(past_key_values, StaticCache):
+            self.static_caches.release(past_key_values)
+
+    def store_session_cache(self, session_id: Optional[str], token_ids: torch.Tensor, past_key_values: DynamicCache):
+        """
+        Keep the KV cache of a finished turn for the session's next request.
+
+        Args:
+            session_id: Session identifier
+            token_ids: 1-D tensor of prompt and generated token ids
+            past_key_values: Cache holding those tokens
+        """
+        if self.session_cache is None or session_id is None or past_key_values is None:
+            return
+
+        if isinstance(past_key_values, StaticCache):
+            # The static cache goes back to the pool: keep a copy of its tokens
+            past_key_values = static_to_dynamic_cache(past_key_values)
+
+        self.session_cache.put(session_id, token_ids, past_key_values)
+
+    def _timed_generate(self, generate_kwargs: Dict, **kwargs) -> torch.Tensor:
+        """
+        Run model.generate() and record its prefill and decode times.
+
+        Args:
+            generate_kwargs: Arguments from _generation_kwargs()
+            **kwargs: Extra generate() arguments (e.g. streamer)
+
+        Returns:
+            Generated token ids, prompt included
+        """
+        first_token = FirstTokenTimer()
+        generate_kwargs["stopping_criteria"].append(first_token)
+
+        start = time.perf_counter()
         with torch.no_grad():
-            outputs = self.model.generate(
-                **inputs,
-                max_new_tokens=max_tokens,
-                temperature=0.2,  # Low temperature for consistent diagrams
-                do_sample=False,  # Greedy decoding for deterministic output
-                pad_token_id=self.tokenizer.eos_token_id
-            )
+            outputs = self.model.generate(**generate_kwargs, **kwargs)
+        end = time.perf_counter()
+
+        first_token_at = first_token.first_token_at or end
+        REQUEST_STAGE_SECONDS.observe(first_token_at - start, stage="prefill")
+        REQUEST_STAGE_SECONDS.observe(end - first_token_at, stage="decode")
+        return outputs
+
+    def generate_response(
+        self,
+        conversation: List[Dict[str, str]],
+        max_tokens: int = MAX_NEW_TOKENS,
+        session_id: Optional[str] = None,
+        prompt_lookup: bool = False
+    ) -> str:
+        """
+        Generate response from conversation history.
+
+        Args:
+            conversation: List of conversation messages with 'role' and 'content'
+            max_tokens: Maximum tokens to generate
+            session_id: Optional session identifier, enables KV-cache reuse across turns
+            prompt_lookup: Use prompt-lookup decoding (for answers that copy the prompt)
+
+        Returns:
+            Generated response text
+        """
+        inputs = self.prepare_inputs(conversation)
+        generate_kwargs = self._generation_kwargs(inputs, max_tokens, session_id, prompt_lookup)
+
+        # Generate
+        try:
+            outputs = self._timed_generate(generate_kwargs)
+
+            self.store_session_cache(session_id, outputs[0], generate_kwargs.get("past_key_values"))
+        finally:
+            self._release_static_cache(generate_kwargs)
 
         # Decode response (skip input tokens)
         input_length = inputs["input_ids"].shape[1]
@@ -122,6 +445,66 @@ class MistralTextAnalyzer:
 
         return response.strip()
 
+    def generate_response_stream(
+        self,
+        conversation: List[Dict[str, str]],
+        max_tokens: int = MAX_NEW_TOKENS,
+        session_id: Optional[str] = None,
+        prompt_lookup: bool = False
+    ) -> Iterator[str]:
+        """
+        Stream the response to a conversation as text chunks.
+
+        Generation runs in a background thread and decoded text is yielded
+        as soon as it is available, so the first chunk arrives after prefill
+        instead of after the whole answer has been decoded. Closing the
+        generator early stops decoding at the next step.
+
+        Args:
+            conversation: List of conversation messages with 'role' and 'content'
+            max_tokens: Maximum tokens to generate
+            session_id: Optional session identifier, enables KV-cache reuse across turns
+            prompt_lookup: Use prompt-lookup decoding (for answers that copy the prompt)
+
+        Yields:
+            Newly decoded text chunks, in order
+        """
+        inputs = self.prepare_inputs(conversation)
+        generate_kwargs = self._generation_kwargs(inputs, max_tokens, session_id, prompt_lookup)
+        streamer = TextIteratorStreamer(
+            self.tokenizer,
+            skip_prompt=True,
+            skip_special_tokens=True
+        )
+        cancelled = Event()
+        generate_kwargs["stopping_criteria"].append(CancelledStoppingCriteria(cancelled))
+
+        errors = []
+
+        def _generate():
+            try:
+                outputs = self._timed_generate(generate_kwargs, streamer=streamer)
+                self.store_session_cache(session_id, outputs[0], generate_kwargs.get("past_key_values"))
+            except Exception as e:
+                # Unblock the consumer, the error is re-raised below
+                errors.append(e)
+                streamer.end()
+            finally:
+                self._release_static_cache(generate_kwargs)
+
+        thread = Thread(target=_generate, daemon=True)
+        thread.start()
+        try:
+            for chunk in streamer:
+                if chunk:
+                    yield chunk
+        finally:
+            cancelled.set()
+            thread.join()
+
+        if errors:
+            raise errors[0]
+
     def cleanup_model(self):
         """Free model from memory."""
         if hasattr(self, 'model') and self.model is not None:
@@ -132,6 +515,16 @@ class MistralTextAnalyzer:
         if hasattr(self, 'tokenizer') and self.tokenizer is not None:
             del self.tokenizer
             self.tokenizer = None
+            self.token_pieces = None
+
+        if self.prefix_cache is not None:
+            self.prefix_cache.clear()
+
+        if self.session_cache is not None:
+            self.session_cache.clear()
+
+        if self.static_caches is not None:
+            self.static_caches.clear()
 
         gc.collect()
 
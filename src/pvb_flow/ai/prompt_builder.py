@@ -0,0 +1,153 @@
+"""
+Token-budgeted assembly of the diagram prompts.
+
+Prompt size drives prefill time, which dominates the first-token latency
+on CPU. The builder serializes the Product Vision Board as compact JSON,
+counts tokens with the serving model's tokenizer and leaves out the
+optional prompt sections (analysis steps, refinement guidelines) when a
+prompt would exceed the target budget. The system prompt is always kept,
+so the prefix cached at startup still matches; refinements never carry it.
+"""
+import json
+import math
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from .generation_limits import CHARS_PER_TOKEN
+from .prompts_config import DiagramPrompts
+
+
+# Prompt tokens aimed for: well above the full initial prompt of a typical
+# board (about 2000 tokens), so only large boards lose the analysis steps
+DEFAULT_PROMPT_TOKEN_BUDGET = 3072
+
+# Token counts kept, enough for the static sections and the boards in use
+TOKEN_COUNT_CACHE_ENTRIES = 512
+
+SECTION_SEPARATOR = "\n\n"
+
+
+class PromptBuilder:
+    """
+    Build initial and refinement prompts within a token budget.
+
+    Usage:
+        builder = PromptBuilder(max_prompt_tokens=3072)
+        prompt, tokens = builder.initial_prompt(pvb_data, tokenizer)
+    """
+
+    def __init__(self, max_prompt_tokens: int = DEFAULT_PROMPT_TOKEN_BUDGET):
+        """
+        Initialize the builder.
+
+        Args:
+            max_prompt_tokens: Target prompt size; optional sections are left
+                out above it (0 keeps every section)
+        """
+        self.max_prompt_tokens = max_prompt_tokens
+        self._token_counts = OrderedDict()  # (tokenizer id, text) -> tokens
+        self._lock = threading.Lock()
+
+    def count_tokens(self, text: str, tokenizer: Any = None) -> int:
+        """
+        Count the tokens of a text.
+
+        Args:
+            text: Text to count
+            tokenizer: Tokenizer of the serving model, None to estimate from
+                the length (CHARS_PER_TOKEN)
+
+        Returns:
+            Number of tokens
+        """
+        if tokenizer is None:
+            return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+        key = (id(tokenizer), text)
+        with self._lock:
+            tokens = self._token_counts.get(key)
+            if tokens is not None:
+                self._token_counts.move_to_end(key)
+                return tokens
+
+        tokens = len(tokenizer.encode(text, add_special_tokens=False))
+        with self._lock:
+            self._token_counts[key] = tokens
+            if len(self._token_counts) > TOKEN_COUNT_CACHE_ENTRIES:
+                self._token_counts.popitem(last=False)
+        return tokens
+
+    @staticmethod
+    def serialize_pvb(pvb_data: Dict) -> str:
+        """
+        Serialize a Product Vision Board as compact JSON.
+
+        Args:
+            pvb_data: Product Vision Board data
+
+        Returns:
+            JSON text without indentation or spaces after separators
+        """
+        return json.dumps(pvb_data, ensure_ascii=False, separators=(",", ":"))
+
+    def initial_prompt(
+        self,
+        pvb_data: Dict,
+        tokenizer: Any = None
+    ) -> Tuple[str, int]:
+        """
+        Build the prompt of a first diagram.
+
+        Args:
+            pvb_data: Product Vision Board data
+            tokenizer: Tokenizer of the serving model, None to estimate
+
+        Returns:
+            Tuple of (prompt, token count)
+        """
+        sections = DiagramPrompts.get_initial_sections(self.serialize_pvb(pvb_data))
+        return self._fit(sections, tokenizer)
+
+    def refinement_prompt(
+        self,
+        pvb_data: Dict,
+        current_diagram: str,
+        user_feedback: str,
+        tokenizer: Any = None
+    ) -> Tuple[str, int]:
+        """
+        Build the prompt of a refinement regenerating the diagram.
+
+        Args:
+            pvb_data: Product Vision Board data
+            current_diagram: Diagram being refined
+            user_feedback: User's refinement request
+            tokenizer: Tokenizer of the serving model, None to estimate
+
+        Returns:
+            Tuple of (prompt, token count)
+        """
+        sections = DiagramPrompts.get_refinement_sections(
+            self.serialize_pvb(pvb_data), current_diagram, user_feedback
+        )
+        return self._fit(sections, tokenizer)
+
+    def _fit(self, sections: List[Tuple[str, Optional[int]]], tokenizer: Any) -> Tuple[str, int]:
+        """Join the sections, leaving out optional ones (lowest rank first) while over budget."""
+        counts = [self.count_tokens(text, tokenizer) for text, _ in sections]
+        total = sum(counts)
+        kept = [True] * len(sections)
+
+        if self.max_prompt_tokens > 0 and total > self.max_prompt_tokens:
+            optional = sorted(
+                (rank, index) for index, (_, rank) in enumerate(sections) if rank is not None
+            )
+            for _, index in optional:
+                if total <= self.max_prompt_tokens:
+                    break
+                kept[index] = False
+                total -= counts[index]
+
+        prompt = SECTION_SEPARATOR.join(text for (text, _), keep in zip(sections, kept) if keep)
+        return prompt, total
@@ -2,12 +2,14 @@
 Prompt templates for Mermaid diagram generation from Product Vision Board data.
 """
 import json
+from typing import List, Optional, Tuple
 
 
 class DiagramPrompts:
     """Prompt templates for diagram generation and refinement."""
 
-    SYSTEM_PROMPT = """You are an expert business process analyst specialized in creating operational process flow diagrams using Mermaid syntax.
+    # Sections of the system prompt, kept separate so PromptBuilder can leave some out
+    ROLE_PROMPT = """You are an expert business process analyst specialized in creating operational process flow diagrams using Mermaid syntax.
 
 Your mission:
 Transform Product Vision Board data into OPERATIONAL PROCESS DIAGRAMS that show:
@@ -29,9 +31,9 @@ Color Code by Actor Type:
 - 🖥️ Systems/Automated processes: #4A90D9 (blue)
 - 🤖 AI/ML processes: #50C878 (green)
 - 👤 Human actors/manual tasks: #FF9F43 (orange)
-- 🎯 Objectives/Results: #E74C3C (red)
+- 🎯 Objectives/Results: #E74C3C (red)"""
 
-Example of GOOD operational process diagram:
+    EXAMPLE_PROMPT = """Example of GOOD operational process diagram:
 ```mermaid
 flowchart TD
     subgraph Légende
@@ -82,9 +84,9 @@ flowchart TD
     style L1 fill:#4A90D9,stroke:#2E5F8A,color:#fff
     style L2 fill:#50C878,stroke:#2E8B57,color:#fff
     style L3 fill:#FF9F43,stroke:#E67E22,color:#fff
-```
+```"""
 
-How to analyze a Product Vision Board for process creation:
+    ANALYSIS_GUIDE = """How to analyze a Product Vision Board for process creation:
 
 1. IDENTIFY THE WORKFLOW from "Description du Produit":
    - What are the main steps described?
@@ -111,19 +113,10 @@ How to analyze a Product Vision Board for process creation:
    - What calculations or transformations?
    - What enrichments or validations?"""
 
-    @staticmethod
-    def get_initial_prompt(pvb_data: dict) -> str:
-        """Generate prompt for initial diagram creation from PVB data."""
-        return f"""{DiagramPrompts.SYSTEM_PROMPT}
-
-Now, analyze this Product Vision Board and create an OPERATIONAL PROCESS DIAGRAM:
+    # Static prefix of every initial prompt (prefilled once by the analyzers)
+    SYSTEM_PROMPT = f"{ROLE_PROMPT}\n\n{EXAMPLE_PROMPT}\n\n{ANALYSIS_GUIDE}"
 
-{json.dumps(pvb_data, indent=2, ensure_ascii=False)}
-
-YOUR TASK:
-Based on the Product Vision Board above, infer and create a complete operational business process diagram.
-
-ANALYSIS STEPS:
+    ANALYSIS_STEPS = """ANALYSIS STEPS:
 
 1. **Extract the operational workflow** from "Description du Produit":
    - What steps are described or implied?
@@ -136,7 +129,7 @@ ANALYSIS STEPS:
    - Is there AI/automation? (→ Green boxes 🤖)
 
 3. **Find decision points and validations**:
-   - Are there conditional branches? (Use diamond shapes {{}})
+   - Are there conditional branches? (Use diamond shapes {})
    - Are there validation/approval steps?
    - Multiple paths based on data type or business rules?
 
@@ -147,16 +140,16 @@ ANALYSIS STEPS:
 
 5. **Add business intelligence** from "Fonctionnalités Clés":
    - What calculations or enrichments occur?
-   - What specific operations are performed?
+   - What specific operations are performed?"""
 
-DIAGRAM REQUIREMENTS:
+    DIAGRAM_REQUIREMENTS = """DIAGRAM REQUIREMENTS:
 
 ✓ Use flowchart TD (top-down, vertical)
 ✓ Create a "Légende" subgraph showing actor types
 ✓ Create a main process subgraph with a descriptive title
 ✓ Use proper emojis for each step type
 ✓ Apply colors by actor type (blue=system, green=AI, orange=human)
-✓ Use decision diamonds {{}} when there are choices
+✓ Use decision diamonds {} when there are choices
 ✓ Label all arrows with conditions when relevant
 ✓ Keep labels concise but informative (use <br/> for line breaks)
 ✓ Make it professional and business-ready
@@ -169,25 +162,7 @@ IMPORTANT:
 
 Respond with ONLY the Mermaid diagram in ```mermaid``` code blocks. No additional explanation."""
 
-    @staticmethod
-    def get_refinement_prompt(pvb_data: dict, current_diagram: str, user_feedback: str) -> str:
-        """Generate prompt for diagram refinement based on user feedback."""
-        return f"""You are refining an operational business process diagram.
-
-CURRENT DIAGRAM:
-```mermaid
-{current_diagram}
-```
-
-ORIGINAL PRODUCT VISION BOARD:
-{json.dumps(pvb_data, indent=2, ensure_ascii=False)}
-
-USER REQUEST: "{user_feedback}"
-
-YOUR TASK:
-Modify the diagram according to the user's request while maintaining process logic and professional quality.
-
-REFINEMENT GUIDELINES:
+    REFINEMENT_GUIDELINES = """REFINEMENT GUIDELINES:
 
 **Layout modifications:**
 - "plus vertical" / "more vertical" → Ensure flowchart TD, arrange nodes top-to-bottom
@@ -208,12 +183,12 @@ REFINEMENT GUIDELINES:
 - "supprimer Y" / "remove Y" → Remove specified element(s)
 
 **Process logic modifications:**
-- "ajouter décision" / "add decision" → Add decision diamond {{}} with branches
+- "ajouter décision" / "add decision" → Add decision diamond {} with branches
 - "ajouter validation" / "add validation" → Add human validation step (orange)
 - "séparer les acteurs" / "separate actors" → Use subgraphs or swimlanes
-- "ajouter boucle" / "add loop" → Add feedback/retry arrows
+- "ajouter boucle" / "add loop" → Add feedback/retry arrows"""
 
-IMPORTANT RULES:
+    REFINEMENT_RULES = """IMPORTANT RULES:
 ✓ Maintain the operational process logic
 ✓ Keep actor color coding (blue=system, green=AI, orange=human)
 ✓ Preserve the sequential flow unless asked to change it
@@ -223,6 +198,146 @@ IMPORTANT RULES:
 
 Respond with ONLY the updated Mermaid diagram in ```mermaid``` code blocks. No explanation."""
 
+    @staticmethod
+    def get_initial_sections(pvb_json: str) -> List[Tuple[str, Optional[int]]]:
+        """
+        Sections of the initial prompt, joined with blank lines.
+
+        Args:
+            pvb_json: Serialized Product Vision Board
+
+        Returns:
+            List of (text, drop rank); sections with a rank may be left out to
+            fit a token budget, lowest rank first, None marks a required one
+        """
+        # The first three sections are SYSTEM_PROMPT, whose KV cache the analyzers
+        # prefill at startup: leaving one out would lose the cached prefix
+        return [
+            (DiagramPrompts.ROLE_PROMPT, None),
+            (DiagramPrompts.EXAMPLE_PROMPT, None),
+            (DiagramPrompts.ANALYSIS_GUIDE, None),
+            (f"Now, analyze this Product Vision Board and create an OPERATIONAL PROCESS DIAGRAM:\n\n{pvb_json}", None),
+            (
+                "YOUR TASK:\nBased on the Product Vision Board above, infer and create a complete "
+                "operational business process diagram.",
+                None
+            ),
+            (DiagramPrompts.ANALYSIS_STEPS, 1),
+            (DiagramPrompts.DIAGRAM_REQUIREMENTS, None),
+        ]
+
+    @staticmethod
+    def get_refinement_sections(
+        pvb_json: str,
+        current_diagram: str,
+        user_feedback: str
+    ) -> List[Tuple[str, Optional[int]]]:
+        """
+        Sections of the refinement prompt, joined with blank lines.
+
+        Args:
+            pvb_json: Serialized Product Vision Board
+            current_diagram: Diagram being refined
+            user_feedback: User's refinement request
+
+        Returns:
+            List of (text, drop rank), as get_initial_sections()
+        """
+        return [
+            ("You are refining an operational business process diagram.", None),
+            (f"CURRENT DIAGRAM:\n```mermaid\n{current_diagram}\n```", None),
+            (f"ORIGINAL PRODUCT VISION BOARD:\n{pvb_json}", 2),
+            (f'USER REQUEST: "{user_feedback}"', None),
+            (
+                "YOUR TASK:\nModify the diagram according to the user's request while maintaining "
+                "process logic and professional quality.",
+                None
+            ),
+            (DiagramPrompts.REFINEMENT_GUIDELINES, 1),
+            (DiagramPrompts.REFINEMENT_RULES, None),
+        ]
+
+    @staticmethod
+    def get_initial_prompt(pvb_data: dict) -> str:
+        """Generate prompt for initial diagram creation from PVB data."""
+        sections = DiagramPrompts.get_initial_sections(json.dumps(pvb_data, indent=2, ensure_ascii=False))
+        return "\n\n".join(text for text, _ in sections)
+
+    @staticmethod
+    def get_refinement_prompt(pvb_data: dict, current_diagram: str, user_feedback: str) -> str:
+        """Generate prompt for diagram refinement based on user feedback."""
+        sections = DiagramPrompts.get_refinement_sections(
+            json.dumps(pvb_data, indent=2, ensure_ascii=False), current_diagram, user_feedback
+        )
+        return "\n\n".join(text for text, _ in sections)
+
+    @staticmethod
+    def get_edit_prompt(current_diagram: str, user_feedback: str) -> str:
+        """Generate prompt for a refinement answered with edit operations."""
+        return f"""You are refining an operational business process diagram.
+
+CURRENT DIAGRAM:
+```mermaid
+{current_diagram}
+```
+
+USER REQUEST: "{user_feedback}"
+
+YOUR TASK:
+Describe the change as a list of edit operations on the CURRENT DIAGRAM, one per line, inside an ```edits``` code block. Do NOT repeat the diagram.
+
+AVAILABLE OPERATIONS:
+- add_node <ID>["<label>"]                → add a node (any Mermaid shape), optionally followed by "in <subgraph ID>"
+- remove_node <ID>                        → remove a node with its edges and styles
+- add_edge <ID> --> <ID>                  → add an edge (any Mermaid link, labels allowed: A -->|"oui"| B)
+- remove_edge <ID> --> <ID>               → remove the edge between two nodes
+- restyle <ID> <properties>               → set the style of a node (fill:#FF9F43,stroke:#E67E22,color:#fff)
+- relabel <ID> "<label>"                  → change the label of a node, keeping its shape
+- direction <TD|LR|BT|RL>                 → change the flow direction
+
+Example, for "ajouter une validation humaine entre E et F":
+```edits
+add_node V["👤 Validation Humaine<br/>Contrôle"] in Process
+remove_edge E --> F
+add_edge E --> V
+add_edge V --> F
+restyle V fill:#FF9F43,stroke:#E67E22,color:#fff
+```
+
+IMPORTANT RULES:
+✓ Only use node IDs that exist in the CURRENT DIAGRAM, or that you add
+✓ Keep actor color coding (blue=system #4A90D9, green=AI #50C878, orange=human #FF9F43)
+✓ Reconnect the flow when you remove a step
+
+Respond with ONLY the ```edits``` code block. No explanation."""
+
+    @staticmethod
+    def get_syntax_retry_prompt(prompt: str, invalid_line: str, error: str) -> str:
+        """Repeat a diagram prompt after an answer was stopped on an invalid line."""
+        return f"""{prompt}
+
+NOTE: a previous answer to this request was stopped because this diagram line is not valid Mermaid flowchart syntax:
+`{invalid_line.strip()}`
+Parser error: {error}
+
+Write the complete diagram again, making sure every line is valid (quote labels containing parentheses, close every bracket, one statement per line)."""
+
+    @staticmethod
+    def get_line_repair_prompt(excerpt: str, error_line: int, error: str) -> str:
+        """Ask for a few diagram lines around a syntax error to be rewritten."""
+        return f"""The following lines are an excerpt of a Mermaid flowchart. Line {error_line} of the excerpt is not valid Mermaid syntax.
+
+EXCERPT:
+```
+{excerpt}
+```
+
+PARSER ERROR: {error}
+
+Rewrite ONLY these lines with the error fixed. Keep the node IDs, labels, links and styles unchanged otherwise, and put labels containing parentheses or brackets in double quotes.
+
+Respond with ONLY a ```mermaid code block containing the corrected lines. No explanation."""
+
     @staticmethod
     def get_chat_message(text: str) -> str:
         """Format a regular chat message (not diagram-related)."""
@@ -0,0 +1,358 @@
+"""
+Cache of complete responses, keyed by a canonical hash of the request.
+
+With greedy decoding (transformers backend), the same board and
+conversation always give the same diagram, and teams re-submit the same
+boards many times. A hit returns the stored answer in milliseconds
+instead of a full generation. Backends that sample (MLX) are not cached.
+
+Two tiers: an in-memory LRU, and an optional SQLite file that survives
+restarts and can be shared by processes on the same host. Both expire
+entries after a TTL.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from .generation_limits import MAX_NEW_TOKENS
+from ..core.fenced_blocks import find_block, scan_fenced_blocks
+from ..core.mermaid_extractor import validate_mermaid_syntax
+from ..utils.metrics import REGISTRY
+
+
+RESPONSE_CACHE_REQUESTS = REGISTRY.counter(
+    "pvb_response_cache_requests_total", "Response cache lookups by result", ["result"]
+)
+
+# Bump when a change makes previously cached responses stale
+CACHE_KEY_VERSION = 2
+
+
+def _canonical_json(value: Any) -> Any:
+    """Sort object keys and normalize whitespace in strings, recursively."""
+    if isinstance(value, dict):
+        return {str(key).strip(): _canonical_json(item) for key, item in sorted(value.items())}
+    if isinstance(value, list):
+        return [_canonical_json(item) for item in value]
+    if isinstance(value, str):
+        return " ".join(value.split())
+    return value
+
+
+def normalize_content(text: str) -> str:
+    """
+    Normalize a message so that equivalent requests share a key.
+
+    JSON objects embedded in the text (the Product Vision Board) are
+    re-serialized with sorted keys and collapsed whitespace; elsewhere line
+    endings and trailing spaces are normalized, keeping line structure
+    (newlines are significant in Mermaid).
+
+    Args:
+        text: Message content
+
+    Returns:
+        Canonical form of the message
+    """
+    decoder = json.JSONDecoder()
+    parts = []
+    position = 0
+    start = text.find("{")
+    while start != -1:
+        try:
+            data, end = decoder.raw_decode(text, start)
+        except json.JSONDecodeError:
+            start = text.find("{", start + 1)
+            continue
+        if isinstance(data, dict):
+            parts.append(text[position:start])
+            parts.append(json.dumps(_canonical_json(data), ensure_ascii=False, separators=(",", ":")))
+            position = end
+        start = text.find("{", end)
+    parts.append(text[position:])
+
+    lines = "".join(parts).replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    return "\n".join(line.rstrip() for line in lines).strip()
+
+
+def response_cache_key(
+    model_name: str,
+    conversation: List[Dict[str, str]],
+    generation_config: Optional[Dict[str, Any]] = None
+) -> str:
+    """
+    Hash a request into a cache key.
+
+    Args:
+        model_name: Model answering the request
+        conversation: List of conversation messages with 'role' and 'content'
+        generation_config: Settings affecting the output (max tokens, precision, ...)
+
+    Returns:
+        Hex SHA-256 digest
+    """
+    payload = {
+        "version": CACHE_KEY_VERSION,
+        "model": model_name,
+        "config": generation_config or {},
+        "conversation": [
+            {"role": message["role"], "content": normalize_content(message["content"])}
+            for message in conversation
+        ]
+    }
+    encoded = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Two-tier (memory LRU, then SQLite) store of responses with a TTL.
+
+    Safe to share between threads.
+    """
+
+    # Expired rows are purged from the SQLite file every this many writes
+    PURGE_EVERY = 100
+
+    def __init__(self, max_entries: int = 256, path: Optional[str] = None, ttl_seconds: float = 24 * 3600):
+        """
+        Initialize the cache.
+
+        Args:
+            max_entries: Responses kept in memory, 0 for the SQLite tier only
+            path: SQLite file of the disk tier, None for memory only
+            ttl_seconds: Age after which an entry is ignored, 0 for no expiry
+        """
+        self.max_entries = max_entries
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+
+        self._memory: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()  # key -> (stored at, response)
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._db = None
+        if path:
+            directory = os.path.dirname(os.path.abspath(path))
+            os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, stored_at REAL NOT NULL)"
+            )
+            self._purge_expired()
+
+    def _expired(self, stored_at: float, now: float) -> bool:
+        return self.ttl_seconds > 0 and now - stored_at > self.ttl_seconds
+
+    def _remember(self, key: str, stored_at: float, response: str):
+        """Insert into the memory tier, evicting the least recently used entries (lock held)."""
+        if self.max_entries <= 0:
+            return
+        self._memory[key] = (stored_at, response)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Look up a response.
+
+        Args:
+            key: Key from response_cache_key()
+
+        Returns:
+            Cached response, None on a miss or an expired entry
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if not self._expired(entry[0], now):
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    RESPONSE_CACHE_REQUESTS.inc(result="memory")
+                    return entry[1]
+                del self._memory[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT response, stored_at FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and not self._expired(row[1], now):
+                    # Promote to the memory tier
+                    self._remember(key, row[1], row[0])
+                    self.disk_hits += 1
+                    RESPONSE_CACHE_REQUESTS.inc(result="disk")
+                    return row[0]
+
+            self.misses += 1
+            RESPONSE_CACHE_REQUESTS.inc(result="miss")
+            return None
+
+    def put(self, key: str, response: str):
+        """
+        Store a complete response in both tiers.
+
+        Args:
+            key: Key from response_cache_key()
+            response: Full response text
+        """
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, response)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, response, stored_at) VALUES (?, ?, ?)",
+                    (key, response, now)
+                )
+                self._writes += 1
+                if self._writes % self.PURGE_EVERY == 0:
+                    self._purge_expired()
+
+    def _purge_expired(self):
+        if self._db is not None and self.ttl_seconds > 0:
+            self._db.execute("DELETE FROM responses WHERE stored_at < ?", (time.time() - self.ttl_seconds,))
+
+    def stats(self) -> Dict:
+        """
+        Get cache counters.
+
+        Returns:
+            Dictionary with memory entries, disk path, hits per tier and misses
+        """
+        with self._lock:
+            return {
+                "memory_entries": len(self._memory),
+                "disk_path": self.path,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses
+            }
+
+    def clear(self):
+        """Drop every entry from both tiers."""
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+
+
+def has_valid_diagram(response: str) -> bool:
+    """
+    Whether a response holds a complete ```mermaid``` block that the chat
+    handler accepts (same validator).
+
+    Args:
+        response: Full response text
+
+    Returns:
+        True if the response is worth caching
+    """
+    block = find_block(scan_fenced_blocks(response), "mermaid")
+    return block is not None and validate_mermaid_syntax(block.content)[0]
+
+
+class CachedAnalyzer:
+    """
+    Analyzer wrapper answering repeated requests from a ResponseCache.
+
+    Only complete generations with a valid diagram are stored: a stream
+    that fails or that the consumer abandons, an invalid diagram (which
+    would be pinned and repaired on every hit) and answers without a
+    diagram are not cached. Other attributes are delegated to the wrapped
+    analyzer.
+    """
+
+    def __init__(
+        self,
+        analyzer,
+        cache: ResponseCache,
+        generation_config: Optional[Dict[str, Any]] = None,
+        model_name: Optional[str] = None
+    ):
+        """
+        Initialize the wrapper.
+
+        Args:
+            analyzer: Analyzer to answer cache misses (only deterministic
+                backends: a sampled answer would be pinned)
+            cache: Response cache
+            generation_config: Settings affecting the output, mixed into the
+                key (backend, precision, constrained decoding, ...)
+            model_name: Configured model, keying requests that do not name one
+                (the analyzer may still be loading and not know it yet)
+        """
+        self.analyzer = analyzer
+        self.cache = cache
+        self.generation_config = generation_config or {}
+        self.configured_model = model_name or "default"
+
+    def __getattr__(self, name):
+        if name == "analyzer":
+            raise AttributeError(name)
+        return getattr(self.analyzer, name)
+
+    def _key(self, conversation: List[Dict[str, str]], max_tokens: int, kwargs: Dict) -> str:
+        # Pools take the model per request, otherwise the configured one
+        model_name = kwargs.get("model") or self.configured_model
+        config = {
+            **self.generation_config,
+            "max_tokens": max_tokens,
+            "prompt_lookup": bool(kwargs.get("prompt_lookup", False))
+        }
+        return response_cache_key(model_name, conversation, config)
+
+    def generate_response(
+        self,
+        conversation: List[Dict[str, str]],
+        max_tokens: int = MAX_NEW_TOKENS,
+        **kwargs
+    ) -> str:
+        """Generate a response, or return the cached one."""
+        key = self._key(conversation, max_tokens, kwargs)
+        response = self.cache.get(key)
+        if response is None:
+            response = self.analyzer.generate_response(conversation, max_tokens=max_tokens, **kwargs)
+            if has_valid_diagram(response):
+                self.cache.put(key, response)
+        return response.strip()
+
+    def generate_response_stream(
+        self,
+        conversation: List[Dict[str, str]],
+        max_tokens: int = MAX_NEW_TOKENS,
+        **kwargs
+    ) -> Iterator[str]:
+        """Stream a response, or yield the cached one as a single chunk."""
+        key = self._key(conversation, max_tokens, kwargs)
+        response = self.cache.get(key)
+        if response is not None:
+            yield response
+            return
+
+        chunks = []
+        for chunk in self.analyzer.generate_response_stream(conversation, max_tokens=max_tokens, **kwargs):
+            chunks.append(chunk)
+            yield chunk
+        response = "".join(chunks)
+        if has_valid_diagram(response):
+            self.cache.put(key, response)
+
+    def get_response_cache_stats(self) -> Dict:
+        """
+        Get response cache counters.
+
+        Returns:
+            Dictionary with memory entries, disk path, hits per tier and misses
+        """
+        return self.cache.stats()
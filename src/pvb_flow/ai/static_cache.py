@@ -0,0 +1,174 @@
+"""
+Static KV caches and compiled decoding for the transformers backend.
+
+With the default DynamicCache, every decode step runs eagerly and pays
+Python dispatch for each of the model's operations, which dominates the
+per-token time of small models. A StaticCache has fixed shapes, which lets
+generate() run the decode step through torch.compile (CUDA graphs on GPU).
+
+Shapes are fixed by the cache length, so requests are padded to a few
+length buckets: each bucket compiles once, and its preallocated caches are
+reused across requests (reusing the same tensors also keeps CUDA graphs
+valid).
+"""
+import threading
+from typing import Dict, List, Optional, Sequence
+
+import torch
+from transformers import DynamicCache, StaticCache
+
+from .kv_cache import cache_from_tensors, cache_tensors
+
+
+# Cache lengths (prompt + generated tokens) requests are padded to
+CACHE_LENGTH_BUCKETS = (1024, 2048, 4096, 8192, 16384, 32768)
+
+# Free caches kept per bucket; a 32768-token cache of a 24B model takes several GB
+MAX_CACHES_PER_BUCKET = 2
+
+
+def bucket_length(needed: int, buckets: Sequence[int] = CACHE_LENGTH_BUCKETS) -> Optional[int]:
+    """
+    Get the smallest bucket holding `needed` tokens.
+
+    Args:
+        needed: Prompt tokens plus maximum new tokens
+        buckets: Ascending cache lengths
+
+    Returns:
+        Bucket length, None if the request exceeds the largest bucket
+    """
+    for length in buckets:
+        if needed <= length:
+            return length
+    return None
+
+
+def fill_static_cache(static_cache: StaticCache, cache: DynamicCache):
+    """
+    Copy the tokens of a DynamicCache at the start of an empty StaticCache.
+
+    generate() then only prefills the rest of the prompt, so the prefix and
+    session caches keep working in static mode.
+
+    Args:
+        static_cache: Empty StaticCache, long enough for the copied tokens
+        cache: DynamicCache covering a prefix of the prompt
+    """
+    for layer_idx, (keys, values) in enumerate(cache_tensors(cache)):
+        positions = torch.arange(keys.shape[-2], device=keys.device)
+        static_cache.update(keys, values, layer_idx, {"cache_position": positions})
+
+
+def static_to_dynamic_cache(static_cache: StaticCache) -> DynamicCache:
+    """
+    Copy the filled part of a StaticCache into a DynamicCache.
+
+    Args:
+        static_cache: StaticCache after generation
+
+    Returns:
+        DynamicCache holding copies of the cached tokens (the static cache
+        is reset and reused by the next request)
+    """
+    length = static_cache.get_seq_length()
+    return cache_from_tensors([
+        (keys[:, :, :length].clone(), values[:, :, :length].clone())
+        for keys, values in cache_tensors(static_cache)
+    ])
+
+
+class StaticCachePool:
+    """
+    Preallocated StaticCaches per length bucket, reused across requests.
+
+    A cache is lent to one generation at a time; concurrent requests in the
+    same bucket get extra caches, of which at most max_per_bucket are kept
+    for later reuse.
+    """
+
+    def __init__(
+        self,
+        config,
+        buckets: Sequence[int] = CACHE_LENGTH_BUCKETS,
+        max_per_bucket: int = MAX_CACHES_PER_BUCKET
+    ):
+        """
+        Initialize an empty pool (caches are allocated on first use).
+
+        Args:
+            config: Model configuration (layers, heads, head size)
+            buckets: Ascending cache lengths
+            max_per_bucket: Free caches kept per bucket, the others are dropped
+                when released
+        """
+        self.config = config
+        self.buckets = tuple(sorted(buckets))
+        self.max_per_bucket = max_per_bucket
+        self._free: Dict[int, List[StaticCache]] = {length: [] for length in self.buckets}
+        self._lengths: Dict[int, int] = {}  # id(cache) -> bucket length
+        self._lock = threading.Lock()
+        self.allocated = 0
+        self.hits = 0
+        self.dropped = 0
+
+    def acquire(self, needed: int) -> Optional[StaticCache]:
+        """
+        Borrow an empty cache for a request.
+
+        Args:
+            needed: Prompt tokens plus maximum new tokens
+
+        Returns:
+            StaticCache of the smallest fitting bucket, None if the request is
+            longer than the largest bucket
+        """
+        length = bucket_length(needed, self.buckets)
+        if length is None:
+            return None
+
+        with self._lock:
+            if self._free[length]:
+                self.hits += 1
+                return self._free[length].pop()
+            self.allocated += 1
+
+        cache = StaticCache(config=self.config, max_cache_len=length)
+        with self._lock:
+            self._lengths[id(cache)] = length
+        return cache
+
+    def release(self, cache: StaticCache):
+        """Reset a borrowed cache and make it available again, unless its bucket is full."""
+        cache.reset()
+        with self._lock:
+            length = self._lengths.get(id(cache))
+            if length is None:
+                return
+            if len(self._free[length]) >= self.max_per_bucket:
+                del self._lengths[id(cache)]
+                self.dropped += 1
+            else:
+                self._free[length].append(cache)
+
+    def stats(self) -> dict:
+        """
+        Get pool counters.
+
+        Returns:
+            Dictionary with buckets, allocated, reused and dropped caches
+        """
+        with self._lock:
+            return {
+                "buckets": list(self.buckets),
+                "allocated": self.allocated,
+                "hits": self.hits,
+                "dropped": self.dropped,
+                "free": {length: len(caches) for length, caches in self._free.items() if caches}
+            }
+
+    def clear(self):
+        """Drop every cache (e.g. when the model is unloaded)."""
+        with self._lock:
+            self._free = {length: [] for length in self.buckets}
+            self._lengths = {}
@@ -0,0 +1,255 @@
+"""
+Model-free analyzer for benchmarking and testing the app plumbing.
+
+Replays recorded responses, or builds a templated Mermaid diagram from the
+Product Vision Board in the prompt, and streams it with a configurable
+time to first token, decode speed and jitter. Responses and timings are
+deterministic for a given conversation, so runs can be compared.
+"""
+import hashlib
+import json
+import random
+import re
+import time
+from typing import Dict, Iterator, List, Optional
+
+from .generation_limits import CHARS_PER_TOKEN, MAX_NEW_TOKENS
+
+
+# Diagram embedded in refinement and edit prompts
+CURRENT_DIAGRAM_PATTERN = re.compile(r"CURRENT DIAGRAM:\s*```mermaid\s*\n(.*?)\n\s*```", re.DOTALL)
+
+FEATURES_SECTION = "3. Fonctionnalités Clés"
+MAX_TEMPLATE_STEPS = 6
+
+
+def load_recorded_responses(path: str) -> List[str]:
+    """
+    Load recorded responses from a file.
+
+    Accepts a JSON list, or JSON Lines, of strings or of objects with a
+    "response" field.
+
+    Args:
+        path: Path to the recording
+
+    Returns:
+        List of response texts
+    """
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+
+    try:
+        records = json.loads(text)
+    except json.JSONDecodeError:
+        records = [json.loads(line) for line in text.splitlines() if line.strip()]
+    if not isinstance(records, list):
+        records = [records]
+
+    responses = [record["response"] if isinstance(record, dict) else str(record) for record in records]
+    if not responses:
+        raise ValueError(f"No recorded responses in {path}")
+    return responses
+
+
+def _find_pvb(prompt: str) -> Optional[Dict]:
+    """Find the Product Vision Board JSON object embedded in a prompt."""
+    decoder = json.JSONDecoder()
+    start = prompt.find("{")
+    while start != -1:
+        try:
+            data, _ = decoder.raw_decode(prompt, start)
+            if isinstance(data, dict) and FEATURES_SECTION in data:
+                return data
+        except json.JSONDecodeError:
+            pass
+        start = prompt.find("{", start + 1)
+    return None
+
+
+def _label(text: str) -> str:
+    """Make text safe inside a quoted Mermaid label."""
+    return str(text).replace('"', "'").replace("\n", " ").strip()
+
+
+def template_response(prompt: str) -> str:
+    """
+    Build a plausible answer to a prompt without a model.
+
+    Refinements echo the current diagram; initial requests get a linear
+    flowchart of the PVB's key features.
+
+    Args:
+        prompt: Last user message sent to the model
+
+    Returns:
+        Response text with a ```mermaid``` block
+    """
+    match = CURRENT_DIAGRAM_PATTERN.search(prompt)
+    if match:
+        return f"Voici le diagramme mis à jour.\n\n```mermaid\n{match.group(1).strip()}\n```"
+
+    pvb = _find_pvb(prompt) or {}
+    features = [_label(item) for item in pvb.get(FEATURES_SECTION, []) if str(item).strip()]
+    steps = features[:MAX_TEMPLATE_STEPS] or ["Traitement des données"]
+
+    lines = [
+        "flowchart TD",
+        "    subgraph Légende",
+        "        L1[🖥️ Système]",
+        "        L2[🤖 IA]",
+        "        L3[👤 Humain]",
+        "    end",
+        '    S[/"📊 Source de Données"/]'
+    ]
+    previous = "S"
+    for index, step in enumerate(steps, start=1):
+        lines.append(f'    N{index}["⚙️ {step}"]')
+        lines.append(f"    {previous} --> N{index}")
+        previous = f"N{index}"
+    lines.append('    R[("💾 Résultat")]')
+    lines.append(f"    {previous} --> R")
+    lines.append("    style S fill:#4A90D9,stroke:#2E5C8A,color:#fff")
+    lines.append("    style R fill:#4A90D9,stroke:#2E5C8A,color:#fff")
+
+    diagram = "\n".join(lines)
+    return f"Voici le diagramme du processus opérationnel.\n\n```mermaid\n{diagram}\n```"
+
+
+def split_tokens(text: str, chars_per_token: int = CHARS_PER_TOKEN) -> List[str]:
+    """
+    Split text into pseudo-tokens of about `chars_per_token` characters.
+
+    Whitespace is attached to the following word, as BPE tokenizers do.
+
+    Args:
+        text: Text to split
+        chars_per_token: Maximum characters per pseudo-token
+
+    Returns:
+        Pseudo-tokens, concatenating back to the text
+    """
+    return re.findall(rf"\s*\S{{1,{chars_per_token}}}|\s+", text)
+
+
+class StubAnalyzer:
+    """
+    Analyzer that replays recorded or templated responses with simulated timings.
+
+    Exposes the analyzer interface without loading any model.
+    """
+
+    def __init__(
+        self,
+        responses: Optional[List[str]] = None,
+        responses_path: Optional[str] = None,
+        time_to_first_token: float = 0.5,
+        tokens_per_second: float = 30.0,
+        jitter: float = 0.0,
+        seed: int = 0,
+        model_name: str = "stub"
+    ):
+        """
+        Initialize the stub analyzer.
+
+        Args:
+            responses: Responses to replay, chosen per conversation (default:
+                templated from the prompt)
+            responses_path: File to load recorded responses from (see
+                load_recorded_responses()), used when `responses` is None
+            time_to_first_token: Seconds before the first token (prefill)
+            tokens_per_second: Simulated decode speed, 0 for no delay
+            jitter: Relative random variation of each delay, 0 to 1
+            seed: Seed mixed into the per-conversation random generator
+            model_name: Name reported to the UI
+        """
+        if responses is None and responses_path:
+            responses = load_recorded_responses(responses_path)
+
+        self.responses = responses
+        self.time_to_first_token = time_to_first_token
+        self.tokens_per_second = tokens_per_second
+        self.jitter = min(max(jitter, 0.0), 1.0)
+        self.seed = seed
+        self.model_name = model_name
+        self.requests = 0
+
+        source = f"{len(responses)} recorded responses" if responses else "templated responses"
+        print(f"✓ Stub analyzer ({source}, TTFT {time_to_first_token:g}s, {tokens_per_second:g} tokens/s)")
+
+    @property
+    def is_loaded(self) -> bool:
+        """Always loaded: there is no model."""
+        return True
+
+    def _conversation_key(self, conversation: List[Dict[str, str]]) -> int:
+        """Stable hash of a conversation, selecting its response and timings."""
+        content = json.dumps(conversation, ensure_ascii=False, sort_keys=True)
+        digest = hashlib.sha256(f"{self.seed}:{content}".encode("utf-8")).digest()
+        return int.from_bytes(digest[:8], "big")
+
+    def _response_for(self, conversation: List[Dict[str, str]]) -> str:
+        if self.responses:
+            return self.responses[self._conversation_key(conversation) % len(self.responses)]
+        prompt = conversation[-1]["content"] if conversation else ""
+        return template_response(prompt)
+
+    def _delay(self, seconds: float, rng: random.Random) -> float:
+        if seconds <= 0:
+            return 0.0
+        return seconds * (1 + rng.uniform(-self.jitter, self.jitter))
+
+    def generate_response(
+        self,
+        conversation: List[Dict[str, str]],
+        max_tokens: int = MAX_NEW_TOKENS,
+        session_id: Optional[str] = None,
+        prompt_lookup: bool = False
+    ) -> str:
+        """
+        Generate a response, taking as long as streaming it would.
+
+        Args:
+            conversation: List of conversation messages with 'role' and 'content'
+            max_tokens: Maximum tokens to generate
+            session_id: Unused, accepted for interface compatibility
+            prompt_lookup: Unused, accepted for interface compatibility
+
+        Returns:
+            Response text
+        """
+        return "".join(self.generate_response_stream(conversation, max_tokens=max_tokens)).strip()
+
+    def generate_response_stream(
+        self,
+        conversation: List[Dict[str, str]],
+        max_tokens: int = MAX_NEW_TOKENS,
+        session_id: Optional[str] = None,
+        prompt_lookup: bool = False
+    ) -> Iterator[str]:
+        """
+        Stream a response one pseudo-token at a time.
+
+        Args:
+            conversation: List of conversation messages with 'role' and 'content'
+            max_tokens: Maximum tokens to generate
+            session_id: Unused, accepted for interface compatibility
+            prompt_lookup: Unused, accepted for interface compatibility
+
+        Yields:
+            Pseudo-token text chunks, in order
+        """
+        self.requests += 1
+        rng = random.Random(self._conversation_key(conversation))
+        tokens = split_tokens(self._response_for(conversation))[:max_tokens]
+        token_seconds = 1.0 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+
+        time.sleep(self._delay(self.time_to_first_token, rng))
+        for index, token in enumerate(tokens):
+            if index:
+                time.sleep(self._delay(token_seconds, rng))
+            yield token
+
+    def cleanup_model(self):
+        """Nothing to free."""
+        print("✓ Stub analyzer cleaned up")
@@ -0,0 +1,425 @@
+"""
+Edit operations for refining a Mermaid flowchart without regenerating it.
+
+In edit mode the model answers a refinement request with a short
+```edits``` block instead of the whole diagram, one operation per line:
+
+    add_node V["👤 Validation"] in Process
+    remove_node Y
+    add_edge E --> V
+    remove_edge E --> F
+    restyle V fill:#FF9F43,stroke:#E67E22,color:#fff
+    relabel D "🤖 Analyse IA<br/>Classification"
+    direction LR
+
+The operations are applied deterministically to the current diagram, so
+the output length scales with the size of the change.
+"""
+import re
+from typing import List, Optional, Tuple
+
+from .fenced_blocks import find_block, scan_fenced_blocks
+from .mermaid_grammar import COMPLETE, DIRECTIONS, NODE_SHAPES, check_line, split_chain
+
+
+OPERATIONS = ("add_node", "remove_node", "add_edge", "remove_edge", "restyle", "relabel", "direction")
+
+_NODE_ID_PATTERN = re.compile(r"^\w+")
+_IN_SUBGRAPH_PATTERN = re.compile(r"^(.*\S)\s+in\s+(\w+)$")
+_HEADER_PATTERN = re.compile(r"^(\s*(?:flowchart|graph))(?:\s+(\w+))?(\s*;?\s*)$")
+
+INDENT = "    "
+
+
+class EditError(ValueError):
+    """An edit operation is malformed or does not apply to the diagram."""
+
+
+class EditOperation:
+    """One parsed edit operation."""
+
+    __slots__ = ("name", "argument")
+
+    def __init__(self, name: str, argument: str):
+        self.name = name
+        self.argument = argument
+
+    def __repr__(self):
+        return f"EditOperation({self.name!r}, {self.argument!r})"
+
+
+def extract_edit_operations(llm_response: str) -> Optional[List[EditOperation]]:
+    """
+    Parse the ```edits``` block of a response.
+
+    Args:
+        llm_response: Full response from the LLM
+
+    Returns:
+        List of operations, or None if the response has no edits block
+
+    Raises:
+        EditError: If a line is not a known operation
+    """
+    block = find_block(scan_fenced_blocks(llm_response), "edits")
+    if block is None:
+        return None
+
+    operations = []
+    for line in block.content.split("\n"):
+        line = line.strip()
+        if not line or line.startswith("%%"):
+            continue
+        name, _, argument = line.partition(" ")
+        if name not in OPERATIONS:
+            raise EditError(f"Unknown edit operation: {name}")
+        operations.append(EditOperation(name, argument.strip()))
+    return operations
+
+
+def apply_edit_operations(diagram: str, operations: List[EditOperation]) -> str:
+    """
+    Apply edit operations to a diagram, in order.
+
+    Args:
+        diagram: Current Mermaid diagram code
+        operations: Operations to apply
+
+    Returns:
+        Updated diagram code
+
+    Raises:
+        EditError: If an operation does not apply (unknown node, invalid syntax...)
+    """
+    lines = diagram.split("\n")
+    for operation in operations:
+        handler = _HANDLERS[operation.name]
+        lines = handler(lines, operation.argument)
+    return "\n".join(lines)
+
+
+def _node_id(node_text: str) -> str:
+    return _NODE_ID_PATTERN.match(node_text).group(0)
+
+
+def _has_shape(node_text: str) -> bool:
+    return node_text.split(":::", 1)[0] != _node_id(node_text)
+
+
+def _indent_of(line: str) -> str:
+    return line[:len(line) - len(line.lstrip())]
+
+
+def _first_word(line: str) -> str:
+    words = line.split(None, 1)
+    return words[0].rstrip(";") if words else ""
+
+
+def _statement_target(line: str, keyword: str) -> Optional[str]:
+    """Node id of a 'style X ...' / 'click X ...' line, if it has that keyword."""
+    words = line.split()
+    if len(words) >= 2 and words[0] == keyword:
+        return words[1]
+    return None
+
+
+def _node_ids(lines: List[str]) -> set:
+    ids = set()
+    for line in lines:
+        parts = split_chain(line)
+        if parts:
+            for group in parts[::2]:
+                ids.update(_node_id(node) for node in group)
+    return ids
+
+
+def _require_node(lines: List[str], node_id: str):
+    if node_id not in _node_ids(lines):
+        raise EditError(f"Unknown node: {node_id}")
+
+
+def _parse_single_node(text: str) -> str:
+    parts = split_chain(text)
+    if not parts or len(parts) != 1 or len(parts[0]) != 1:
+        raise EditError(f"Invalid node definition: {text}")
+    return parts[0][0]
+
+
+def _last_index(lines: List[str], predicate, default: int) -> int:
+    for index in range(len(lines) - 1, -1, -1):
+        if predicate(lines[index]):
+            return index
+    return default
+
+
+def _insert_after(lines: List[str], index: int, text: str) -> List[str]:
+    """Insert a statement after lines[index], with that line's indentation."""
+    if 0 <= index < len(lines) and lines[index].strip() and not _HEADER_PATTERN.match(lines[index]):
+        indent = _indent_of(lines[index])
+    else:
+        indent = INDENT
+    return lines[:index + 1] + [indent + text] + lines[index + 1:]
+
+
+def _is_edge(line: str) -> bool:
+    parts = split_chain(line)
+    return bool(parts) and len(parts) > 1
+
+
+def _is_definition(line: str) -> bool:
+    parts = split_chain(line)
+    return bool(parts) and len(parts) == 1
+
+
+def _subgraph_end(lines: List[str], subgraph_id: str) -> int:
+    """Index of the 'end' line closing a subgraph."""
+    depth = 0
+    start = None
+    for index, line in enumerate(lines):
+        word = _first_word(line)
+        if word == "subgraph":
+            if start is None:
+                name = line.split(None, 1)[1] if len(line.split(None, 1)) > 1 else ""
+                if _NODE_ID_PATTERN.match(name) and _node_id(name) == subgraph_id:
+                    start = index
+                    depth = 0
+            depth += 1
+        elif word == "end":
+            depth -= 1
+            if start is not None and depth == 0:
+                return index
+    raise EditError(f"Unknown subgraph: {subgraph_id}")
+
+
+def _add_node(lines: List[str], argument: str) -> List[str]:
+    subgraph_id = None
+    match = _IN_SUBGRAPH_PATTERN.match(argument)
+    if match and split_chain(match.group(1)) is not None:
+        argument, subgraph_id = match.group(1), match.group(2)
+
+    node = _parse_single_node(argument)
+    if _node_id(node) in _node_ids(lines):
+        raise EditError(f"Node already exists: {_node_id(node)}")
+
+    if subgraph_id is not None:
+        end = _subgraph_end(lines, subgraph_id)
+        return lines[:end] + [_indent_of(lines[end]) + INDENT + node] + lines[end:]
+
+    # After the last node definition, else right after the header
+    index = _last_index(lines, _is_definition, 0)
+    return _insert_after(lines, index, node)
+
+
+def _rebuild_edges(indent: str, parts: list, keep_pair, keep_node) -> Tuple[List[str], List[int]]:
+    """
+    Rewrite a chain statement as the pairwise edges that are kept.
+
+    A group edge keeps its '&' groups unless some of its node pairs are
+    dropped, in which case it is split per source node. Nodes left out of
+    every kept edge get a standalone definition; the indexes of those that
+    are a bare id are returned too, for _drop_redundant_nodes.
+    """
+    groups = [[node for node in group if keep_node(_node_id(node))] for group in parts[::2]]
+    links = parts[1::2]
+
+    edges = []
+    kept_definitions = set()
+    for index, link in enumerate(links):
+        source, target = groups[index], groups[index + 1]
+        if all(keep_pair(node, other) for node in source for other in target):
+            pairs = [(source, target)] if source and target else []
+        else:
+            pairs = [([node], [other for other in target if keep_pair(node, other)]) for node in source]
+        for sources, targets in pairs:
+            if targets:
+                edges.append(f"{' & '.join(sources)} {link} {' & '.join(targets)}")
+                kept_definitions.update(sources + targets)
+
+    orphans = []
+    for group in groups:
+        orphans.extend(node for node in group if node not in kept_definitions and node not in orphans)
+    bare = [index for index, node in enumerate(orphans) if not _has_shape(node)]
+    return [indent + text for text in orphans + edges], bare
+
+
+def _drop_redundant_nodes(lines: List[str], bare: List[int]) -> List[str]:
+    """
+    Remove the bare-id definitions added by _rebuild_edges for nodes that
+    still appear in another statement.
+
+    Args:
+        lines: Edited diagram lines
+        bare: Indexes of the added bare-id definitions
+
+    Returns:
+        Lines where each remaining node still appears once at least
+    """
+    dropped = set()
+    for index in bare:
+        others = [line for position, line in enumerate(lines) if position != index and position not in dropped]
+        if lines[index].strip() in _node_ids(others):
+            dropped.add(index)
+    return [line for index, line in enumerate(lines) if index not in dropped]
+
+
+def _remove_node(lines: List[str], node_id: str) -> List[str]:
+    _require_node(lines, node_id)
+
+    result = []
+    bare = []
+    for line in lines:
+        parts = split_chain(line)
+        if parts:
+            if not any(_node_id(node) == node_id for group in parts[::2] for node in group):
+                result.append(line)
+            elif len(parts) == 1:
+                others = [node for node in parts[0] if _node_id(node) != node_id]
+                if others:
+                    result.append(_indent_of(line) + " & ".join(others))
+            else:
+                rebuilt, rebuilt_bare = _rebuild_edges(
+                    _indent_of(line), parts,
+                    keep_pair=lambda source, target: True,
+                    keep_node=lambda other: other != node_id
+                )
+                bare.extend(len(result) + index for index in rebuilt_bare)
+                result.extend(rebuilt)
+            continue
+
+        words = line.split()
+        if words and words[0] in ("style", "click") and words[1:2] == [node_id]:
+            continue
+        if words and words[0] == "class" and len(words) >= 3:
+            members = [member for member in words[1].split(",") if member != node_id]
+            if not members:
+                continue
+            if len(members) != len(words[1].split(",")):
+                line = f"{_indent_of(line)}class {','.join(members)} {' '.join(words[2:])}"
+        result.append(line)
+    return _drop_redundant_nodes(result, bare)
+
+
+def _edge_endpoints(argument: str) -> Tuple[List[str], List[str], str]:
+    parts = split_chain(argument)
+    if not parts or len(parts) != 3:
+        raise EditError(f"Invalid edge: {argument}")
+    return [_node_id(node) for node in parts[0]], [_node_id(node) for node in parts[2]], parts[1]
+
+
+def _add_edge(lines: List[str], argument: str) -> List[str]:
+    if check_line(argument)[0] != COMPLETE or not _is_edge(argument):
+        raise EditError(f"Invalid edge: {argument}")
+
+    index = _last_index(lines, _is_edge, -1)
+    if index == -1:
+        index = _last_index(lines, _is_definition, len(lines) - 1)
+    return _insert_after(lines, index, argument.strip())
+
+
+def _remove_edge(lines: List[str], argument: str) -> List[str]:
+    sources, targets, _ = _edge_endpoints(argument)
+
+    def is_removed(source: str, target: str) -> bool:
+        return _node_id(source) in sources and _node_id(target) in targets
+
+    removed = False
+    result = []
+    bare = []
+    for line in lines:
+        parts = split_chain(line)
+        if parts and len(parts) > 1 and any(
+            is_removed(source, target)
+            for index in range(0, len(parts) - 2, 2)
+            for source in parts[index] for target in parts[index + 2]
+        ):
+            removed = True
+            rebuilt, rebuilt_bare = _rebuild_edges(
+                _indent_of(line), parts,
+                keep_pair=lambda source, target: not is_removed(source, target),
+                keep_node=lambda node_id: True
+            )
+            bare.extend(len(result) + index for index in rebuilt_bare)
+            result.extend(rebuilt)
+        else:
+            result.append(line)
+
+    if not removed:
+        raise EditError(f"Unknown edge: {argument}")
+    return _drop_redundant_nodes(result, bare)
+
+
+def _restyle(lines: List[str], argument: str) -> List[str]:
+    node_id, _, properties = argument.partition(" ")
+    statement = f"style {node_id} {properties.strip()}"
+    if not properties.strip() or check_line(statement)[0] != COMPLETE:
+        raise EditError(f"Invalid style: {argument}")
+    _require_node(lines, node_id)
+
+    for index, line in enumerate(lines):
+        if _statement_target(line.strip(), "style") == node_id:
+            return lines[:index] + [_indent_of(line) + statement] + lines[index + 1:]
+
+    index = _last_index(lines, lambda line: _first_word(line) == "style", len(lines) - 1)
+    return _insert_after(lines, index, statement)
+
+
+def _relabel_node(node_text: str, label: str) -> str:
+    node_id = _node_id(node_text)
+    shape, _, css_class = node_text[len(node_id):].partition(":::")
+    for opening, closing in NODE_SHAPES:
+        if shape.startswith(opening) and shape.endswith(closing) and len(shape) >= len(opening) + len(closing):
+            relabeled = f'{node_id}{opening}"{label}"{closing}'
+            return relabeled + (f":::{css_class}" if css_class else "")
+    return f'{node_id}["{label}"]' + (f":::{css_class}" if css_class else "")
+
+
+def _relabel(lines: List[str], argument: str) -> List[str]:
+    node_id, _, label = argument.partition(" ")
+    label = label.strip()
+    if len(label) >= 2 and label[0] == label[-1] == '"':
+        label = label[1:-1]
+    if not label:
+        raise EditError(f"Missing label: {argument}")
+    label = label.replace('"', "#quot;")
+    _require_node(lines, node_id)
+
+    for index, line in enumerate(lines):
+        parts = split_chain(line)
+        if not parts:
+            continue
+        for group in parts[::2]:
+            for position, node in enumerate(group):
+                if _node_id(node) == node_id and _has_shape(node):
+                    group[position] = _relabel_node(node, label)
+                    rebuilt = " ".join(
+                        " & ".join(part) if isinstance(part, list) else part
+                        for part in parts
+                    )
+                    return lines[:index] + [_indent_of(line) + rebuilt] + lines[index + 1:]
+
+    # Node only used in edges so far: give it a definition
+    index = _last_index(lines, _is_definition, 0)
+    return _insert_after(lines, index, f'{node_id}["{label}"]')
+
+
+def _direction(lines: List[str], argument: str) -> List[str]:
+    direction = argument.strip().upper()
+    if direction not in DIRECTIONS:
+        raise EditError(f"Invalid direction: {argument}")
+
+    for index, line in enumerate(lines):
+        match = _HEADER_PATTERN.match(line)
+        if match:
+            return lines[:index] + [f"{match.group(1)} {direction}"] + lines[index + 1:]
+    raise EditError("Diagram has no flowchart header")
+
+
+_HANDLERS = {
+    "add_node": _add_node,
+    "remove_node": _remove_node,
+    "add_edge": _add_edge,
+    "remove_edge": _remove_edge,
+    "restyle": _restyle,
+    "relabel": _relabel,
+    "direction": _direction,
+}
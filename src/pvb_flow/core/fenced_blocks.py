@@ -0,0 +1,228 @@
+"""
+Single-pass scanner for the fenced code blocks of a response.
+
+A response is split into text segments and ```lang``` code blocks, with
+their offsets, in one pass over its lines. The scanner is incremental, so
+a live token stream can be fed chunk by chunk and queried at any time for
+the block being written. As in CommonMark, an opening fence starts its
+line (up to 3 spaces of indentation) and its info string has no backtick,
+so inline triple backticks in prose stay text. Fences may end with '\r\n'
+or trailing spaces.
+"""
+from typing import Iterable, List, Optional
+
+
+TEXT = "text"
+CODE = "code"
+
+FENCE = "```"
+
+# Indentation allowed before an opening fence
+MAX_FENCE_INDENT = 3
+
+
+class Segment:
+    """A run of text, or a fenced code block, of a scanned response."""
+
+    __slots__ = ("kind", "language", "content", "start", "end", "closed")
+
+    def __init__(self, kind: str, start: int, language: Optional[str] = None):
+        self.kind = kind
+        self.language = language  # First word of the fence info string, "" if none
+        self.content = ""  # Text, or code lines without the fences (complete lines only while open)
+        self.start = start  # Offset of the text, or of the opening fence
+        self.end = start  # Offset after the text, or after the closing fence
+        self.closed = kind == TEXT
+
+    def __repr__(self):
+        if self.kind == TEXT:
+            return f"Segment(text, {self.start}:{self.end})"
+        return f"Segment(code {self.language!r}, {self.start}:{self.end}, closed={self.closed})"
+
+
+class FencedBlockScanner:
+    """
+    Split text into segments as it arrives.
+
+    Usage:
+        scanner = FencedBlockScanner()
+        for chunk in stream:
+            scanner.feed(chunk)
+            block = scanner.open_block  # Block being written, if any
+        segments = scanner.finish()
+    """
+
+    __slots__ = ("segments", "open_block", "pending_line", "_offset", "_text", "_code_lines")
+
+    def __init__(self):
+        self.segments: List[Segment] = []  # Completed segments, in order
+        self.open_block: Optional[Segment] = None
+        self.pending_line = ""  # Last line, not terminated yet
+        self._offset = 0  # Offset of pending_line
+        self._text: Optional[Segment] = None  # Text segment being accumulated
+        self._code_lines = 0  # Lines in the open block
+
+    def feed(self, chunk: str) -> List[Segment]:
+        """
+        Scan more text.
+
+        Args:
+            chunk: Text following what was fed so far
+
+        Returns:
+            Segments completed by this chunk
+        """
+        completed = len(self.segments)
+        text = self.pending_line + chunk
+        position = 0
+        newline = text.find("\n")
+        while newline != -1:
+            self._line(text[position:newline + 1], self._offset)
+            self._offset += newline + 1 - position
+            position = newline + 1
+            newline = text.find("\n", position)
+        self.pending_line = text[position:]
+        return self.segments[completed:]
+
+    def finish(self) -> List[Segment]:
+        """
+        Scan the last line and close the segments still open.
+
+        Returns:
+            All segments; a block without a closing fence has closed=False
+        """
+        if self.pending_line:
+            self._line(self.pending_line, self._offset)
+            self._offset += len(self.pending_line)
+            self.pending_line = ""
+        self._end_text()
+        if self.open_block is not None:
+            self.open_block.end = self._offset
+            self.segments.append(self.open_block)
+            self.open_block = None
+        return self.segments
+
+    @property
+    def fence_pending(self) -> bool:
+        """Whether the unterminated last line may be an opening fence."""
+        if self.open_block is not None:
+            return False
+        stripped = self.pending_line.lstrip(" ")
+        indent = len(self.pending_line) - len(stripped)
+        return bool(stripped) and indent <= MAX_FENCE_INDENT and FENCE.startswith(stripped[:len(FENCE)])
+
+    def _line(self, line: str, offset: int):
+        """Process one line, with its newline if any."""
+        body = line.rstrip("\r\n")
+        block = self.open_block
+
+        if block is not None:
+            stripped = body.strip()
+            if stripped.startswith(FENCE) and not stripped.strip("`"):
+                block.end = offset + len(body)
+                block.closed = True
+                self.segments.append(block)
+                self.open_block = None
+                self._code_lines = 0
+                # The line break after the fence starts the next text segment
+                self._add_text(line[len(body):], block.end)
+            else:
+                block.content += "\n" + body if self._code_lines else body
+                self._code_lines += 1
+            return
+
+        info = _opening_fence_info(body)
+        if info is None:
+            self._add_text(line, offset)
+            return
+
+        fence = len(body) - len(body.lstrip(" "))
+        self._add_text(line[:fence], offset)
+        self._end_text()
+        self.open_block = Segment(CODE, offset + fence, info.split(None, 1)[0] if info else "")
+        self.open_block.end = offset + len(line)
+
+    def _add_text(self, text: str, offset: int):
+        if not text:
+            return
+        if self._text is None:
+            self._text = Segment(TEXT, offset)
+        self._text.content += text
+        self._text.end = offset + len(text)
+
+    def _end_text(self):
+        if self._text is not None:
+            self.segments.append(self._text)
+            self._text = None
+
+
+def _opening_fence_info(line: str) -> Optional[str]:
+    """
+    Info string of an opening fence line.
+
+    Args:
+        line: Line without its line break
+
+    Returns:
+        The stripped info string ("" if none), or None if the line is not an opening fence
+    """
+    stripped = line.lstrip(" ")
+    if len(line) - len(stripped) > MAX_FENCE_INDENT or not stripped.startswith(FENCE):
+        return None
+    info = stripped.lstrip("`").strip()
+    # "```mermaid```" or "``` a ``` b" are inline code, not a fence
+    if "`" in info:
+        return None
+    return info
+
+
+def scan_fenced_blocks(text: str) -> List[Segment]:
+    """
+    Split a complete text into text segments and fenced code blocks.
+
+    Args:
+        text: Response text
+
+    Returns:
+        Segments in order
+    """
+    scanner = FencedBlockScanner()
+    scanner.feed(text)
+    return scanner.finish()
+
+
+def find_block(segments: Iterable[Segment], language: str) -> Optional[Segment]:
+    """
+    First closed code block of a language.
+
+    Args:
+        segments: Segments from scan_fenced_blocks()
+        language: Fence language, e.g. "mermaid"
+
+    Returns:
+        The block, or None
+    """
+    return next(
+        (segment for segment in segments if segment.kind == CODE and segment.closed and segment.language == language),
+        None
+    )
+
+
+def text_without_blocks(text: str, segments: Iterable[Segment], languages: Iterable[str]) -> str:
+    """
+    Remove the closed code blocks of some languages from a text.
+
+    Args:
+        text: Text the segments were scanned from
+        segments: Segments from scan_fenced_blocks()
+        languages: Languages of the blocks to remove
+
+    Returns:
+        The text without those blocks (fences included)
+    """
+    languages = set(languages)
+    return "".join(
+        text[segment.start:segment.end]
+        for segment in segments
+        if not (segment.kind == CODE and segment.closed and segment.language in languages)
+    )
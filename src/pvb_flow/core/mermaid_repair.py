@@ -0,0 +1,260 @@
+"""
+Deterministic repair of near-valid flowcharts.
+
+Models often get a diagram right except for a few lines: an unbalanced
+bracket, an unquoted label containing parentheses, '{{' opened and '}'
+closed, a style line for a node that does not exist, or no 'flowchart'
+header. These are fixed here, line by line where the parser reports an
+error, so the diagram can be kept without asking the model again.
+"""
+import re
+from typing import List, Optional, Tuple
+
+from .flowchart_parser import FlowchartSyntaxError, parse_flowchart
+from .mermaid_grammar import COMPLETE, HEADER_KEYWORDS, LABEL_FORBIDDEN, NODE_SHAPES, check_line
+
+
+DEFAULT_HEADER = "flowchart TD"
+
+# Errors fixed before giving up, one line (or one 'end') per repair
+MAX_REPAIRS = 50
+
+# Lines sent around an error when the model is asked to fix it
+REPAIR_CONTEXT_LINES = 3
+
+# Edge operators with their optional |label|, as written by models
+_LINK_PATTERN = re.compile(r"\s*(<?(?:-{2,}[->ox]|-\.+->?|={2,}[=>]|~~~))(?:\s*\|([^|]*)\|)?\s*")
+_NODE_PATTERN = re.compile(r"(\w+)\s*(.*?)(:::\w+)?$")
+_AMPERSAND_PATTERN = re.compile(r"\s+&\s+")
+_QUOTED_PATTERN = re.compile(r"'[^']*'")
+_CLOSING_CHARS = set(")]}/\\")
+_PAIRS = {"(": ")", "[": "]", "{": "}"}
+
+
+def _outside_quotes(text: str, index: int) -> bool:
+    return text.count('"', 0, index) % 2 == 0
+
+
+def _quote(label: str) -> str:
+    """Quote a label, unless it already is a single quoted string."""
+    if len(label) >= 2 and label[0] == label[-1] == '"' and '"' not in label[1:-1]:
+        return label
+    if not any(char in LABEL_FORBIDDEN for char in label):
+        return label
+    return '"' + label.strip('"').replace('"', "#quot;") + '"'
+
+
+def _split_closing(body: str) -> Tuple[str, str]:
+    """
+    Split the text after a shape's opening into label and closing delimiters.
+
+    Trailing closing characters are the closing, except those that close
+    a bracket opened inside the label (e.g. the ')' of '[Etape (1)]').
+    """
+    end = len(body)
+    while end > 0 and body[end - 1] in _CLOSING_CHARS:
+        end -= 1
+    label, suffix = body[:end], body[end:]
+
+    for char in suffix:
+        opened = [opening for opening, closing in _PAIRS.items() if closing == char]
+        if not opened or label.count(opened[0]) <= label.count(char):
+            break
+        label += char
+    return label, body[len(label):]
+
+
+def _repair_node(text: str) -> Optional[str]:
+    """Rebuild a node definition with a balanced shape and a quoted label if needed."""
+    match = _NODE_PATTERN.match(text.strip())
+    if match is None:
+        return None
+    node_id, rest, css_class = match.group(1), match.group(2).strip(), match.group(3) or ""
+    if not rest:
+        return node_id + css_class
+
+    shapes = [shape for shape in NODE_SHAPES if rest.startswith(shape[0])]
+    if not shapes:
+        return None
+    opening = shapes[0][0]
+    closings = [closing for shape_opening, closing in shapes if shape_opening == opening]
+    label, closing_text = _split_closing(rest[len(opening):])
+    if not label.strip():
+        return None
+    # Keep the closing that was written when it matches the opening ('[/' has two)
+    closing = next((closing for closing in closings if closing_text.endswith(closing)), closings[0])
+    return f"{node_id}{opening}{_quote(label.strip())}{closing}{css_class}"
+
+
+def repair_line(line: str) -> Optional[str]:
+    """
+    Fix the node shapes and labels of a node/edge statement.
+
+    Args:
+        line: Statement line, as written by the model
+
+    Returns:
+        Valid line, or None if it cannot be repaired (or is not a node/edge line)
+    """
+    indent = line[:len(line) - len(line.lstrip())]
+    body = line.strip().rstrip(";").rstrip()
+    if not body:
+        return None
+
+    links = [match for match in _LINK_PATTERN.finditer(body) if _outside_quotes(body, match.start())]
+    parts = []
+    position = 0
+    for match in links + [None]:
+        segment = body[position:match.start() if match else len(body)]
+        nodes = [_repair_node(node) for node in _AMPERSAND_PATTERN.split(segment)]
+        if None in nodes:
+            return None
+        parts.append(" & ".join(nodes))
+        if match is not None:
+            link = match.group(1)
+            if match.group(2) is not None:
+                link += f"|{_quote(match.group(2).strip())}|"
+            parts.append(link)
+            position = match.end()
+
+    repaired = indent + " ".join(parts)
+    if check_line(repaired)[0] != COMPLETE:
+        return None
+    return repaired
+
+
+def _first_statement(lines: List[str]) -> int:
+    return next(
+        (index for index, line in enumerate(lines) if line.strip() and not line.strip().startswith("%%")), -1
+    )
+
+
+def _drop_undefined_styles(lines: List[str], chart) -> List[str]:
+    """Remove style/class statements naming nodes that are not in the diagram."""
+    known = set(chart.nodes) | set(chart.subgraphs)
+    changes = []
+    for index in range(len(lines) - 1, -1, -1):
+        words = lines[index].strip().rstrip(";").split()
+        if len(words) < 3 or words[0] not in ("style", "class"):
+            continue
+        if words[0] == "style" and words[1] not in known:
+            changes.append(f"Removed the style of undefined node '{words[1]}'")
+            del lines[index]
+        elif words[0] == "class":
+            node_ids = words[1].split(",")
+            kept = [node_id for node_id in node_ids if node_id in known]
+            if len(kept) == len(node_ids):
+                continue
+            dropped = ", ".join(node_id for node_id in node_ids if node_id not in known)
+            changes.append(f"Removed undefined node(s) {dropped} from a class statement")
+            if kept:
+                indent = lines[index][:len(lines[index]) - len(lines[index].lstrip())]
+                lines[index] = f"{indent}class {','.join(kept)} {' '.join(words[2:])}"
+            else:
+                del lines[index]
+    return changes[::-1]
+
+
+def repair_mermaid(code: str) -> Tuple[Optional[str], List[str]]:
+    """
+    Repair a flowchart that does not parse.
+
+    Args:
+        code: Mermaid diagram code
+
+    Returns:
+        Tuple of (repaired code, descriptions of the changes); the code is
+        None if the diagram could not be made valid
+    """
+    lines = code.replace("\r\n", "\n").split("\n")
+    changes = []
+
+    first = _first_statement(lines)
+    if first == -1:
+        return None, changes
+    if lines[first].split(None, 1)[0] not in HEADER_KEYWORDS:
+        if check_line(lines[first])[0] != COMPLETE and repair_line(lines[first]) is None:
+            return None, changes
+        lines.insert(first, DEFAULT_HEADER)
+        changes.append(f"Added the missing '{DEFAULT_HEADER}' header")
+
+    for _ in range(MAX_REPAIRS):
+        try:
+            chart = parse_flowchart("\n".join(lines))
+            break
+        except FlowchartSyntaxError as e:
+            index = e.line - 1
+            line = lines[index]
+            if e.message.startswith("Subgraph "):
+                lines.append("    end")
+                changes.append(f"Closed subgraph {_QUOTED_PATTERN.search(e.message).group(0)} with 'end'")
+            elif e.message == "'end' without an open subgraph":
+                del lines[index]
+                changes.append(f"Removed an 'end' without an open subgraph (line {e.line})")
+            elif index == _first_statement(lines):
+                lines[index] = DEFAULT_HEADER
+                changes.append(f"Replaced the invalid header {line.strip()!r} with '{DEFAULT_HEADER}'")
+            else:
+                repaired = repair_line(line)
+                if repaired is None or repaired == line:
+                    return None, changes
+                lines[index] = repaired
+                changes.append(f"Line {e.line}: {line.strip()!r} -> {repaired.strip()!r}")
+    else:
+        return None, changes
+
+    changes.extend(_drop_undefined_styles(lines, chart))
+    if not chart.nodes or not chart.edges:
+        return None, changes
+    return "\n".join(lines).strip(), changes
+
+
+def find_syntax_error(code: str) -> Optional[FlowchartSyntaxError]:
+    """
+    Locate the first syntax error of a flowchart.
+
+    Args:
+        code: Mermaid diagram code
+
+    Returns:
+        The parser error, or None if the flowchart parses
+    """
+    try:
+        parse_flowchart(code)
+    except FlowchartSyntaxError as e:
+        return e
+    return None
+
+
+def error_window(code: str, line_number: int, context: int = REPAIR_CONTEXT_LINES) -> Tuple[int, int]:
+    """
+    Range of lines to send to the model around an error.
+
+    Args:
+        code: Mermaid diagram code
+        line_number: 1-based line of the error
+        context: Lines kept before and after it
+
+    Returns:
+        (start, end) line indexes, end excluded
+    """
+    count = len(code.split("\n"))
+    index = min(max(line_number - 1, 0), count - 1)
+    return max(0, index - context), min(count, index + context + 1)
+
+
+def splice_lines(code: str, start: int, end: int, replacement: str) -> str:
+    """
+    Replace a range of lines of a diagram.
+
+    Args:
+        code: Mermaid diagram code
+        start: First line index replaced
+        end: Line index after the last one replaced
+        replacement: New lines
+
+    Returns:
+        Updated diagram code
+    """
+    lines = code.split("\n")
+    return "\n".join(lines[:start] + replacement.split("\n") + lines[end:])
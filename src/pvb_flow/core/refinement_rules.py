@@ -0,0 +1,285 @@
+"""
+Rule-based handling of common refinement requests, without the model.
+
+Layout and styling toggles ("plus horizontal", "plus vertical", "plus de
+couleurs", "légende") are a large share of refinement traffic and have a
+deterministic answer. The request is matched against known phrases; only
+if every word is understood are the matching transforms applied to the
+current diagram. Anything else goes to the model.
+"""
+import re
+import unicodedata
+from typing import List, Optional, Tuple
+
+from .diagram_edits import EditError, EditOperation, apply_edit_operations
+from .mermaid_grammar import split_chain
+
+
+HORIZONTAL = "horizontal"
+VERTICAL = "vertical"
+COLORS = "colors"
+LEGEND = "legend"
+
+# Phrases per intent, as accent-free lowercase words (longest are tried first)
+INTENT_PHRASES = {
+    HORIZONTAL: (
+        "plus horizontal", "plus horizontale", "more horizontal", "horizontal", "horizontale",
+        "horizontalement", "de gauche a droite", "left to right", "en largeur", "lr"
+    ),
+    VERTICAL: (
+        "plus vertical", "plus verticale", "more vertical", "vertical", "verticale",
+        "verticalement", "de haut en bas", "top to bottom", "en hauteur", "td", "tb"
+    ),
+    COLORS: (
+        "plus de couleurs", "plus de couleur", "more colors", "more colours", "couleurs", "couleur",
+        "colors", "colours", "colorer", "colorier", "coloriser", "colorize", "colorise"
+    ),
+    LEGEND: ("legende", "legend"),
+}
+
+# Words that may surround a command without changing its meaning
+FILLER_WORDS = frozenset("""
+    a an and add ajoute ajouter ajoutez avec can chart d de des diagram diagramme disposition
+    du en est et fais faire faites graphe il it l la layout le les make mets mettez mettre
+    merci moi more orientation peu peux please plait plus pouvez rend rendez rendre rends s
+    schema sens some stp svp te thanks the tu un une vous vue you
+""".split())
+
+# Fill/stroke per actor type, as in the generation prompt's color code
+ACTOR_STYLES = {
+    "system": "fill:#4A90D9,stroke:#2E5F8A,color:#fff",
+    "ai": "fill:#50C878,stroke:#2E8B57,color:#fff",
+    "human": "fill:#FF9F43,stroke:#E67E22,color:#fff",
+    "objective": "fill:#E74C3C,stroke:#A93226,color:#fff",
+}
+
+# (actor, emoji, keywords) checked in order against node labels
+ACTOR_MARKERS = (
+    ("human", "👤", ("humain", "human", "manuel", "manual", "utilisateur", "operateur", "expert")),
+    ("ai", "🤖", ("ia", "ai", "ml", "intelligence artificielle", "llm")),
+    ("objective", "🎯", ("objectif", "objective", "kpi")),
+)
+
+# Legend entries: (actor, label)
+LEGEND_ENTRIES = (
+    ("system", "🖥️ Système"),
+    ("ai", "🤖 IA"),
+    ("human", "👤 Humain"),
+)
+LEGEND_NODE_IDS = (("L1", "L2", "L3"), ("LG1", "LG2", "LG3"), ("Legende1", "Legende2", "Legende3"))
+
+_SUBGRAPH_PATTERN = re.compile(r"^\s*subgraph\s+(\w+)(.*)$")
+_STYLED_PATTERN = re.compile(r"^\s*(?:style|class)\s+([\w,]+)")
+_HEADER_PATTERN = re.compile(r"^\s*(?:flowchart|graph)\b")
+
+_PHRASES = sorted(
+    ((tuple(phrase.split()), intent) for intent, phrases in INTENT_PHRASES.items() for phrase in phrases),
+    key=lambda item: -len(item[0])
+)
+
+
+def _plain_words(text: str) -> List[str]:
+    """Lowercase, accent-free words of a text."""
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    ascii_text = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return re.findall(r"[a-z0-9]+", ascii_text)
+
+
+def match_refinement_intents(request: str) -> Optional[List[str]]:
+    """
+    Recognize a refinement request made only of known commands.
+
+    Args:
+        request: User's refinement message
+
+    Returns:
+        Intents in request order, or None if any word is not understood or
+        the commands contradict each other
+    """
+    words = _plain_words(request)
+    intents = []
+    index = 0
+    while index < len(words):
+        for phrase, intent in _PHRASES:
+            if tuple(words[index:index + len(phrase)]) == phrase:
+                if intent not in intents:
+                    intents.append(intent)
+                index += len(phrase)
+                break
+        else:
+            if words[index] not in FILLER_WORDS:
+                return None
+            index += 1
+
+    if not intents or (HORIZONTAL in intents and VERTICAL in intents):
+        return None
+    return intents
+
+
+def _defined_nodes(lines: List[str]) -> List[Tuple[str, str]]:
+    """(node id, node text) of nodes defined with a shape, in order of appearance."""
+    nodes = []
+    seen = set()
+    for line in lines:
+        parts = split_chain(line)
+        if not parts:
+            continue
+        for group in parts[::2]:
+            for node in group:
+                node_id = re.match(r"\w+", node).group(0)
+                if node_id not in seen and node.split(":::", 1)[0] != node_id:
+                    seen.add(node_id)
+                    nodes.append((node_id, node))
+    return nodes
+
+
+def _all_node_ids(lines: List[str]) -> set:
+    ids = set()
+    for line in lines:
+        parts = split_chain(line)
+        if parts:
+            for group in parts[::2]:
+                ids.update(re.match(r"\w+", node).group(0) for node in group)
+        match = _SUBGRAPH_PATTERN.match(line)
+        if match:
+            ids.add(match.group(1))
+    return ids
+
+
+def _styled_node_ids(lines: List[str]) -> set:
+    """Nodes already colored by a style/class statement or a :::class suffix."""
+    styled = set()
+    for line in lines:
+        match = _STYLED_PATTERN.match(line)
+        if match:
+            styled.update(match.group(1).split(","))
+        parts = split_chain(line)
+        if parts:
+            for group in parts[::2]:
+                styled.update(re.match(r"\w+", node).group(0) for node in group if ":::" in node)
+    return styled
+
+
+def actor_of(node_text: str) -> str:
+    """
+    Guess the actor type of a node from its label.
+
+    Args:
+        node_text: Node definition (id and shape)
+
+    Returns:
+        "human", "ai", "objective" or "system"
+    """
+    words = " ".join(_plain_words(node_text))
+    for actor, emoji, _ in ACTOR_MARKERS:
+        if emoji in node_text:
+            return actor
+    for actor, _, keywords in ACTOR_MARKERS:
+        if any(re.search(rf"\b{keyword}\b", words) for keyword in keywords):
+            return actor
+    return "system"
+
+
+def _find_legend(lines: List[str]) -> Optional[Tuple[str, int, int]]:
+    """(subgraph id, start index, end index) of the legend subgraph, if any."""
+    for start, line in enumerate(lines):
+        match = _SUBGRAPH_PATTERN.match(line)
+        if not match or not any(word in ("legende", "legend") for word in _plain_words(line)):
+            continue
+        depth = 0
+        for end in range(start, len(lines)):
+            first = lines[end].split(None, 1)[0] if lines[end].strip() else ""
+            if first == "subgraph":
+                depth += 1
+            elif first == "end":
+                depth -= 1
+                if depth == 0:
+                    return match.group(1), start, end
+    return None
+
+
+def _add_legend(lines: List[str]) -> Tuple[List[str], str]:
+    """Add the actor legend, or its missing entries."""
+    taken = _all_node_ids(lines)
+    node_ids = next((ids for ids in LEGEND_NODE_IDS if not taken.intersection(ids)), None)
+    if node_ids is None:
+        raise EditError("No free node ids for the legend")
+
+    legend = _find_legend(lines)
+    if legend is None:
+        header = next((index for index, line in enumerate(lines) if _HEADER_PATTERN.match(line)), None)
+        if header is None:
+            raise EditError("Diagram has no flowchart header")
+        block = ["    subgraph Légende"]
+        block += [f"        {node_id}[{label}]" for node_id, (_, label) in zip(node_ids, LEGEND_ENTRIES)]
+        block += ["    end"]
+        lines = lines[:header + 1] + block + lines[header + 1:]
+        operations = [
+            EditOperation("restyle", f"{node_id} {ACTOR_STYLES[actor]}")
+            for node_id, (actor, _) in zip(node_ids, LEGEND_ENTRIES)
+        ]
+        return apply_edit_operations("\n".join(lines), operations).split("\n"), "Légende ajoutée."
+
+    legend_id, start, end = legend
+    present = {actor_of(line) for line in lines[start + 1:end] if split_chain(line)}
+    operations = []
+    for node_id, (actor, label) in zip(node_ids, LEGEND_ENTRIES):
+        if actor not in present:
+            operations.append(EditOperation("add_node", f"{node_id}[{label}] in {legend_id}"))
+            operations.append(EditOperation("restyle", f"{node_id} {ACTOR_STYLES[actor]}"))
+    if not operations:
+        return lines, "La légende est déjà complète."
+    lines = apply_edit_operations("\n".join(lines), operations).split("\n")
+    return lines, "Légende complétée."
+
+
+def _add_colors(lines: List[str]) -> Tuple[List[str], str]:
+    """Color every node that has no style yet, by actor type."""
+    styled = _styled_node_ids(lines)
+    operations = [
+        EditOperation("restyle", f"{node_id} {ACTOR_STYLES[actor_of(node)]}")
+        for node_id, node in _defined_nodes(lines)
+        if node_id not in styled
+    ]
+    if not operations:
+        return lines, "Tous les éléments sont déjà colorés."
+    lines = apply_edit_operations("\n".join(lines), operations).split("\n")
+    return lines, f"Couleurs ajoutées à {len(operations)} élément(s) selon le type d'acteur."
+
+
+def apply_refinement_rules(diagram: str, request: str) -> Optional[Tuple[str, str]]:
+    """
+    Answer a refinement request with deterministic transforms, if possible.
+
+    Args:
+        diagram: Current Mermaid diagram code
+        request: User's refinement message
+
+    Returns:
+        (updated diagram, summary for the chat), or None if the request
+        needs the model
+    """
+    intents = match_refinement_intents(request)
+    if intents is None:
+        return None
+
+    lines = diagram.split("\n")
+    summaries = []
+    try:
+        for intent in intents:
+            if intent == HORIZONTAL:
+                lines = apply_edit_operations("\n".join(lines), [EditOperation("direction", "LR")]).split("\n")
+                summaries.append("Disposition horizontale (de gauche à droite).")
+            elif intent == VERTICAL:
+                lines = apply_edit_operations("\n".join(lines), [EditOperation("direction", "TD")]).split("\n")
+                summaries.append("Disposition verticale (de haut en bas).")
+            elif intent == LEGEND:
+                lines, summary = _add_legend(lines)
+                summaries.append(summary)
+            elif intent == COLORS:
+                lines, summary = _add_colors(lines)
+                summaries.append(summary)
+    except EditError:
+        return None
+
+    return "\n".join(lines), " ".join(summaries)
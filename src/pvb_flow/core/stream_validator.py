@@ -0,0 +1,147 @@
+"""
+Incremental validation of a diagram while its answer is streamed.
+
+The ```mermaid``` block is checked line by line with the flowchart grammar
+as text arrives. As soon as a line cannot be valid whatever follows, the
+answer is flagged so the caller can stop decoding and retry, instead of
+paying for the rest of a diagram that will be rejected anyway. Lines
+that mermaid_repair can fix may be let through, to be repaired once the
+answer is complete.
+"""
+from typing import Optional
+
+from .mermaid_grammar import COMPLETE, HEADER_KEYWORDS, INVALID, FlowchartGrammarState, check_line, is_fence_prefix
+from .mermaid_repair import DEFAULT_HEADER, repair_line
+
+
+MERMAID_FENCE = "```mermaid"
+
+
+class StreamingMermaidValidator:
+    """
+    Follow a streamed answer and detect an irrecoverably malformed diagram.
+
+    Usage:
+        validator = StreamingMermaidValidator()
+        for chunk in stream:
+            if not validator.feed(chunk):
+                break  # validator.error describes the offending line
+    """
+
+    __slots__ = (
+        "_text", "_searched", "_line_start", "_line_number", "_grammar", "allow_repairs", "repaired_lines",
+        "closed", "error", "error_line"
+    )
+
+    def __init__(self, allow_repairs: bool = False):
+        """
+        Initialize the validator.
+
+        Args:
+            allow_repairs: Accept lines that mermaid_repair can fix once the
+                answer is complete (only whole lines are judged then)
+        """
+        self._text = ""
+        self._searched = 0  # Offset up to which the opening fence was looked for
+        self._line_start = -1  # Offset of the diagram line being received, -1 before the fence
+        self._line_number = 0  # Diagram lines completed so far
+        self._grammar = FlowchartGrammarState()
+        self.allow_repairs = allow_repairs
+        self.repaired_lines = 0
+        self.closed = False
+        self.error: Optional[str] = None  # "Line X, column Y: message", once invalid
+        self.error_line: Optional[str] = None
+
+    @property
+    def failed(self) -> bool:
+        return self.error is not None
+
+    def feed(self, chunk: str) -> bool:
+        """
+        Add streamed text and check the diagram lines it completes.
+
+        Args:
+            chunk: Newly generated text
+
+        Returns:
+            False once the diagram cannot be valid anymore, True otherwise
+        """
+        if self.error is not None:
+            return False
+        self._text += chunk
+        if self.closed:
+            return True
+
+        if self._line_start == -1 and not self._find_block():
+            return True
+
+        text = self._text
+        newline = text.find("\n", self._line_start)
+        while newline != -1:
+            line = text[self._line_start:newline].rstrip("\r")
+            self._line_start = newline + 1
+            self._line_number += 1
+            if is_fence_prefix(line):
+                # The block is over: a missing 'end' is left to the final validation
+                self.closed = True
+                return True
+            status, column, message = self._grammar.check(line)
+            if status != COMPLETE and self.allow_repairs:
+                line, status = self._repair(line, status)
+            if status != COMPLETE:
+                if status != INVALID:
+                    column, message = len(line), "Unexpected end of line"
+                return self._fail(line, self._line_number, column, message)
+            self._grammar.advance(line)
+            newline = text.find("\n", self._line_start)
+
+        # Line still being written: only reject it if no continuation can fix it
+        # (a trailing incomplete multi-byte character, e.g. an emoji, cannot be judged yet)
+        partial = text[self._line_start:]
+        if partial and not self.allow_repairs and not is_fence_prefix(partial) and not partial.endswith("\ufffd"):
+            status, column, message = self._grammar.check(partial)
+            if status == INVALID:
+                return self._fail(partial, self._line_number + 1, column, message)
+        return True
+
+    def _repair(self, line: str, status: str):
+        """Substitute the line mermaid_repair would produce, if it is valid here."""
+        if self._grammar.depth == 0 and line.strip().rstrip(";") == "end":
+            # Stray 'end', dropped by the repair
+            self.repaired_lines += 1
+            return "", COMPLETE
+        if not self._grammar.header_seen:
+            # Missing or invalid header, added or replaced by the repair
+            if line.split(None, 1)[0] in HEADER_KEYWORDS:
+                statement = DEFAULT_HEADER
+            else:
+                self._grammar.advance(DEFAULT_HEADER)
+                statement = line if check_line(line)[0] == COMPLETE else repair_line(line)
+                if statement is None:
+                    return line, status
+            self.repaired_lines += 1
+            return statement, COMPLETE
+        repaired = repair_line(line)
+        if repaired is not None and self._grammar.check(repaired)[0] == COMPLETE:
+            self.repaired_lines += 1
+            return repaired, COMPLETE
+        return line, status
+
+    def _find_block(self) -> bool:
+        """Look for the line after the opening fence, remembering how far was searched."""
+        start = max(0, self._searched - len(MERMAID_FENCE))
+        fence = self._text.find(MERMAID_FENCE, start)
+        if fence == -1:
+            self._searched = len(self._text)
+            return False
+        newline = self._text.find("\n", fence + len(MERMAID_FENCE))
+        if newline == -1:
+            self._searched = fence
+            return False
+        self._line_start = newline + 1
+        return True
+
+    def _fail(self, line: str, line_number: int, column: int, message: str) -> bool:
+        self.error = f"Line {line_number}, column {column + 1}: {message}"
+        self.error_line = line
+        return False
@@ -1,16 +1,34 @@
 """
 Gradio v6 interface for Product Vision Board to Mermaid diagram generation.
 """
-import gradio as gr
-from .handlers import handle_message, handle_clear, handle_open_mermaid_chart
-
+from typing import List, Optional
 
-def create_ui(analyzer):
+import gradio as gr
+from ..ai.prompt_builder import DEFAULT_PROMPT_TOKEN_BUDGET, PromptBuilder
+from ..ai.conversation_history import ConversationHistory
+from .handlers import handle_message, handle_clear, handle_open_mermaid_chart, render_model_status
+
+
+def create_ui(
+    analyzer,
+    concurrency_limit: int = 1,
+    edit_refinements: bool = False,
+    model_choices: Optional[List[str]] = None,
+    prompt_token_budget: int = DEFAULT_PROMPT_TOKEN_BUDGET
+):
     """
     Create the Gradio interface.
 
     Args:
-        analyzer: LLM analyzer instance (MistralMLXAnalyzer or MistralTextAnalyzer)
+        analyzer: LLM analyzer instance (MistralMLXAnalyzer, MistralTextAnalyzer or
+            a BackgroundAnalyzer still loading one)
+        concurrency_limit: Number of chat requests Gradio runs at the same time
+        edit_refinements: Answer refinements with edit operations applied to the
+            current diagram instead of regenerating it
+        model_choices: Models offered in a selector (analyzer must be an
+            AnalyzerPool serving them), None to hide the selector
+        prompt_token_budget: Target prompt size in tokens, optional prompt
+            sections are left out above it (0 to keep them all)
 
     Returns:
         Gradio Blocks demo
@@ -24,6 +42,15 @@ def create_ui(analyzer):
             """
         )
 
+        # Model loading state, refreshed until the model is ready
+        model_status = gr.Markdown(value=render_model_status(analyzer))
+        if not getattr(analyzer, "is_ready", True):
+            status_timer = gr.Timer(2.0)
+            status_timer.tick(
+                fn=lambda: (render_model_status(analyzer), gr.Timer(active=not analyzer.wait_ready(0))),
+                outputs=[model_status, status_timer]
+            )
+
         # Instructions
         with gr.Accordion("📖 How to use", open=False):
             gr.Markdown(
@@ -84,6 +111,14 @@ def create_ui(analyzer):
                     max_lines=10
                 )
 
+                # Model selector, only when the pool serves several models
+                model_selector = gr.Dropdown(
+                    choices=model_choices or [],
+                    value=model_choices[0] if model_choices else None,
+                    label="Modèle",
+                    visible=bool(model_choices and len(model_choices) > 1)
+                )
+
                 # Action buttons
                 with gr.Row():
                     send_btn = gr.Button("📤 Send", variant="primary")
@@ -115,22 +150,36 @@ def create_ui(analyzer):
         pvb_state = gr.State({})
 
         # Event handlers - explicitly update all states
-        def send_message_wrapper(*args):
-            result = handle_message(*args)
-            print(f"[DEBUG] send_message_wrapper output diagram_state index 3 length: {len(result[3]) if result[3] else 0}")
-            return result
+        # handle_message is a generator: each yield streams a UI update.
+        # The analyzer is shared through the closure: gr.State would deep-copy
+        # it (model, locks, loader thread) for every session.
+        prompt_builder = PromptBuilder(max_prompt_tokens=prompt_token_budget)
+        conversation_history = ConversationHistory()
+
+        def send_message_wrapper(user_input, conversation, current_diagram, pvb_data, model, request: gr.Request):
+            session_id = request.session_hash if request is not None else None
+            for result in handle_message(
+                user_input, conversation, current_diagram, pvb_data, analyzer, session_id,
+                edit_mode=edit_refinements, model=model, prompt_builder=prompt_builder,
+                conversation_history=conversation_history
+            ):
+                yield result
 
         send_event = send_btn.click(
             fn=send_message_wrapper,
-            inputs=[msg_input, conversation_state, diagram_state, pvb_state, gr.State(analyzer)],
-            outputs=[chatbot, diagram_preview, conversation_state, diagram_state, pvb_state, msg_input]
+            inputs=[msg_input, conversation_state, diagram_state, pvb_state, model_selector],
+            outputs=[chatbot, diagram_preview, conversation_state, diagram_state, pvb_state, msg_input],
+            concurrency_limit=concurrency_limit,
+            concurrency_id="chat"
         )
 
         # Also trigger on Enter key
         msg_input.submit(
             fn=send_message_wrapper,
-            inputs=[msg_input, conversation_state, diagram_state, pvb_state, gr.State(analyzer)],
-            outputs=[chatbot, diagram_preview, conversation_state, diagram_state, pvb_state, msg_input]
+            inputs=[msg_input, conversation_state, diagram_state, pvb_state, model_selector],
+            outputs=[chatbot, diagram_preview, conversation_state, diagram_state, pvb_state, msg_input],
+            concurrency_limit=concurrency_limit,
+            concurrency_id="chat"
         )
 
         # Clear button
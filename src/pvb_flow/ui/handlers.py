@@ -1,11 +1,125 @@
 """
 Event handlers for Gradio UI interactions.
 """
-from typing import Tuple, List, Dict, Any
+from typing import Tuple, List, Dict, Any, Iterator, Optional
 from ..utils.json_validator import validate_pvb_json
 from ..ai.prompts_config import DiagramPrompts
-from ..core.mermaid_extractor import extract_mermaid_code, format_for_display
+from ..ai.prompt_builder import PromptBuilder
+from ..ai.conversation_history import ConversationHistory
+from ..ai.generation_limits import estimate_max_new_tokens, EDIT_MAX_NEW_TOKENS, REPAIR_MAX_NEW_TOKENS
+from ..core.mermaid_extractor import (
+    MermaidExtractor, extract_mermaid_code, format_for_display, validate_mermaid_syntax
+)
+from ..core.fenced_blocks import CODE, FencedBlockScanner, find_block, scan_fenced_blocks, text_without_blocks
+from ..core.mermaid_repair import error_window, find_syntax_error, repair_mermaid, splice_lines
+from ..core.diagram_edits import extract_edit_operations, apply_edit_operations, EditError
+from ..core.refinement_rules import apply_refinement_rules
+from ..core.stream_validator import StreamingMermaidValidator
 from ..core.mermaid_encoder import generate_mermaid_chart_url
+from ..utils.metrics import (
+    DIAGRAM_REPAIRS, DIAGRAM_RETRIES, PROMPT_TOKENS, REQUEST_SECONDS, REQUEST_STAGE_SECONDS, REQUESTS_IN_FLIGHT
+)
+from ..utils.structured_logging import RequestLogger, get_logger, new_request_id
+
+
+STREAMING_DIAGRAM_PLACEHOLDER = "⏳ Génération du diagramme en cours..."
+
+# Code blocks shown in the preview pane rather than in the chat
+DIAGRAM_BLOCK_LANGUAGES = ("mermaid", "edits")
+MODEL_WARMING_UP_MESSAGE = "⏳ Le modèle démarre, votre demande sera traitée dès qu'il sera prêt..."
+
+DIAGRAM_REPAIRING_MESSAGE = "🔧 Correction de la syntaxe du diagramme..."
+
+# Diagram generations stopped on an invalid line and asked again; the last
+# attempt always runs to completion, so it is never worse than no validation
+STREAM_VALIDATION_RETRIES = 1
+
+# Requests to the model for the lines around a syntax error that local repair could not fix
+MODEL_REPAIR_ROUNDS = 2
+
+# Used when the UI does not provide its own (keeps the token counts across calls)
+DEFAULT_PROMPT_BUILDER = PromptBuilder()
+DEFAULT_CONVERSATION_HISTORY = ConversationHistory()
+
+
+def _is_header(line: str) -> bool:
+    return line.lstrip().startswith(("flowchart", "graph"))
+
+
+def render_model_status(analyzer: Any) -> str:
+    """
+    Describe the loading state of the analyzer for the status banner.
+
+    Args:
+        analyzer: LLM analyzer instance (BackgroundAnalyzer reports its state)
+
+    Returns:
+        Markdown status line, empty once the model is ready
+    """
+    if not hasattr(analyzer, "get_readiness"):
+        return ""
+
+    readiness = analyzer.get_readiness()
+    if readiness["ready"]:
+        return ""
+    if readiness["status"] == "failed":
+        return f"❌ **Le modèle n'a pas pu être chargé :** {readiness['error']}"
+    if readiness["status"] == "warming_up":
+        return "🔥 **Préchauffage du modèle...** Les premières demandes seront traitées dans quelques instants."
+    return "⏳ **Chargement du modèle en cours...** Vous pouvez déjà coller votre Product Vision Board."
+
+
+def render_partial_response(
+    response: str,
+    scanner: FencedBlockScanner,
+    current_diagram: str
+) -> Tuple[str, str]:
+    """
+    Split a partially generated response into chat text and diagram preview.
+
+    Only complete lines of an unfinished Mermaid block are shown in the
+    preview, so the renderer never sees a half-written node definition.
+
+    Args:
+        response: Response text generated so far
+        scanner: FencedBlockScanner fed with that text
+        current_diagram: Diagram to keep showing until a new one is available
+
+    Returns:
+        Tuple of (chat_text, diagram_preview)
+    """
+    # Chat text: everything but diagram blocks, the block being written and a fence being written
+    pieces = []
+    position = 0
+    for segment in scanner.segments:
+        if segment.kind == CODE and segment.language in DIAGRAM_BLOCK_LANGUAGES:
+            pieces.append(response[position:segment.start])
+            position = segment.end
+    if scanner.open_block is not None:
+        pieces.append(response[position:scanner.open_block.start])
+    elif scanner.fence_pending:
+        pieces.append(response[position:len(response) - len(scanner.pending_line)])
+    else:
+        pieces.append(response[position:])
+    chat_text = "".join(pieces).strip()
+
+    block = find_block(scanner.segments, "mermaid")
+    if block is None and scanner.open_block is not None and scanner.open_block.language == "mermaid":
+        block = scanner.open_block
+
+    if block is None:
+        diagram_preview = f"```mermaid\n{current_diagram}\n```" if current_diagram else "Diagram will appear here..."
+        return chat_text or STREAMING_DIAGRAM_PLACEHOLDER, diagram_preview
+
+    if not block.closed:
+        chat_text = f"{chat_text}\n\n{STREAMING_DIAGRAM_PLACEHOLDER}" if chat_text else STREAMING_DIAGRAM_PLACEHOLDER
+
+    if block.content.strip():
+        diagram_preview = f"```mermaid\n{block.content.rstrip()}\n```"
+    else:
+        diagram_preview = f"```mermaid\n{current_diagram}\n```" if current_diagram else "Diagram will appear here..."
+
+    return chat_text or STREAMING_DIAGRAM_PLACEHOLDER, diagram_preview
 
 
 def handle_message(
@@ -13,10 +127,18 @@ def handle_message(
     conversation: List[Dict[str, str]],
     current_diagram: str,
     pvb_data: Dict,
-    analyzer: Any
-) -> Tuple[List[Dict[str, str]], str, List[Dict], str, Dict, str]:
+    analyzer: Any,
+    session_id: Optional[str] = None,
+    edit_mode: bool = False,
+    model: Optional[str] = None,
+    prompt_builder: Optional[PromptBuilder] = None,
+    conversation_history: Optional[ConversationHistory] = None
+) -> Iterator[Tuple[List[Dict[str, str]], str, List[Dict], str, Dict, str]]:
     """
-    Handle user message and generate response.
+    Handle user message and stream the generated response.
+
+    Intermediate states are yielded as tokens arrive so the chat and the
+    preview update live; the last yielded state is the final one.
 
     Args:
         user_input: User's input message
@@ -24,83 +146,337 @@ def handle_message(
         current_diagram: Current Mermaid diagram code
         pvb_data: Product Vision Board data
         analyzer: LLM analyzer instance
-
-    Returns:
+        session_id: Gradio session identifier, lets the analyzer reuse its KV cache across turns
+        edit_mode: Ask refinements as edit operations applied to the current diagram
+            instead of a regenerated diagram
+        model: Model to use when the analyzer is an AnalyzerPool, None for its default
+        prompt_builder: Builds the initial and refinement prompts within a token
+            budget, None for DEFAULT_PROMPT_BUILDER
+        conversation_history: Prompts and raw answers the model saw in each
+            session, replayed so its KV cache matches; None for DEFAULT_CONVERSATION_HISTORY
+
+    Yields:
         Tuple of (chatbot_history, diagram_preview, conversation, current_diagram, pvb_data, cleared_input)
     """
+    log = get_logger(__name__, new_request_id())
+    REQUESTS_IN_FLIGHT.inc()
+    try:
+        with REQUEST_SECONDS.timer():
+            yield from _handle_message(
+                user_input, conversation, current_diagram, pvb_data, analyzer, session_id, edit_mode, model,
+                prompt_builder or DEFAULT_PROMPT_BUILDER, conversation_history or DEFAULT_CONVERSATION_HISTORY, log
+            )
+    finally:
+        # Also runs when the client disconnects and the generator is closed
+        REQUESTS_IN_FLIGHT.dec()
+
+
+def _handle_message(
+    user_input: str,
+    conversation: List[Dict[str, str]],
+    current_diagram: str,
+    pvb_data: Dict,
+    analyzer: Any,
+    session_id: Optional[str],
+    edit_mode: bool,
+    model: Optional[str],
+    prompt_builder: PromptBuilder,
+    conversation_history: ConversationHistory,
+    log: RequestLogger
+) -> Iterator[Tuple[List[Dict[str, str]], str, List[Dict], str, Dict, str]]:
+    """Body of handle_message(), without the request metrics."""
     if not user_input or not user_input.strip():
         # Empty input, return current state
         diagram_preview = f"```mermaid\n{current_diagram}\n```" if current_diagram else "Diagram will appear here..."
-        return conversation, diagram_preview, conversation, current_diagram, pvb_data, ""
+        yield conversation, diagram_preview, conversation, current_diagram, pvb_data, ""
+        return
 
     # Check if this is initial PVB input or refinement
+    is_refinement = bool(pvb_data)
+    # Count prompt tokens with the model's tokenizer once loaded (estimated until then)
+    tokenizer = getattr(analyzer, "tokenizer", None)
+    prompt_tokens = None
+    use_edits = edit_mode and is_refinement and bool(current_diagram)
+    # Earlier turns as the model saw them (prompts and raw answers), else as displayed
+    llm_history = conversation_history.get(session_id, len(conversation))
+    if llm_history is None:
+        llm_history = list(conversation)
+
+    # Layout and styling toggles are answered without the model
+    if is_refinement and current_diagram:
+        with REQUEST_STAGE_SECONDS.timer(stage="refinement_rules"):
+            ruled = apply_refinement_rules(current_diagram, user_input)
+        if ruled is not None:
+            current_diagram, summary = ruled
+            log.info("refinement applied by rules", summary=summary)
+            conversation.append({"role": "user", "content": user_input})
+            conversation.append({"role": "assistant", "content": summary})
+            conversation_history.record(session_id, len(conversation), llm_history + conversation[-2:])
+            diagram_preview = f"```mermaid\n{current_diagram}\n```"
+            yield conversation, diagram_preview, conversation, current_diagram, pvb_data, ""
+            return
+
     if not pvb_data:
         # Try to parse as PVB JSON
-        is_valid, parsed_pvb, error = validate_pvb_json(user_input)
+        with REQUEST_STAGE_SECONDS.timer(stage="pvb_validation"):
+            is_valid, parsed_pvb, error = validate_pvb_json(user_input)
 
         if is_valid:
             # Valid PVB JSON - generate initial diagram
             pvb_data = parsed_pvb
-            prompt = DiagramPrompts.get_initial_prompt(pvb_data)
+            with REQUEST_STAGE_SECONDS.timer(stage="prompt_building"):
+                prompt, prompt_tokens = prompt_builder.initial_prompt(pvb_data, tokenizer)
             display_message = "Here's my Product Vision Board. Please generate a Mermaid diagram."
         else:
             # Not valid PVB JSON, treat as regular message
             prompt = user_input
             display_message = user_input
+    elif use_edits:
+        # Refinement request answered with edit operations
+        with REQUEST_STAGE_SECONDS.timer(stage="prompt_building"):
+            prompt = DiagramPrompts.get_edit_prompt(current_diagram, user_input)
+        display_message = user_input
     else:
         # Refinement request
-        prompt = DiagramPrompts.get_refinement_prompt(pvb_data, current_diagram, user_input)
+        with REQUEST_STAGE_SECONDS.timer(stage="prompt_building"):
+            prompt, prompt_tokens = prompt_builder.refinement_prompt(
+                pvb_data, current_diagram, user_input, tokenizer
+            )
         display_message = user_input
 
+    log.info(
+        "chat request",
+        kind="edit" if use_edits else "refinement" if is_refinement else "initial",
+        session_id=session_id,
+        model=model,
+        input_chars=len(user_input),
+        prompt_tokens=prompt_tokens
+    )
+    if prompt_tokens is not None:
+        PROMPT_TOKENS.observe(prompt_tokens, kind="refinement" if is_refinement else "initial")
+
     # Add display message to conversation (what user sees)
     conversation.append({"role": "user", "content": display_message})
 
-    try:
-        # Create LLM conversation with the actual prompt
-        llm_conversation = conversation[:-1]  # All messages except the last one
-        llm_conversation.append({"role": "user", "content": prompt})
+    # Placeholder assistant message, filled in as tokens arrive
+    assistant_message = {"role": "assistant", "content": STREAMING_DIAGRAM_PLACEHOLDER}
+    conversation.append(assistant_message)
+
+    # Show the user message right away, before the first token
+    diagram_preview = f"```mermaid\n{current_diagram}\n```" if current_diagram else "Diagram will appear here..."
+    yield conversation, diagram_preview, conversation, current_diagram, pvb_data, ""
+
+    # Model still loading in the background: say so rather than hang silently
+    if not getattr(analyzer, "is_ready", True):
+        assistant_message["content"] = MODEL_WARMING_UP_MESSAGE
+        yield conversation, diagram_preview, conversation, current_diagram, pvb_data, ""
+        analyzer.wait_ready()
+        assistant_message["content"] = STREAMING_DIAGRAM_PLACEHOLDER
+
+    # Only an AnalyzerPool takes a model choice
+    model_kwargs = {"model": model} if model else {}
+    # Conversation of the last generation, answer included, for the next turn
+    llm_messages = []
+
+    def stream_response(
+        llm_prompt: str,
+        max_tokens: int,
+        prompt_lookup: bool,
+        validator: Optional[StreamingMermaidValidator] = None
+    ):
+        """
+        Stream the answer to a prompt into the assistant message, returning the full text.
+
+        With a validator, decoding is stopped as soon as the diagram has an
+        invalid line (the text generated so far is returned).
+        """
+        # LLM conversation: history plus the actual prompt instead of the display message
+        llm_conversation = llm_history + [{"role": "user", "content": llm_prompt}]
+
+        response = ""
+        scanner = FencedBlockScanner()
+        stream = analyzer.generate_response_stream(
+            llm_conversation,
+            max_tokens=max_tokens,
+            session_id=session_id,
+            prompt_lookup=prompt_lookup,
+            **model_kwargs
+        )
+        try:
+            for chunk in stream:
+                response += chunk
+                scanner.feed(chunk)
+                assistant_message["content"], preview = render_partial_response(response, scanner, current_diagram)
+                yield conversation, preview, conversation, current_diagram, pvb_data, ""
+                if validator is not None and not validator.feed(chunk):
+                    break
+        finally:
+            # Stops decoding when the loop was left early
+            stream.close()
+        llm_messages[:] = llm_conversation + [{"role": "assistant", "content": response}]
+        return response.strip()
+
+    def repair_diagram(code: str):
+        """
+        Fix an invalid diagram locally, else by asking the model to rewrite
+        only the lines around each syntax error.
+
+        Returns:
+            Tuple of (code, is_valid, summary for the chat)
+        """
+        with REQUEST_STAGE_SECONDS.timer(stage="mermaid_repair"):
+            repaired, changes = repair_mermaid(code)
+        if repaired is not None:
+            DIAGRAM_REPAIRS.inc(result="local")
+            log.info("diagram repaired locally", changes=changes)
+            return repaired, True, f"Syntaxe du diagramme corrigée automatiquement ({len(changes)} correction(s))."
+
+        candidate = code
+        for repair_round in range(MODEL_REPAIR_ROUNDS):
+            error = find_syntax_error(candidate)
+            if error is None:
+                # Not a syntax error (e.g. no connections): nothing to point the model at
+                break
+            start, end = error_window(candidate, error.line)
+            excerpt = "\n".join(candidate.split("\n")[start:end])
+
+            assistant_message["content"] = DIAGRAM_REPAIRING_MESSAGE
+            yield conversation, f"```mermaid\n{candidate}\n```", conversation, current_diagram, pvb_data, ""
+
+            repair_prompt = DiagramPrompts.get_line_repair_prompt(
+                excerpt, error.line - start, f"column {error.column}: {error.message}"
+            )
+            answer = analyzer.generate_response(
+                [{"role": "user", "content": repair_prompt}], max_tokens=REPAIR_MAX_NEW_TOKENS, **model_kwargs
+            )
+            blocks = MermaidExtractor.extract_all_mermaid_blocks(answer)
+            log.info(
+                "diagram repair requested from the model",
+                round=repair_round + 1,
+                error=str(error),
+                excerpt_lines=end - start,
+                prompt_chars=len(repair_prompt),
+                answered=bool(blocks)
+            )
+            if not blocks:
+                break
+            fixed_lines = blocks[0].split("\n")
+            if _is_header(fixed_lines[0]) and not _is_header(excerpt):
+                # Added by the model (or by constrained decoding) to make the block a diagram
+                fixed_lines = fixed_lines[1:]
+            candidate = splice_lines(candidate, start, end, "\n".join(fixed_lines))
+
+            with REQUEST_STAGE_SECONDS.timer(stage="mermaid_repair"):
+                if validate_mermaid_syntax(candidate)[0]:
+                    repaired = candidate
+                else:
+                    repaired, _ = repair_mermaid(candidate)
+            if repaired is not None:
+                DIAGRAM_REPAIRS.inc(result="model")
+                return repaired, True, "Syntaxe du diagramme corrigée automatiquement."
+
+        DIAGRAM_REPAIRS.inc(result="failed")
+        log.info("diagram could not be repaired", changes=changes)
+        return code, False, None
 
-        # Generate response with LLM
-        response = analyzer.generate_response(llm_conversation)
+    try:
+        edit_summary = None
+
+        if use_edits:
+            response = yield from stream_response(prompt, EDIT_MAX_NEW_TOKENS, False)
+            try:
+                with REQUEST_STAGE_SECONDS.timer(stage="edit_application"):
+                    operations = extract_edit_operations(response)
+                    if operations:
+                        edited = apply_edit_operations(current_diagram, operations)
+                        valid, error = validate_mermaid_syntax(edited)
+                        if not valid:
+                            # Same local repair as generated diagrams, else regenerate
+                            edited, _ = repair_mermaid(edited)
+                            if edited is None:
+                                raise EditError(f"Edited diagram is invalid: {error}")
+                            DIAGRAM_REPAIRS.inc(result="local")
+                        current_diagram = edited
+                if operations:
+                    edit_summary = f"Diagramme mis à jour ({len(operations)} modification(s) appliquée(s))."
+                    log.debug("edit operations applied", operations=len(operations))
+            except EditError as e:
+                # Fall back to regenerating the whole diagram
+                log.info("edit operations rejected, regenerating the diagram", error=str(e))
+                operations = None
+
+            if not operations and extract_mermaid_code(response, scan_fenced_blocks(response))[0] is None:
+                prompt, _ = prompt_builder.refinement_prompt(
+                    pvb_data, current_diagram, user_input, tokenizer
+                )
+                use_edits = False
+
+        if not use_edits:
+            # Budget sized from the diagram being refined, or from the PVB for a first diagram
+            max_tokens = estimate_max_new_tokens(current_diagram, pvb_data)
+            llm_prompt = prompt
+            for attempt in range(STREAM_VALIDATION_RETRIES + 1):
+                # Lines the local repair can fix are not worth a retry
+                validator = StreamingMermaidValidator(allow_repairs=True) if attempt < STREAM_VALIDATION_RETRIES else None
+                # Refinements mostly copy the current diagram: draft tokens from the prompt
+                response = yield from stream_response(llm_prompt, max_tokens, is_refinement, validator)
+                if validator is None or not validator.failed:
+                    break
+                DIAGRAM_RETRIES.inc(reason="stream_abort")
+                log.info(
+                    "diagram stopped on an invalid line, retrying",
+                    attempt=attempt + 1,
+                    error=validator.error,
+                    line=validator.error_line,
+                    response_chars=len(response)
+                )
+                llm_prompt = DiagramPrompts.get_syntax_retry_prompt(prompt, validator.error_line, validator.error)
 
         # Extract Mermaid code from response
-        mermaid_code, is_valid = extract_mermaid_code(response)
+        with REQUEST_STAGE_SECONDS.timer(stage="mermaid_extraction"):
+            segments = scan_fenced_blocks(response)
+            mermaid_code, is_valid = extract_mermaid_code(response, segments)
+
+        log.debug("mermaid extracted", valid=is_valid, code_length=len(mermaid_code) if mermaid_code else 0)
 
-        print(f"[DEBUG] Mermaid extraction - is_valid: {is_valid}, code_length: {len(mermaid_code) if mermaid_code else 0}")
+        repair_summary = None
+        if mermaid_code and not is_valid:
+            # Fix near-valid output rather than discarding it
+            mermaid_code, is_valid, repair_summary = yield from repair_diagram(mermaid_code)
 
         if is_valid and mermaid_code:
             # Update current diagram
             current_diagram = mermaid_code
-            print(f"[DEBUG] Updated current_diagram with {len(current_diagram)} characters")
 
         # Format diagram preview
         diagram_preview = f"```mermaid\n{current_diagram}\n```" if current_diagram else "No diagram yet..."
-        print(f"[DEBUG] current_diagram to be returned: {len(current_diagram) if current_diagram else 0} chars")
 
         # For chat display: show only text without the Mermaid code block
-        # Extract text before and after the mermaid block
-        import re
-        chat_response = re.sub(r'```mermaid\n.*?\n```', '', response, flags=re.DOTALL).strip()
+        chat_response = text_without_blocks(response, segments, DIAGRAM_BLOCK_LANGUAGES).strip()
+        for summary in (edit_summary, repair_summary):
+            if summary:
+                chat_response = f"{chat_response}\n\n{summary}".strip()
 
         # If no text remains, add a default message
         if not chat_response:
             chat_response = "Diagramme généré avec succès ! Consultez le panneau de droite pour visualiser le résultat."
 
-        # Add cleaned response to conversation (for chat display)
-        conversation.append({"role": "assistant", "content": chat_response})
+        # Replace streamed content with cleaned response (for chat display)
+        assistant_message["content"] = chat_response
+        if llm_messages:
+            conversation_history.record(session_id, len(conversation), llm_messages)
 
     except Exception as e:
         # Handle errors gracefully
+        log.exception("response generation failed")
         import traceback
         error_message = f"Error generating response: {str(e)}\n\n{traceback.format_exc()}"
-        conversation.append({"role": "assistant", "content": error_message})
+        assistant_message["content"] = error_message
         diagram_preview = f"```mermaid\n{current_diagram}\n```" if current_diagram else "Error occurred"
 
-    print(f"[DEBUG] handle_message returning:")
-    print(f"  - current_diagram length: {len(current_diagram) if current_diagram else 0}")
-    print(f"  - current_diagram first 100 chars: {current_diagram[:100] if current_diagram else 'EMPTY'}")
+    log.debug("chat response", diagram_length=len(current_diagram) if current_diagram else 0, diagram=current_diagram)
 
-    return (
+    yield (
         conversation,          # Chatbot display (same as conversation now)
         diagram_preview,       # Diagram preview
         conversation,          # Updated conversation state
@@ -161,48 +537,37 @@ def handle_open_mermaid_chart(diagram_preview: str) -> str:
     """
     import time
     import hashlib
-    import re
 
     timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-
-    print("\n" + "="*80)
-    print(f"[DEBUG] handle_open_mermaid_chart called at {timestamp}")
-    print(f"[DEBUG] diagram_preview type: {type(diagram_preview)}")
-    print(f"[DEBUG] diagram_preview length: {len(diagram_preview) if diagram_preview else 0}")
-    print(f"[DEBUG] diagram_preview RAW:")
-    print("-"*80)
-    print(diagram_preview if diagram_preview else 'EMPTY')
-    print("-"*80)
+    log = get_logger(__name__, new_request_id())
+    log.debug("mermaid chart link requested", preview=diagram_preview or "")
 
     # Extract Mermaid code from the preview markdown
     # Preview format is: ```mermaid\n<code>\n```
-    mermaid_pattern = r'```mermaid\n(.*?)\n```'
-    match = re.search(mermaid_pattern, diagram_preview, re.DOTALL)
+    block = find_block(scan_fenced_blocks(diagram_preview or ""), "mermaid")
 
-    if not match:
-        print("[DEBUG] No mermaid code found in preview")
-        print("="*80 + "\n")
+    if block is None:
+        log.info("no mermaid code in preview")
         return "⚠️ **Pas de diagramme à partager.** Veuillez d'abord générer un diagramme."
 
-    current_diagram = match.group(1).strip()
-    print(f"[DEBUG] Extracted diagram length: {len(current_diagram)}")
-    print(f"[DEBUG] Extracted diagram preview:")
-    print(current_diagram[:200] if len(current_diagram) > 200 else current_diagram)
+    current_diagram = block.content.strip()
 
     if not current_diagram or not current_diagram.strip():
-        print("[DEBUG] Extracted diagram is empty")
-        print("="*80 + "\n")
+        log.info("empty diagram in preview")
         return "⚠️ **Pas de diagramme à partager.** Veuillez d'abord générer un diagramme."
 
     # Generate hash for verification
     diagram_hash = hashlib.md5(current_diagram.encode()).hexdigest()[:8]
 
-    url = generate_mermaid_chart_url(current_diagram)
-    print(f"[DEBUG] Generated URL length: {len(url) if url else 0}")
-    print(f"[DEBUG] Diagram hash: {diagram_hash}")
-    print(f"[DEBUG] Generated URL FULL:")
-    print(url)
-    print("="*80 + "\n")
+    with REQUEST_STAGE_SECONDS.timer(stage="url_encoding"):
+        url = generate_mermaid_chart_url(current_diagram)
+    log.debug(
+        "mermaid chart link generated",
+        diagram_length=len(current_diagram),
+        diagram_hash=diagram_hash,
+        url_length=len(url) if url else 0,
+        url=url
+    )
 
     if url:
         # Extract unique identifier from diagram (first line for verification)
@@ -0,0 +1,47 @@
+"""
+HTTP server hosting the Gradio UI next to health endpoints.
+
+The Gradio app is mounted on a FastAPI app (both ship with gradio) so that
+the load balancer can probe the instance:
+- /health: the process is up (liveness)
+- /ready: the model is loaded and warmed up (readiness), 503 until then
+- /metrics: Prometheus metrics
+"""
+import gradio as gr
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse, PlainTextResponse
+
+from ..utils.metrics import REGISTRY
+
+
+def create_server(demo: gr.Blocks, analyzer) -> FastAPI:
+    """
+    Create the FastAPI app serving the UI and the probes.
+
+    Args:
+        demo: Gradio Blocks demo
+        analyzer: Analyzer served by the UI (BackgroundAnalyzer reports its
+            loading state, any other analyzer is considered ready)
+
+    Returns:
+        FastAPI application
+    """
+    app = FastAPI()
+
+    @app.get("/health")
+    def health():
+        return {"status": "ok"}
+
+    @app.get("/ready")
+    def ready():
+        if hasattr(analyzer, "get_readiness"):
+            readiness = analyzer.get_readiness()
+        else:
+            readiness = {"status": "ready", "ready": True}
+        return JSONResponse(readiness, status_code=200 if readiness["ready"] else 503)
+
+    @app.get("/metrics")
+    def metrics():
+        return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+    return gr.mount_gradio_app(app, demo, path="/")
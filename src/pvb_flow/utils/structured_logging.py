@@ -0,0 +1,204 @@
+"""
+Structured, leveled logging for the request path.
+
+Records carry a per-request id and key/value fields, long payloads
+(diagrams, URLs) are truncated, and DEBUG records can be sampled per
+request. Handlers on the request path only enqueue records: formatting
+and writing to stdout happen on a background listener thread.
+"""
+import atexit
+import hashlib
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+import uuid
+from typing import Any, Dict, Optional
+
+
+LOGGER_NAME = "pvb_flow"
+LOG_FORMATS = ("text", "json")
+
+# Characters kept from a string field before it is cut
+DEFAULT_MAX_PAYLOAD_CHARS = 200
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def truncate(value: Any, max_chars: int = DEFAULT_MAX_PAYLOAD_CHARS) -> Any:
+    """
+    Cut a long string field, noting how much was dropped.
+
+    Args:
+        value: Field value (non-strings are returned unchanged)
+        max_chars: Characters to keep, 0 or less to keep everything
+
+    Returns:
+        The value, truncated if it is a string longer than max_chars
+    """
+    if not isinstance(value, str) or max_chars <= 0 or len(value) <= max_chars:
+        return value
+    return f"{value[:max_chars]}… (+{len(value) - max_chars} chars)"
+
+
+def new_request_id() -> str:
+    """Short random identifier correlating the records of one request."""
+    return uuid.uuid4().hex[:12]
+
+
+class RequestLogger(logging.LoggerAdapter):
+    """
+    Logger bound to one request id, taking structured fields as keywords.
+
+    Usage:
+        log = get_logger(__name__, request_id)
+        log.debug("mermaid extracted", valid=True, code_length=412)
+    """
+
+    def process(self, msg, kwargs):
+        # Logger._log() only accepts its own keywords: the rest are fields
+        reserved = {"exc_info", "stack_info", "stacklevel", "extra"}
+        fields = {key: kwargs.pop(key) for key in list(kwargs) if key not in reserved}
+        kwargs["extra"] = {**kwargs.get("extra", {}), "request_id": self.extra["request_id"], "fields": fields}
+        return msg, kwargs
+
+
+def get_logger(name: str, request_id: Optional[str] = None) -> RequestLogger:
+    """
+    Get a structured logger, under the package logger.
+
+    Args:
+        name: Module name (usually __name__)
+        request_id: Request to tag records with, "-" outside requests
+
+    Returns:
+        RequestLogger taking structured fields as keyword arguments
+    """
+    # "src.pvb_flow.ui.handlers" -> "pvb_flow.ui.handlers"
+    _, found, module = name.partition(f"{LOGGER_NAME}.")
+    name = f"{LOGGER_NAME}.{module if found else name}"
+    return RequestLogger(logging.getLogger(name), {"request_id": request_id or "-"})
+
+
+class DebugSamplingFilter(logging.Filter):
+    """
+    Keep the DEBUG records of a fraction of requests.
+
+    The decision is derived from the request id, so a sampled request keeps
+    all its DEBUG records and the others cost a single hash.
+    """
+
+    def __init__(self, sample_rate: float = 1.0):
+        super().__init__()
+        self.sample_rate = min(max(sample_rate, 0.0), 1.0)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or self.sample_rate >= 1.0:
+            return True
+        if self.sample_rate <= 0.0:
+            return False
+        request_id = getattr(record, "request_id", "-")
+        digest = hashlib.blake2b(request_id.encode("utf-8"), digest_size=4).digest()
+        return int.from_bytes(digest, "big") / 0xFFFFFFFF < self.sample_rate
+
+
+class StructuredFormatter(logging.Formatter):
+    """Render records as key=value text or as JSON lines, truncating fields."""
+
+    def __init__(self, fmt: str = "text", max_payload_chars: int = DEFAULT_MAX_PAYLOAD_CHARS):
+        super().__init__()
+        if fmt not in LOG_FORMATS:
+            raise ValueError(f"Unknown log format '{fmt}', expected one of {LOG_FORMATS}")
+        self.fmt = fmt
+        self.max_payload_chars = max_payload_chars
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = {
+            key: truncate(value, self.max_payload_chars)
+            for key, value in getattr(record, "fields", {}).items()
+        }
+        request_id = getattr(record, "request_id", "-")
+        message = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+
+        if self.fmt == "json":
+            entry: Dict[str, Any] = {
+                "ts": round(record.created, 3),
+                "level": record.levelname,
+                "logger": record.name,
+                "request_id": request_id,
+                "msg": message,
+                **fields
+            }
+            if record.exc_text:
+                entry["exc"] = record.exc_text
+            return json.dumps(entry, ensure_ascii=False, default=str)
+
+        timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(record.created))
+        pairs = " ".join(f"{key}={json.dumps(value, ensure_ascii=False, default=str)}" for key, value in fields.items())
+        line = f"{timestamp} {record.levelname:<7} {record.name} [{request_id}] {message}"
+        if pairs:
+            line += " " + pairs
+        if record.exc_text:
+            line += "\n" + record.exc_text
+        return line
+
+
+def configure_logging(
+    level: str = "INFO",
+    fmt: str = "text",
+    debug_sample_rate: float = 1.0,
+    max_payload_chars: int = DEFAULT_MAX_PAYLOAD_CHARS,
+    stream=None
+):
+    """
+    Route the package logger through a queue to a background writer.
+
+    Calling it again replaces the previous configuration.
+
+    Args:
+        level: Minimum level name (DEBUG, INFO, WARNING, ERROR)
+        fmt: "text" (key=value) or "json" (one object per line)
+        debug_sample_rate: Fraction of requests whose DEBUG records are kept
+        max_payload_chars: Characters kept from string fields, 0 for all
+        stream: Output stream (default: stdout)
+    """
+    global _listener
+
+    level_number = logging.getLevelName(level.upper())
+    if not isinstance(level_number, int):
+        raise ValueError(f"Unknown log level '{level}'")
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(StructuredFormatter(fmt, max_payload_chars))
+
+    records = queue.SimpleQueue()
+    enqueue = logging.handlers.QueueHandler(records)
+    # Drop unsampled records before they are copied into the queue
+    enqueue.addFilter(DebugSamplingFilter(debug_sample_rate))
+
+    if _listener is not None:
+        _listener.stop()
+    _listener = logging.handlers.QueueListener(records, output, respect_handler_level=True)
+    _listener.start()
+
+    logger = logging.getLogger(LOGGER_NAME)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(enqueue)
+    logger.setLevel(level_number)
+    logger.propagate = False
+
+
+def shutdown_logging():
+    """Flush queued records and stop the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(shutdown_logging)
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+"""
+Tests of the analyzer pool: LRU eviction within the budget, models in use,
+and unloading outside the pool lock.
+"""
+from src.pvb_flow.ai.analyzer_pool import AnalyzerPool
+
+
+class FakeModel:
+    def __init__(self, nbytes: int):
+        self.nbytes = nbytes
+
+    def get_memory_footprint(self) -> int:
+        return self.nbytes
+
+
+class FakeAnalyzer:
+    """Answers with its name; records whether the pool lock was held during cleanup."""
+
+    def __init__(self, name: str, nbytes: int, pool_holder: list, unloads: list):
+        self.name = name
+        self.model = FakeModel(nbytes)
+        self.pool_holder = pool_holder
+        self.unloads = unloads
+
+    def generate_response(self, conversation, max_tokens, **kwargs):
+        return self.name
+
+    def generate_response_stream(self, conversation, max_tokens, **kwargs):
+        yield self.name
+
+    def cleanup_model(self):
+        self.unloads.append((self.name, self.pool_holder[0]._lock.locked()))
+        self.model = None
+
+
+def _pool(sizes: dict, budget: int, estimated: dict = None):
+    """Pool of fake analyzers; returns it with the list of (unloaded name, lock held)."""
+    holder, unloads = [], []
+    factories = {
+        name: (lambda name=name, size=size: FakeAnalyzer(name, size, holder, unloads))
+        for name, size in sizes.items()
+    }
+    pool = AnalyzerPool(factories, budget_bytes=budget, estimated_bytes=estimated or sizes)
+    holder.append(pool)
+    return pool, unloads
+
+
+def test_least_recently_used_evicted():
+    pool, unloads = _pool({"a": 10, "b": 10, "c": 10}, budget=25)
+    assert pool.generate_response([], model="a") == "a"
+    assert pool.generate_response([], model="b") == "b"
+    pool.generate_response([])  # Default model: a is now the most recent
+    assert pool.generate_response([], model="c") == "c"
+
+    stats = pool.get_pool_stats()
+    assert stats["loaded"] == ["a", "c"] and stats["bytes"] == 20
+    assert (stats["loads"], stats["evictions"]) == (3, 1)
+    # Unloaded outside the lock requests need
+    assert unloads == [("b", False)]
+
+
+def test_model_in_use_kept():
+    pool, unloads = _pool({"a": 10, "b": 10, "c": 10}, budget=15)
+    stream = pool.generate_response_stream([], model="a")
+    assert next(stream) == "a"
+    # a is generating: b is loaded over budget rather than evicting it
+    assert pool.generate_response([], model="b") == "b"
+    assert unloads == []
+    assert pool.get_pool_stats()["bytes"] == 20
+    list(stream)
+
+    # Once released, the next load brings the pool back within its budget
+    pool.generate_response([], model="c")
+    assert unloads == [("a", False), ("b", False)]
+
+
+def test_unknown_size_unloads_idle_models():
+    pool, unloads = _pool({"a": 10, "b": 10, "c": 10}, budget=100, estimated={"a": 10, "b": 10})
+    pool.generate_response([], model="a")
+    pool.generate_response([], model="b")
+    pool.generate_response([], model="c")
+    assert sorted(unloads) == [("a", False), ("b", False)]
+    # The measured size is used from then on
+    pool.generate_response([], model="a")
+    assert pool.get_pool_stats()["loaded"] == ["c", "a"]
+
+
+def test_cleanup_and_errors():
+    pool, unloads = _pool({"a": 10, "b": 10}, budget=100)
+    pool.generate_response([], model="a")
+    pool.generate_response([], model="b")
+    pool.cleanup_model()
+    assert sorted(unloads) == [("a", False), ("b", False)]
+    assert pool.get_pool_stats()["loaded"] == []
+
+    try:
+        pool.generate_response([], model="z")
+        assert False, "expected ValueError"
+    except ValueError as e:
+        assert str(e) == "Unknown model: z"
+
+    def failing():
+        raise OSError("no weights")
+
+    pool = AnalyzerPool({"a": failing}, budget_bytes=100)
+    for _ in range(2):
+        try:
+            pool.generate_response([])
+            assert False, "expected OSError"
+        except OSError:
+            pass
+    assert pool._entries["a"].in_use == 0
+
+
+if __name__ == "__main__":
+    for test in (
+        test_least_recently_used_evicted, test_model_in_use_kept, test_unknown_size_unloads_idle_models,
+        test_cleanup_and_errors
+    ):
+        test()
+        print(f"✅ {test.__name__}")
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+"""
+Tests of background model loading, warm-up and readiness.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+from src.pvb_flow.ai.background_loader import (
+    FAILED, LOADING, READY, WARMING_UP, WARMUP_MAX_NEW_TOKENS, BackgroundAnalyzer
+)
+from src.pvb_flow.utils.metrics import QUEUE_DEPTH
+
+
+class GatedAnalyzer:
+    """Records its generations; warm-up blocks until `release` is set."""
+
+    model_name = "fake"
+
+    def __init__(self, release: threading.Event = None):
+        self.release = release
+        self.calls = []  # (max_tokens, counted)
+        self.counting = True
+
+    @contextmanager
+    def uncounted_cache_lookups(self):
+        self.counting = False
+        try:
+            yield
+        finally:
+            self.counting = True
+
+    def generate_response(self, conversation, max_tokens, **kwargs):
+        if self.release is not None:
+            self.release.wait()
+        self.calls.append((max_tokens, self.counting))
+        return "ok"
+
+    def generate_response_stream(self, conversation, max_tokens, **kwargs):
+        yield self.generate_response(conversation, max_tokens, **kwargs)
+
+
+def _wait_for(predicate, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_requests_wait_for_warm_up():
+    release = threading.Event()
+    analyzer = GatedAnalyzer(release)
+    loader = BackgroundAnalyzer(lambda: analyzer).start()
+    _wait_for(lambda: loader.status == WARMING_UP)
+    assert not loader.is_ready
+    # Nothing is delegated before the analyzer is ready
+    try:
+        loader.model_name
+        assert False, "expected AttributeError"
+    except AttributeError:
+        pass
+
+    depth = QUEUE_DEPTH.value()
+    answers = []
+    request = threading.Thread(target=lambda: answers.append(loader.generate_response([], max_tokens=50)))
+    request.start()
+    _wait_for(lambda: QUEUE_DEPTH.value() == depth + 1)
+
+    release.set()
+    request.join(5)
+    assert answers == ["ok"]
+    assert QUEUE_DEPTH.value() == depth
+    assert loader.status == READY and loader.get_readiness()["ready"]
+    # Warm-up first, outside the cache counters, then the request
+    assert analyzer.calls == [(WARMUP_MAX_NEW_TOKENS, False), (50, True)]
+    assert loader.model_name == "fake"
+
+
+def test_without_warm_up():
+    analyzer = GatedAnalyzer()
+    loader = BackgroundAnalyzer(lambda: analyzer, warmup=False).start()
+    assert loader.wait_ready(5)
+    assert loader.status == READY and loader.warmup_seconds is None
+    assert list(loader.generate_response_stream([], max_tokens=10)) == ["ok"]
+    assert analyzer.calls == [(10, True)]
+
+
+def test_load_failure():
+    def factory():
+        raise OSError("no weights")
+
+    loader = BackgroundAnalyzer(factory).start()
+    assert loader.wait_ready(5)
+    readiness = loader.get_readiness()
+    assert readiness["status"] == FAILED and not readiness["ready"]
+    assert readiness["error"] == "no weights"
+    try:
+        loader.generate_response([])
+        assert False, "expected RuntimeError"
+    except RuntimeError as e:
+        assert str(e) == "Model failed to load: no weights"
+
+
+def test_not_started():
+    loader = BackgroundAnalyzer(GatedAnalyzer)
+    assert loader.status == LOADING and not loader.wait_ready(0.01)
+
+
+if __name__ == "__main__":
+    for test in (test_requests_wait_for_warm_up, test_without_warm_up, test_load_failure, test_not_started):
+        test()
+        print(f"✅ {test.__name__}")
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+"""
+Tests of the continuous-batching scheduler against single-request generation.
+
+A tiny random Mistral model and a character-level tokenizer are built in a
+temporary directory, so no download is needed.
+"""
+import tempfile
+import threading
+
+import torch
+from tokenizers import Regex, Tokenizer, decoders, models, pre_tokenizers
+from transformers import MistralConfig, MistralForCausalLM, PreTrainedTokenizerFast
+
+from src.pvb_flow.ai.batch_scheduler import ContinuousBatchScheduler
+from src.pvb_flow.ai.mistral_text_analyzer import MistralTextAnalyzer
+
+
+CHARS = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789 \n[]()-->:`\"éèà"
+
+CONVERSATIONS = [
+    [{"role": "user", "content": "Trace le processus de validation des factures"}],
+    [{"role": "user", "content": "Court"}],
+    [{"role": "user", "content": "Ajoute une étape de contrôle puis une archive à la fin du diagramme"}],
+]
+
+
+def _build_model(path: str):
+    """Save a random two-layer Mistral and a character-level tokenizer to `path`."""
+    vocab = {"<unk>": 0, "<s>": 1, "</s>": 2}
+    for char in CHARS:
+        vocab.setdefault(char, len(vocab))
+    backend = Tokenizer(models.WordLevel(vocab, unk_token="<unk>"))
+    backend.pre_tokenizer = pre_tokenizers.Split(Regex(""), behavior="isolated")
+    backend.decoder = decoders.Fuse()
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=backend, bos_token="<s>", eos_token="</s>", unk_token="<unk>")
+    tokenizer.chat_template = (
+        "{{ bos_token }}{% for m in messages %}[{{ m['role'] }}]{{ m['content'] }}{% endfor %}[assistant]"
+    )
+    tokenizer.save_pretrained(path)
+
+    torch.manual_seed(0)
+    config = MistralConfig(
+        vocab_size=len(vocab), hidden_size=64, intermediate_size=128, num_hidden_layers=2,
+        num_attention_heads=4, num_key_value_heads=2, max_position_embeddings=512,
+        bos_token_id=1, eos_token_id=2
+    )
+    MistralForCausalLM(config).save_pretrained(path)
+
+
+def _analyzer(path: str, **kwargs) -> MistralTextAnalyzer:
+    return MistralTextAnalyzer(hf_token=None, model_name=path, use_prefix_cache=False, session_cache_mb=0, **kwargs)
+
+
+def _generate_together(scheduler, conversations, max_tokens):
+    """Submit every conversation at once and collect the answers."""
+    answers = [None] * len(conversations)
+    start = threading.Barrier(len(conversations))
+
+    def run(index):
+        start.wait()
+        answers[index] = "".join(scheduler.generate_response_stream(conversations[index], max_tokens))
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(len(conversations))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return answers
+
+
+def test_batched_matches_single_greedy():
+    with tempfile.TemporaryDirectory() as path:
+        _build_model(path)
+        analyzer = _analyzer(path)
+        max_tokens = 24
+        expected = [analyzer.generate_response(conversation, max_tokens) for conversation in CONVERSATIONS]
+
+        scheduler = ContinuousBatchScheduler(analyzer, max_batch_size=len(CONVERSATIONS))
+        answers = _generate_together(scheduler, CONVERSATIONS, max_tokens)
+
+    # Prompts of different lengths are left-padded in the shared batch
+    assert [answer.strip() for answer in answers] == expected
+    assert scheduler.get_scheduler_stats()["mean_batch_size"] > 1
+    assert scheduler.eos_token_ids == {2}
+
+
+if __name__ == "__main__":
+    for test in (test_batched_matches_single_greedy,):
+        test()
+        print(f"✅ {test.__name__}")
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+"""
+Tests of the per-session LLM conversation replayed across turns.
+
+A fake analyzer tokenizes conversations one character per token with a
+Mistral-like chat template and keeps a real SessionKVCache, so the number
+of tokens a turn reuses from the previous one can be checked without a model.
+"""
+import json
+
+import torch
+
+from src.pvb_flow.ai.conversation_history import ConversationHistory
+from src.pvb_flow.ai.kv_cache import SessionKVCache, cache_from_tensors
+from src.pvb_flow.ui import handlers
+
+
+with open("benchmarks/corpus/latency_corpus.json", encoding="utf-8") as corpus_file:
+    PVB = json.load(corpus_file)[0]["pvb"]
+
+ANSWERS = [
+    "Voici le processus :\n```mermaid\nflowchart TD\n    A[Début] --> B[Fin]\n```",
+    "```mermaid\nflowchart TD\n    A[Début] --> C[Contrôle]\n    C --> B[Fin]\n```",
+    "```mermaid\nflowchart TD\n    A[Début] --> C[Contrôle]\n    C --> B[Fin]\n    B --> D[Archive]\n```",
+]
+
+
+def _template(conversation) -> str:
+    text = "<s>"
+    for message in conversation:
+        if message["role"] == "user":
+            text += f"[INST]{message['content']}[/INST]"
+        else:
+            text += f"{message['content']}</s>"
+    return text
+
+
+def _tokens(text: str) -> torch.Tensor:
+    return torch.tensor([ord(char) for char in text])
+
+
+class SessionAnalyzer:
+    """Answers from ANSWERS in order, reusing session caches like MistralTextAnalyzer."""
+
+    def __init__(self):
+        self.session_cache = SessionKVCache(max_bytes=1 << 30)
+        self.reused = []  # Reused tokens per generation
+        self.prompts = []  # Tokenized prompt per generation
+
+    def generate_response_stream(self, conversation, max_tokens, session_id=None, prompt_lookup=False):
+        prompt = _template(conversation)
+        input_ids = _tokens(prompt)
+        _, reused = self.session_cache.take(session_id, input_ids)
+        self.reused.append(reused)
+        self.prompts.append(prompt)
+
+        answer = ANSWERS[len(self.reused) - 1]
+        token_ids = _tokens(prompt + answer)
+        empty = torch.zeros(1, 1, token_ids.shape[0], 1)
+        self.session_cache.put(session_id, token_ids, cache_from_tensors([(empty, empty)]))
+        yield answer
+
+
+def _turn(analyzer, history, user_input, state):
+    result = None
+    for result in handlers.handle_message(
+        user_input, state["conversation"], state["diagram"], state["pvb"], analyzer, "session-1",
+        conversation_history=history
+    ):
+        pass
+    state["conversation"], state["diagram"], state["pvb"] = result[2], result[3], result[4]
+
+
+def test_second_refinement_reuses_previous_turn():
+    analyzer = SessionAnalyzer()
+    history = ConversationHistory()
+    state = {"conversation": [], "diagram": "", "pvb": {}}
+
+    _turn(analyzer, history, json.dumps(PVB, ensure_ascii=False), state)
+    _turn(analyzer, history, "ajoute une étape de contrôle", state)
+    _turn(analyzer, history, "ajoute un archivage à la fin", state)
+
+    # Each turn reuses everything the model saw and wrote on the previous one
+    for turn in (1, 2):
+        previous = analyzer.prompts[turn - 1] + ANSWERS[turn - 1]
+        assert analyzer.prompts[turn].startswith(previous)
+        assert analyzer.reused[turn] == len(previous), (turn, analyzer.reused[turn], len(previous))
+    assert analyzer.session_cache.stats()["hits"] == 2
+
+
+def test_display_history_fallback():
+    history = ConversationHistory()
+    history.record("s", 2, [{"role": "user", "content": "prompt"}, {"role": "assistant", "content": "raw"}])
+    assert history.get("s", 2)[1]["content"] == "raw"
+    # Cleared chat or unknown session: the caller falls back to the displayed messages
+    assert history.get("s", 0) is None
+    assert history.get("other", 2) is None
+    assert history.get(None, 2) is None
+
+
+def test_history_restarts_when_too_long():
+    history = ConversationHistory(max_exchanges=2)
+    messages = []
+    for index in range(3):
+        messages += [{"role": "user", "content": f"q{index}"}, {"role": "assistant", "content": f"a{index}"}]
+    history.record("s", 6, messages)
+    assert [message["content"] for message in history.get("s", 6)] == ["q2", "a2"]
+
+
+def test_sessions_evicted_least_recently_used():
+    history = ConversationHistory(max_sessions=2)
+    for session in ("a", "b"):
+        history.record(session, 2, [])
+    history.get("a", 2)
+    history.record("c", 2, [])
+    assert history.get("b", 2) is None
+    assert history.get("a", 2) == [] and history.get("c", 2) == []
+
+
+if __name__ == "__main__":
+    for test in (
+        test_second_refinement_reuses_previous_turn, test_display_history_fallback,
+        test_history_restarts_when_too_long, test_sessions_evicted_least_recently_used
+    ):
+        test()
+        print(f"✅ {test.__name__}")
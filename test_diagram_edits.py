@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+"""
+Tests of the edit operations applied to a diagram.
+"""
+from src.pvb_flow.core.diagram_edits import (
+    EditError, EditOperation, apply_edit_operations, extract_edit_operations
+)
+
+
+DIAGRAM = """flowchart TD
+    subgraph Process
+        A["Début"]
+        B{{"Choix ?"}}
+    end
+    A --> B
+    B -->|"oui"| C & D
+    style A fill:#fff
+    class A,C done"""
+
+# (operation, argument, lines of DIAGRAM replaced: {old line: new lines})
+APPLIED = [
+    ("add_node", 'V["👤 Validation"] in Process',
+     {'        B{{"Choix ?"}}': ['        B{{"Choix ?"}}', '        V["👤 Validation"]']}),
+    ("add_node", 'V["x"]', {'        B{{"Choix ?"}}': ['        B{{"Choix ?"}}', '        V["x"]']}),
+    ("remove_node", "C", {'    B -->|"oui"| C & D': ['    B -->|"oui"| D'], "    class A,C done": ["    class A done"]}),
+    ("remove_node", "A", {
+        '        A["Début"]': [], "    A --> B": [], "    style A fill:#fff": [], "    class A,C done": ["    class C done"]
+    }),
+    # C and D only appeared in B's edge
+    ("remove_node", "B", {
+        '        B{{"Choix ?"}}': [], "    A --> B": [], '    B -->|"oui"| C & D': ["    C", "    D"]
+    }),
+    ("add_edge", "C --> D", {'    B -->|"oui"| C & D': ['    B -->|"oui"| C & D', "    C --> D"]}),
+    ("remove_edge", "A --> B", {"    A --> B": []}),
+    # C no longer appears in any edge: it keeps a standalone definition
+    ("remove_edge", "B --> C", {'    B -->|"oui"| C & D': ["    C", '    B -->|"oui"| D']}),
+    ("restyle", "A fill:#000", {"    style A fill:#fff": ["    style A fill:#000"]}),
+    ("restyle", "B fill:#f00", {"    style A fill:#fff": ["    style A fill:#fff", "    style B fill:#f00"]}),
+    ("relabel", 'B "Nouveau"', {'        B{{"Choix ?"}}': ['        B{{"Nouveau"}}']}),
+    ("relabel", 'C "Cé"', {'        B{{"Choix ?"}}': ['        B{{"Choix ?"}}', '        C["Cé"]']}),
+    ("direction", "lr", {"flowchart TD": ["flowchart LR"]}),
+]
+
+# (operation, argument, error message)
+REJECTED = [
+    ("add_node", 'A["x"]', "Node already exists: A"),
+    ("add_node", 'V["x"] in Nope', "Unknown subgraph: Nope"),
+    ("add_node", "A --> B", "Invalid node definition: A --> B"),
+    ("remove_node", "Z", "Unknown node: Z"),
+    ("add_edge", "C -->", "Invalid edge: C -->"),
+    ("add_edge", "C", "Invalid edge: C"),
+    ("remove_edge", "A --> C", "Unknown edge: A --> C"),
+    ("remove_edge", "junk", "Invalid edge: junk"),
+    ("restyle", "B", "Invalid style: B"),
+    ("restyle", "Z fill:#f00", "Unknown node: Z"),
+    ("relabel", "B", "Missing label: B"),
+    ("relabel", 'Z "x"', "Unknown node: Z"),
+    ("direction", "XX", "Invalid direction: XX"),
+]
+
+
+def _expected(replacements: dict) -> str:
+    lines = []
+    for line in DIAGRAM.split("\n"):
+        lines.extend(replacements.get(line, [line]))
+    return "\n".join(lines)
+
+
+def test_apply():
+    for name, argument, replacements in APPLIED:
+        result = apply_edit_operations(DIAGRAM, [EditOperation(name, argument)])
+        assert result == _expected(replacements), f"{name} {argument}:\n{result}"
+
+
+def test_apply_in_order():
+    operations = [EditOperation("add_node", 'V["x"]'), EditOperation("add_edge", "V --> A")]
+    assert "    V --> A" in apply_edit_operations(DIAGRAM, operations).split("\n")
+
+
+def test_rejected():
+    for name, argument, message in REJECTED:
+        try:
+            apply_edit_operations(DIAGRAM, [EditOperation(name, argument)])
+        except EditError as e:
+            assert str(e) == message, f"{name} {argument}: {e}"
+        else:
+            raise AssertionError(f"{name} {argument}: applied")
+
+
+def test_no_header():
+    try:
+        apply_edit_operations("A --> B", [EditOperation("direction", "LR")])
+    except EditError as e:
+        assert str(e) == "Diagram has no flowchart header"
+    else:
+        raise AssertionError("applied")
+
+
+def test_extract():
+    operations = extract_edit_operations("Voilà :\n```edits\nadd_edge A --> B\n%% c\n\ndirection LR\n```")
+    assert [(operation.name, operation.argument) for operation in operations] == [
+        ("add_edge", "A --> B"), ("direction", "LR")
+    ]
+    assert extract_edit_operations("Pas de bloc") is None
+    try:
+        extract_edit_operations("```edits\nexplode A\n```")
+    except EditError as e:
+        assert str(e) == "Unknown edit operation: explode"
+    else:
+        raise AssertionError("unknown operation accepted")
+
+
+if __name__ == "__main__":
+    for test in (test_apply, test_apply_in_order, test_rejected, test_no_header, test_extract):
+        test()
+        print(f"✅ {test.__name__}")
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""
+Tests of the incremental fenced block scanner.
+"""
+from src.pvb_flow.core.fenced_blocks import (
+    CODE, TEXT, FencedBlockScanner, find_block, scan_fenced_blocks, text_without_blocks
+)
+
+
+RESPONSE = "Voici le diagramme :\n```mermaid\nflowchart TD\n    A --> B\n```\nBonne lecture."
+
+
+def _summary(segments):
+    return [(segment.kind, segment.language, segment.content, segment.start, segment.end, segment.closed)
+            for segment in segments]
+
+
+def _scan_in_chunks(text: str, *sizes: int):
+    scanner = FencedBlockScanner()
+    position = 0
+    for size in sizes:
+        scanner.feed(text[position:position + size])
+        position += size
+    scanner.feed(text[position:])
+    return scanner.finish()
+
+
+def test_whole_text():
+    segments = scan_fenced_blocks(RESPONSE)
+    assert [(segment.kind, segment.closed) for segment in segments] == [(TEXT, True), (CODE, True), (TEXT, True)]
+    block = find_block(segments, "mermaid")
+    assert block.content == "flowchart TD\n    A --> B"
+    assert RESPONSE[block.start:block.end] == "```mermaid\nflowchart TD\n    A --> B\n```"
+    assert text_without_blocks(RESPONSE, segments, ["mermaid"]) == "Voici le diagramme :\n\nBonne lecture."
+
+
+def test_fence_split_across_chunks():
+    expected = _summary(scan_fenced_blocks(RESPONSE))
+    for split in range(len(RESPONSE) + 1):
+        assert _summary(_scan_in_chunks(RESPONSE, split)) == expected, split
+    # One character at a time
+    assert _summary(_scan_in_chunks(RESPONSE, *[1] * len(RESPONSE))) == expected
+
+
+def test_partial_fence_state():
+    scanner = FencedBlockScanner()
+    scanner.feed("Voici :\n`")
+    assert scanner.fence_pending and scanner.open_block is None
+    scanner.feed("``mer")
+    assert scanner.fence_pending
+    scanner.feed("maid\nA")
+    assert scanner.open_block.language == "mermaid"
+    # Only complete lines are part of an open block
+    assert scanner.open_block.content == ""
+    scanner.feed(" --> B\n")
+    assert scanner.open_block.content == "A --> B"
+
+
+def test_crlf_and_trailing_spaces():
+    text = "Voici :\r\n```mermaid  \r\nflowchart TD\r\n    A --> B\r\n```  \r\nFin"
+    segments = scan_fenced_blocks(text)
+    block = find_block(segments, "mermaid")
+    assert block is not None and block.content == "flowchart TD\n    A --> B"
+    assert text[block.start:block.end] == "```mermaid  \r\nflowchart TD\r\n    A --> B\r\n```  "
+    assert _summary(_scan_in_chunks(text, 3, 5, 7, 11)) == _summary(segments)
+
+
+def test_unclosed_block():
+    text = "Voici :\n```mermaid\nflowchart TD\n    A --> B"
+    segments = scan_fenced_blocks(text)
+    assert segments[-1].kind == CODE and not segments[-1].closed
+    assert segments[-1].content == "flowchart TD\n    A --> B"
+    assert segments[-1].end == len(text)
+    assert find_block(segments, "mermaid") is None
+    # Unclosed blocks are kept in the text
+    assert text_without_blocks(text, segments, ["mermaid"]) == text
+
+
+def test_inline_backticks_are_text():
+    text = "Utilise ```mermaid``` ou une ligne ``` dans le texte.\n```mermaid\nflowchart TD\n    A --> B\n```"
+    segments = scan_fenced_blocks(text)
+    assert [segment.kind for segment in segments] == [TEXT, CODE]
+    assert segments[1].language == "mermaid" and segments[1].content == "flowchart TD\n    A --> B"
+    assert segments[1].start == text.index("```mermaid\n")
+    # Indented up to 3 spaces it is still a fence, with 4 spaces it is not
+    assert find_block(scan_fenced_blocks("   ```mermaid\nA --> B\n```"), "mermaid").start == 3
+    assert find_block(scan_fenced_blocks("    ```mermaid\nA --> B\n```"), "mermaid") is None
+
+    scanner = FencedBlockScanner()
+    scanner.feed("Voici ``")
+    assert not scanner.fence_pending
+    scanner.feed("`mermaid`` :\n  ``")
+    assert scanner.open_block is None and scanner.fence_pending
+
+
+if __name__ == "__main__":
+    for test in (
+        test_whole_text, test_fence_split_across_chunks, test_partial_fence_state,
+        test_crlf_and_trailing_spaces, test_unclosed_block, test_inline_backticks_are_text
+    ):
+        test()
+        print(f"✅ {test.__name__}")
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+"""
+Accept/reject tests of the flowchart parser and its line grammar.
+"""
+from src.pvb_flow.core.flowchart_parser import FlowchartSyntaxError, parse_flowchart
+from src.pvb_flow.core.mermaid_grammar import (
+    COMPLETE, INCOMPLETE, INVALID, FlowchartGrammarState, check_line
+)
+
+
+# (description, diagram) pairs that must parse
+ACCEPTED = [
+    ("chain with labels", 'flowchart TD\n    A["x"] -->|"oui"| B{{"y"}} & C'),
+    ("graph header with semicolons", "graph LR;\n    A --> B;"),
+    ("comment line", "flowchart TD\n    %% comment\n    A --> B"),
+    ("trailing comment", "flowchart TD\n    A --> B %% note"),
+    ("trailing comment after semicolon", "flowchart TD\n    A --> B;  %% note"),
+    ("trailing comment on the header", "flowchart TD %% note\n    A --> B"),
+    ("quoted %% is not a comment", 'flowchart TD\n    A["50%% done"] --> B'),
+    ("trailing comment on keywords",
+     "flowchart TD\n    subgraph S Title %% c\n        A --> B\n    end %% c\n"
+     "    style A fill:#fff %% c\n    classDef x fill:#f00 %% c\n    class A x %% c"),
+    ("edge ids", "flowchart TD\n    A e1@--> B\n    B e2@-->|x| C"),
+    ("node metadata", 'flowchart TD\n    A@{ shape: rect, label: "Start }" } --> B'),
+    ("node metadata without label", "flowchart TD\n    A@{ shape: circle } --> B"),
+    ("accTitle and accDescr", "flowchart LR\n    accTitle: My chart\n    accDescr: What it shows\n    A --> B"),
+    ("single-line accDescr block", "flowchart LR\n    accDescr { What it shows }\n    A --> B"),
+    ("multi-line accDescr block", "flowchart LR\n    accDescr {\n        What (it] shows\n    }\n    A --> B"),
+]
+
+# (description, diagram, line of the error) triples that must not parse
+REJECTED = [
+    ("missing header", "A --> B", 1),
+    ("text after a statement", "flowchart TD\n    A --> B junk", 2),
+    ("unbalanced brackets", "flowchart TD\n    A[x --> B", 2),
+    ("parens in an unquoted label", "flowchart TD\n    A[a (b)] --> B", 2),
+    ("edge id without a link", "flowchart TD\n    A e1@ B", 2),
+    ("unterminated node metadata", "flowchart TD\n    A@{ shape: rect", 2),
+    ("accTitle without ':'", "flowchart TD\n    accTitle My chart", 2),
+    ("unclosed accDescr block", "flowchart TD\n    accDescr {\n    x", 2),
+    ("stray end", "flowchart TD\n    A --> B\n    end", 3),
+    ("unclosed subgraph", "flowchart TD\n    subgraph S\n    A --> B", 3),
+]
+
+# (partial line, status) while the line is still being generated
+PARTIAL_LINES = [
+    ("    A e1", INCOMPLETE),
+    ("    A e1@-", INCOMPLETE),
+    ("    A@{ sh", INCOMPLETE),
+    ("    A --> B %", INCOMPLETE),
+    ("    A --> B %% note", COMPLETE),
+    ("    accDescr {", COMPLETE),
+    ("    A e1@ B", INVALID),
+    ("    A --> B; C", INVALID),
+]
+
+
+def test_accepted():
+    for description, code in ACCEPTED:
+        try:
+            parse_flowchart(code)
+        except FlowchartSyntaxError as e:
+            raise AssertionError(f"{description}: {e}")
+
+
+def test_rejected():
+    for description, code, line in REJECTED:
+        try:
+            parse_flowchart(code)
+        except FlowchartSyntaxError as e:
+            assert e.line == line, f"{description}: {e}"
+        else:
+            raise AssertionError(f"{description}: accepted")
+
+
+def test_partial_lines():
+    for line, status in PARTIAL_LINES:
+        assert check_line(line)[0] == status, line
+
+
+def test_tree():
+    chart = parse_flowchart(
+        'flowchart LR %% c\n    A@{ shape: rect, label: "Start" } e1@-->|"go"| B %% c\n'
+        "    style A fill:#fff %% c"
+    )
+    assert chart.direction == "LR"
+    assert (chart.nodes["A"].shape, chart.nodes["A"].label) == ("@{}", "Start")
+    edge = chart.edges[0]
+    assert (edge.source, edge.arrow, edge.label, edge.target) == ("A", "-->", "go", "B")
+    assert chart.styles[0].properties == {"fill": "#fff"}
+
+
+def test_grammar_state_description_block():
+    state = FlowchartGrammarState()
+    for line in ("flowchart TD", "    accDescr {"):
+        state.advance(line)
+    assert not state.can_close()
+    assert state.check("    free (text]")[0] == COMPLETE
+    state.advance("    }")
+    assert state.can_close()
+    assert state.check("    end %% c")[0] == INVALID
+
+
+if __name__ == "__main__":
+    for test in (test_accepted, test_rejected, test_partial_lines, test_tree, test_grammar_state_description_block):
+        test()
+        print(f"✅ {test.__name__}")
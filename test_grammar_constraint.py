@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+"""
+Tests of grammar-constrained decoding inside the ```mermaid``` block.
+"""
+import torch
+
+from src.pvb_flow.ai.grammar_constraint import GRAMMAR_FALLBACKS, MermaidGrammarLogitsProcessor
+
+
+class ByteTokenizer:
+    """Greedy longest-match tokenizer over a small vocabulary, with byte-fallback tokens."""
+
+    def __init__(self, pieces):
+        self.vocab = [b"</s>"] + [piece.encode() for piece in pieces]
+        # Byte fallback for characters outside the vocabulary (é, emojis)
+        self.byte_ids = {}
+        for value in range(0x80, 0x100):
+            self.byte_ids[value] = len(self.vocab)
+            self.vocab.append(bytes([value]))
+        self.decode_calls = 0
+
+    def __len__(self):
+        return len(self.vocab)
+
+    def encode(self, text, add_special_tokens=False):
+        data, ids = text.encode(), []
+        while data:
+            match = max(
+                (index for index, piece in enumerate(self.vocab[1:], 1) if data.startswith(piece)),
+                key=lambda index: len(self.vocab[index]), default=None
+            )
+            if match is None:
+                match = self.byte_ids[data[0]]
+            ids.append(match)
+            data = data[len(self.vocab[match]):]
+        return ids
+
+    def decode(self, ids, skip_special_tokens=False):
+        self.decode_calls += 1
+        return b"".join(self.vocab[index] for index in ids if index != 0).decode("utf-8", "replace")
+
+    def batch_decode(self, sequences, skip_special_tokens=False):
+        return [self.decode(ids, skip_special_tokens) for ids in sequences]
+
+
+CHARS = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789 :\n[](){}>-|\"`;"
+TOKENIZER = ByteTokenizer(list(CHARS) + ["```mermaid", "```", "flowchart", " TD", " -->", "    "])
+
+OPENING = "Voici :\n```mermaid\nflowchart TD\n"
+
+
+def _step(processor, text, preferred):
+    """Run the processor after `text` with `preferred` as the best-scored tokens; return the kept ids."""
+    ids = torch.tensor([TOKENIZER.encode(text)])
+    scores = torch.zeros(1, len(TOKENIZER))
+    for rank, piece in enumerate(preferred):
+        scores[0, TOKENIZER.encode(piece)[0]] = 10.0 - rank
+    scores = processor(ids, scores)
+    return {index for index in range(len(TOKENIZER)) if scores[0, index] > -float("inf")}
+
+
+def _id(piece):
+    return TOKENIZER.encode(piece)[0]
+
+
+def test_invalid_continuations_masked():
+    processor = MermaidGrammarLogitsProcessor(TOKENIZER, 0)
+    kept = _step(processor, OPENING + "    A[Début] -->", ["]", ">", " B"])
+    # A closing bracket or a stray arrow head cannot follow the arrow
+    assert _id("]") not in kept and _id(">") not in kept
+    assert _id(" B") in kept
+    assert processor.masked_steps == 1
+
+    # The fence closes the block only at the start of a complete line
+    kept = _step(processor, OPENING + "    A[Début] --> B\n", ["```", "    "])
+    assert _id("```") in kept
+    kept = _step(processor, OPENING + "    A[Début] -->", ["```"])
+    assert _id("```") not in kept
+
+
+def test_text_outside_block_unconstrained():
+    processor = MermaidGrammarLogitsProcessor(TOKENIZER, 0)
+    assert len(_step(processor, "Voici ] le diagramme", ["]"])) == len(TOKENIZER)
+    closed = OPENING + "    A --> B\n```\n"
+    assert len(_step(processor, closed, ["]"])) == len(TOKENIZER)
+
+
+def test_incremental_text_without_decoding():
+    processor = MermaidGrammarLogitsProcessor(TOKENIZER, 0)
+    text = OPENING + "    A[Entrée] --> B[Sortie]\n    B --> C"
+    ids = TOKENIZER.encode(text)
+    calls = TOKENIZER.decode_calls
+    for length in range(1, len(ids) + 1):
+        scores = torch.zeros(1, len(TOKENIZER))
+        processor(torch.tensor([ids[:length]]), scores)
+    state = processor._rows[0]
+    assert state.text == text
+    # Only the bytes of "é" were decoded (once incomplete, once complete),
+    # candidates and other tokens use the precomputed pieces
+    assert TOKENIZER.decode_calls - calls == 2
+
+
+def test_partial_character_not_judged():
+    processor = MermaidGrammarLogitsProcessor(TOKENIZER, 0)
+    # First byte of "é": the label cannot be checked until the character is complete
+    ids = TOKENIZER.encode(OPENING + "    A[D") + [TOKENIZER.byte_ids["é".encode()[0]]]
+    scores = torch.zeros(1, len(TOKENIZER))
+    processor(torch.tensor([ids]), scores)
+    assert torch.isfinite(scores).all()
+
+
+def test_fallback_counted():
+    processor = MermaidGrammarLogitsProcessor(TOKENIZER, 0)
+    processor.TOP_K = processor.MAX_CANDIDATES = 2
+    before = GRAMMAR_FALLBACKS.value()
+    # No valid candidate among the checked ones: the scores are left as they are
+    kept = _step(processor, OPENING + "    A[Début] -->", ["]", ">"])
+    assert len(kept) == len(TOKENIZER)
+    assert processor.fallback_steps == 1
+    assert GRAMMAR_FALLBACKS.value() == before + 1
+
+
+if __name__ == "__main__":
+    for test in (
+        test_invalid_continuations_masked, test_text_outside_block_unconstrained,
+        test_incremental_text_without_decoding, test_partial_character_not_judged, test_fallback_counted
+    ):
+        test()
+        print(f"✅ {test.__name__}")
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+"""
+Tests of the idle watchdog: unload after inactivity, reload on the next
+request, and requests arriving while the model is being unloaded.
+"""
+import threading
+import time
+
+from src.pvb_flow.ai.idle_watchdog import IdleUnloadWatchdog
+
+
+class ReloadableAnalyzer:
+    """Fails to generate while unloaded; cleanup can be held mid-way."""
+
+    def __init__(self):
+        self.model = object()
+        self.reloads = 0
+        self.cleanup_started = threading.Event()
+        self.finish_cleanup = threading.Event()
+        self.finish_cleanup.set()
+        self.fail_reload = False
+
+    def generate_response(self, conversation, max_tokens, **kwargs):
+        assert self.model is not None, "generation on an unloaded model"
+        return "ok"
+
+    def generate_response_stream(self, conversation, max_tokens, **kwargs):
+        for chunk in ("o", "k"):
+            assert self.model is not None, "generation on an unloaded model"
+            yield chunk
+
+    def cleanup_model(self):
+        self.cleanup_started.set()
+        self.finish_cleanup.wait()
+        self.model = None
+
+    def reload_model(self):
+        if self.fail_reload:
+            raise OSError("no weights")
+        self.reloads += 1
+        self.model = object()
+
+
+def _wait_for(predicate, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_unload_then_reload():
+    analyzer = ReloadableAnalyzer()
+    watchdog = IdleUnloadWatchdog(analyzer, idle_timeout=0.1, check_interval=0.02)
+    unloads = watchdog.get_watchdog_stats()["unloads"]
+    _wait_for(lambda: not watchdog.loaded)
+    assert analyzer.model is None
+    assert watchdog.get_watchdog_stats()["unloads"] == unloads + 1
+
+    assert watchdog.generate_response([]) == "ok"
+    assert analyzer.reloads == 1 and watchdog.loaded
+
+
+def test_not_unloaded_mid_generation():
+    analyzer = ReloadableAnalyzer()
+    watchdog = IdleUnloadWatchdog(analyzer, idle_timeout=0.05, check_interval=0.01)
+    stream = watchdog.generate_response_stream([])
+    assert next(stream) == "o"
+    time.sleep(0.2)
+    assert watchdog.loaded and watchdog.get_watchdog_stats()["in_flight"] == 1
+    assert next(stream) == "k"
+    list(stream)
+    assert watchdog.get_watchdog_stats()["in_flight"] == 0
+
+
+def test_request_during_unload():
+    analyzer = ReloadableAnalyzer()
+    analyzer.finish_cleanup.clear()
+    watchdog = IdleUnloadWatchdog(analyzer, idle_timeout=0.05, check_interval=0.01)
+    assert analyzer.cleanup_started.wait(5)
+
+    # Requests arriving mid-unload wait for it, then reload once
+    answers = []
+    requests = [
+        threading.Thread(target=lambda: answers.append(watchdog.generate_response([])))
+        for _ in range(3)
+    ]
+    for request in requests:
+        request.start()
+    time.sleep(0.1)
+    assert answers == []
+
+    analyzer.finish_cleanup.set()
+    for request in requests:
+        request.join(5)
+    assert answers == ["ok"] * 3
+    assert analyzer.reloads == 1
+
+
+def test_failed_reload():
+    analyzer = ReloadableAnalyzer()
+    watchdog = IdleUnloadWatchdog(analyzer, idle_timeout=0.05, check_interval=0.01)
+    _wait_for(lambda: not watchdog.loaded)
+    analyzer.fail_reload = True
+    try:
+        watchdog.generate_response([])
+        assert False, "expected OSError"
+    except OSError:
+        pass
+    assert not watchdog.loaded and watchdog.get_watchdog_stats()["in_flight"] == 0
+
+    analyzer.fail_reload = False
+    assert watchdog.generate_response([]) == "ok"
+
+
+if __name__ == "__main__":
+    for test in (test_unload_then_reload, test_not_unloaded_mid_generation, test_request_during_unload, test_failed_reload):
+        test()
+        print(f"✅ {test.__name__}")
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+"""
+Tests of the deterministic flowchart repair and the repair helpers.
+"""
+from src.pvb_flow.core.mermaid_repair import (
+    error_window, find_syntax_error, repair_line, repair_mermaid, splice_lines
+)
+
+
+# (description, line, repaired line) for each class of error fixed in a line
+REPAIRED_LINES = [
+    ("unbalanced bracket", "    A[Start --> B", "    A[Start] --> B"),
+    ("unbalanced shape", "    A[x] --> B(((y", "    A[x] --> B(((y)))"),
+    ("parens in a label", "    A[Etape (1)] --> B", '    A["Etape (1)"] --> B'),
+    ("'{{' closed with '}'", "    A{{Choix} --> B", "    A{{Choix}} --> B"),
+]
+
+# Valid lines repair_line() must return unchanged
+VALID_LINES = [
+    "    A[Début] --> B",
+    '    A["x"] -->|"oui"| B & C',
+    "A --> B",
+]
+
+# Lines that are not node/edge statements or cannot be repaired
+UNREPAIRABLE_LINES = [
+    "    style A fill:#f00",
+    "    subgraph S",
+    "    click A call",
+    "nonsense (((",
+]
+
+# (description, diagram, repaired diagram) for each class of error fixed in a diagram
+REPAIRED_DIAGRAMS = [
+    ("unbalanced bracket", "flowchart TD\n    A[Start --> B", "flowchart TD\n    A[Start] --> B"),
+    ("missing header", "A --> B", "flowchart TD\nA --> B"),
+    ("undefined style", "flowchart TD\n    A --> B\n    style Z fill:#f00", "flowchart TD\n    A --> B"),
+    ("undefined node in a class", "flowchart TD\n    A --> B\n    class A,Z c", "flowchart TD\n    A --> B\n    class A c"),
+    ("unclosed subgraph", "flowchart TD\n    subgraph S\n    A --> B", "flowchart TD\n    subgraph S\n    A --> B\n    end"),
+    ("stray end", "flowchart TD\n    A --> B\n    end", "flowchart TD\n    A --> B"),
+]
+
+CODE = "\n".join(f"l{index}" for index in range(1, 10))
+
+
+def test_repair_line():
+    for description, line, expected in REPAIRED_LINES:
+        assert repair_line(line) == expected, description
+    for line in VALID_LINES:
+        assert repair_line(line) == line, line
+    for line in UNREPAIRABLE_LINES:
+        assert repair_line(line) is None, line
+
+
+def test_repair_mermaid():
+    for description, code, expected in REPAIRED_DIAGRAMS:
+        repaired, changes = repair_mermaid(code)
+        assert repaired == expected, description
+        assert changes, description
+
+
+def test_repair_mermaid_untouched():
+    code = 'flowchart TD\n    A["Début"] --> B{{"Choix ?"}}\n    style A fill:#f00'
+    assert repair_mermaid(code) == (code, [])
+
+
+def test_repair_mermaid_gives_up():
+    # No edge left, or nothing that looks like a flowchart
+    assert repair_mermaid("flowchart TD\n    A")[0] is None
+    assert repair_mermaid("nonsense (((")[0] is None
+    assert repair_mermaid("")[0] is None
+
+
+def test_find_syntax_error():
+    error = find_syntax_error("flowchart TD\n    A --> B\n    A[x")
+    assert (error.line, error.column) == (3, 8)
+    assert find_syntax_error("flowchart TD\n    A --> B") is None
+
+
+def test_error_window():
+    assert error_window(CODE, 5) == (1, 8)
+    assert error_window(CODE, 1) == (0, 4)
+    assert error_window(CODE, 9, context=1) == (7, 9)
+    # Lines past the end are clamped to the last one
+    assert error_window(CODE, 42) == (5, 9)
+
+
+def test_splice_lines():
+    assert splice_lines(CODE, 2, 4, "X\nY\nZ") == "l1\nl2\nX\nY\nZ\nl5\nl6\nl7\nl8\nl9"
+    assert splice_lines(CODE, 0, 9, "A") == "A"
+
+
+if __name__ == "__main__":
+    for test in (
+        test_repair_line, test_repair_mermaid, test_repair_mermaid_untouched,
+        test_repair_mermaid_gives_up, test_find_syntax_error, test_error_window, test_splice_lines
+    ):
+        test()
+        print(f"✅ {test.__name__}")
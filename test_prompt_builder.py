@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+"""
+Tests of the token-budgeted prompt builder: which optional section is left
+out first, and what is always kept.
+"""
+import json
+
+from src.pvb_flow.ai.prompt_builder import SECTION_SEPARATOR, PromptBuilder
+from src.pvb_flow.ai.prompts_config import DiagramPrompts
+
+
+with open("benchmarks/corpus/latency_corpus.json", encoding="utf-8") as corpus_file:
+    PVB = json.load(corpus_file)[0]["pvb"]
+
+DIAGRAM = "flowchart TD\n    A --> B"
+REQUEST = "ajoute une étape de validation"
+
+
+class CountingTokenizer:
+    """One token per word; counts encode() calls."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def encode(self, text, add_special_tokens=False):
+        self.calls += 1
+        return text.split()
+
+
+def _tokens(builder: PromptBuilder, text: str) -> int:
+    return builder.count_tokens(text)
+
+
+def test_initial_prompt_drops_analysis_steps():
+    full, full_tokens = PromptBuilder(0).initial_prompt(PVB)
+    assert DiagramPrompts.ANALYSIS_STEPS in full
+
+    prompt, tokens = PromptBuilder(full_tokens - 1).initial_prompt(PVB)
+    assert DiagramPrompts.ANALYSIS_STEPS not in prompt
+    assert tokens == full_tokens - _tokens(PromptBuilder(), DiagramPrompts.ANALYSIS_STEPS)
+    # The cached system prompt prefix is still the start of the prompt
+    assert prompt.startswith(DiagramPrompts.SYSTEM_PROMPT)
+
+    # Required sections are kept even far above the budget
+    prompt, _ = PromptBuilder(1).initial_prompt(PVB)
+    assert prompt.startswith(DiagramPrompts.SYSTEM_PROMPT)
+    assert PromptBuilder.serialize_pvb(PVB) in prompt and DiagramPrompts.DIAGRAM_REQUIREMENTS in prompt
+
+
+def test_refinement_prompt_drop_order():
+    builder = PromptBuilder(0)
+    full, full_tokens = builder.refinement_prompt(PVB, DIAGRAM, REQUEST)
+    guidelines = _tokens(builder, DiagramPrompts.REFINEMENT_GUIDELINES)
+
+    # Guidelines go first, the board is kept while the rest fits
+    prompt, tokens = PromptBuilder(full_tokens - 1).refinement_prompt(PVB, DIAGRAM, REQUEST)
+    assert DiagramPrompts.REFINEMENT_GUIDELINES not in prompt
+    assert "ORIGINAL PRODUCT VISION BOARD" in prompt
+    assert tokens == full_tokens - guidelines
+
+    # Then the board
+    prompt, _ = PromptBuilder(full_tokens - guidelines - 1).refinement_prompt(PVB, DIAGRAM, REQUEST)
+    assert "ORIGINAL PRODUCT VISION BOARD" not in prompt
+    assert DIAGRAM in prompt and REQUEST in prompt and DiagramPrompts.REFINEMENT_RULES in prompt
+    assert DiagramPrompts.SYSTEM_PROMPT not in prompt
+
+
+def test_no_budget_keeps_everything():
+    prompt, tokens = PromptBuilder(0).refinement_prompt(PVB, DIAGRAM, REQUEST)
+    sections = DiagramPrompts.get_refinement_sections(PromptBuilder.serialize_pvb(PVB), DIAGRAM, REQUEST)
+    assert prompt == SECTION_SEPARATOR.join(text for text, _ in sections)
+    assert tokens == sum(_tokens(PromptBuilder(), text) for text, _ in sections)
+
+
+def test_token_counts_cached():
+    tokenizer = CountingTokenizer()
+    builder = PromptBuilder()
+    _, tokens = builder.initial_prompt(PVB, tokenizer)
+    calls = tokenizer.calls
+    assert builder.initial_prompt(PVB, tokenizer) == builder.initial_prompt(PVB, tokenizer)
+    assert tokenizer.calls == calls
+    sections = DiagramPrompts.get_initial_sections(PromptBuilder.serialize_pvb(PVB))
+    assert tokens == sum(len(text.split()) for text, _ in sections)
+
+
+if __name__ == "__main__":
+    for test in (
+        test_initial_prompt_drops_analysis_steps, test_refinement_prompt_drop_order, test_no_budget_keeps_everything,
+        test_token_counts_cached
+    ):
+        test()
+        print(f"✅ {test.__name__}")
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+"""
+Tests of the rule-based refinements answered without the model.
+"""
+from src.pvb_flow.core.refinement_rules import (
+    ACTOR_STYLES, COLORS, HORIZONTAL, LEGEND, VERTICAL, actor_of, apply_refinement_rules,
+    match_refinement_intents
+)
+
+
+DIAGRAM = 'flowchart TD\n    A["👤 Saisie"] --> B["🤖 Analyse IA"]\n    B --> C["Stockage"]\n    style A fill:#fff'
+
+# (request, intents): known phrases, with accents, case and filler words
+MATCHED = [
+    ("Plus horizontal", [HORIZONTAL]),
+    ("rends le diagramme plus horizontal stp", [HORIZONTAL]),
+    ("De gauche à droite", [HORIZONTAL]),
+    ("LR", [HORIZONTAL]),
+    ("vertical", [VERTICAL]),
+    ("make it top to bottom please", [VERTICAL]),
+    ("couleurs", [COLORS]),
+    ("plus de couleurs et une légende", [COLORS, LEGEND]),
+    ("Ajoute une légende, merci", [LEGEND]),
+]
+
+# Requests left to the model: unknown words, negations, contradictions, no command
+FALL_THROUGH = [
+    "ajoute une étape de validation",
+    "pas horizontal",
+    "ne le mets pas en horizontal",
+    "sans couleurs",
+    "horizontal et vertical",
+    "merci",
+    "",
+]
+
+
+def test_matched_phrases():
+    for request, intents in MATCHED:
+        assert match_refinement_intents(request) == intents, request
+
+
+def test_fall_through():
+    for request in FALL_THROUGH:
+        assert match_refinement_intents(request) is None, request
+        assert apply_refinement_rules(DIAGRAM, request) is None, request
+
+
+def test_direction():
+    diagram, summary = apply_refinement_rules(DIAGRAM, "plus horizontal")
+    assert diagram.split("\n")[0] == "flowchart LR"
+    assert diagram.split("\n")[1:] == DIAGRAM.split("\n")[1:]
+    assert summary == "Disposition horizontale (de gauche à droite)."
+
+
+def test_colors():
+    diagram, _ = apply_refinement_rules(DIAGRAM, "plus de couleurs")
+    lines = diagram.split("\n")
+    # A already has a style, the others are colored by actor
+    assert "    style A fill:#fff" in lines
+    assert f"    style B {ACTOR_STYLES['ai']}" in lines
+    assert f"    style C {ACTOR_STYLES['system']}" in lines
+
+
+def test_legend():
+    diagram, summary = apply_refinement_rules(DIAGRAM, "ajoute une légende")
+    assert summary == "Légende ajoutée."
+    assert "    subgraph Légende" in diagram.split("\n")
+    _, summary = apply_refinement_rules(diagram, "légende")
+    assert summary == "La légende est déjà complète."
+
+
+def test_not_applicable():
+    # Recognized request, but the diagram has no header to change
+    assert apply_refinement_rules("A --> B", "horizontal") is None
+
+
+def test_actor_of():
+    assert actor_of('X["Contrôle manuel"]') == "human"
+    assert actor_of('X["Modèle ML"]') == "ai"
+    assert actor_of('X["🎯 KPI"]') == "objective"
+    assert actor_of('X["Base de données"]') == "system"
+
+
+if __name__ == "__main__":
+    for test in (
+        test_matched_phrases, test_fall_through, test_direction, test_colors, test_legend,
+        test_not_applicable, test_actor_of
+    ):
+        test()
+        print(f"✅ {test.__name__}")
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+"""
+Tests of the response cache: key, LRU and TTL of the memory tier, SQLite tier.
+"""
+import os
+import tempfile
+import time
+
+from src.pvb_flow.ai.response_cache import CachedAnalyzer, ResponseCache, has_valid_diagram, response_cache_key
+
+
+CONVERSATION = [{"role": "user", "content": 'Board :\n{"b": 1, "a": "x  y"}\n'}]
+
+VALID = "Voici :\n```mermaid\nflowchart TD\n    A --> B\n```"
+INVALID = "Voici :\n```mermaid\nflowchart TD\n    A --> [\n```"
+
+
+class CountingAnalyzer:
+    """Answers with a fixed response and counts the generations."""
+
+    def __init__(self, response: str):
+        self.response = response
+        self.calls = 0
+
+    def generate_response(self, conversation, max_tokens, **kwargs):
+        self.calls += 1
+        return self.response
+
+    def generate_response_stream(self, conversation, max_tokens, **kwargs):
+        self.calls += 1
+        yield from self.response.partition("\n")
+
+
+def test_key():
+    key = response_cache_key("m", CONVERSATION, {"static_kv_cache": False})
+    # Same board with other key order and spacing
+    same = [{"role": "user", "content": 'Board :\r\n{"a": "x y", "b": 1}'}]
+    assert response_cache_key("m", same, {"static_kv_cache": False}) == key
+    assert response_cache_key("m", CONVERSATION, {"static_kv_cache": True}) != key
+    assert response_cache_key("other", CONVERSATION, {"static_kv_cache": False}) != key
+
+
+def test_lru_eviction():
+    cache = ResponseCache(max_entries=2)
+    cache.put("a", "1")
+    cache.put("b", "2")
+    assert cache.get("a") == "1"
+    # b is now the least recently used
+    cache.put("c", "3")
+    assert cache.get("b") is None
+    assert cache.get("a") == "1" and cache.get("c") == "3"
+    assert cache.stats()["memory_entries"] == 2
+
+
+def test_ttl():
+    cache = ResponseCache(max_entries=4, ttl_seconds=0.05)
+    cache.put("a", "1")
+    assert cache.get("a") == "1"
+    time.sleep(0.1)
+    assert cache.get("a") is None
+    assert cache.stats()["memory_entries"] == 0
+
+
+def test_sqlite_tier():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "cache", "responses.sqlite")
+        ResponseCache(max_entries=4, path=path).put("a", "1")
+
+        # Another process, or a restart, reads the file
+        cache = ResponseCache(max_entries=4, path=path)
+        assert cache.get("a") == "1"
+        assert cache.get("a") == "1"
+        stats = cache.stats()
+        assert (stats["disk_hits"], stats["memory_hits"]) == (1, 1)
+
+        # Disk tier only, with expired rows ignored
+        time.sleep(0.1)
+        disk_only = ResponseCache(max_entries=0, path=path, ttl_seconds=0.05)
+        assert disk_only.get("a") is None
+        disk_only.put("b", "2")
+        assert disk_only.get("b") == "2"
+        time.sleep(0.1)
+        assert disk_only.get("b") is None
+
+        cache.put("c", "3")
+        cache.clear()
+        assert ResponseCache(max_entries=0, path=path).get("c") is None
+
+
+def test_valid_diagram():
+    assert has_valid_diagram(VALID)
+    assert not has_valid_diagram(INVALID)
+    assert not has_valid_diagram("Pas de diagramme")
+    # Unclosed block
+    assert not has_valid_diagram(VALID[:-3])
+    # Other diagram types pass as in the chat handler
+    assert has_valid_diagram("```mermaid\nsequenceDiagram\n    A->>B: x\n```")
+
+
+def test_cached_analyzer():
+    analyzer = CountingAnalyzer(VALID)
+    cached = CachedAnalyzer(analyzer, ResponseCache(max_entries=4), {"edit_refinements": False})
+    assert "".join(cached.generate_response_stream(CONVERSATION, 100)) == VALID
+    assert cached.generate_response(CONVERSATION, 100) == VALID
+    assert analyzer.calls == 1
+    # Other settings or token limit: generated again
+    other = CachedAnalyzer(analyzer, cached.cache, {"edit_refinements": True})
+    other.generate_response(CONVERSATION, 100)
+    cached.generate_response(CONVERSATION, 200)
+    assert analyzer.calls == 3
+
+    # Invalid diagrams are not kept
+    invalid = CountingAnalyzer(INVALID)
+    cached = CachedAnalyzer(invalid, ResponseCache(max_entries=4))
+    cached.generate_response(CONVERSATION, 100)
+    cached.generate_response(CONVERSATION, 100)
+    assert invalid.calls == 2
+
+
+if __name__ == "__main__":
+    for test in (test_key, test_lru_eviction, test_ttl, test_sqlite_tier, test_valid_diagram, test_cached_analyzer):
+        test()
+        print(f"✅ {test.__name__}")
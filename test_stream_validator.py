@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+"""
+Tests of the incremental diagram validation of a streamed answer.
+"""
+from src.pvb_flow.core.stream_validator import StreamingMermaidValidator
+
+
+def _feed_by_chars(validator, text: str) -> int:
+    """Feed one character at a time; return how many were fed before the validator gave up."""
+    for position, char in enumerate(text):
+        if not validator.feed(char):
+            return position + 1
+    return len(text)
+
+
+def test_valid_answer():
+    text = "Voici :\n```mermaid\nflowchart TD\n    A[\"👤 Début\"] --> B{Choix ?}\n    B -->|oui| C\n```\nFin."
+    validator = StreamingMermaidValidator()
+    assert _feed_by_chars(validator, text) == len(text)
+    assert validator.closed and not validator.failed
+
+
+def test_early_abort_on_partial_line():
+    text = "```mermaid\nflowchart TD\n    A --> [\n    B --> C\n    C --> D\n```"
+    validator = StreamingMermaidValidator()
+    fed = _feed_by_chars(validator, text)
+    # Stopped as soon as the bracket made the line invalid, not at the end of the answer
+    assert fed == text.index("[") + 1
+    assert validator.failed and validator.error.startswith("Line 2, column ")
+    assert validator.error_line == "    A --> ["
+    # Nothing more is accepted once failed
+    assert not validator.feed("\n")
+
+
+def test_unfinished_line_rejected_at_newline():
+    validator = StreamingMermaidValidator()
+    assert validator.feed("```mermaid\nflowchart TD\n    A[x] --> B[y")
+    assert not validator.feed("\n")
+    assert validator.error == "Line 2, column 17: Unexpected end of line"
+
+
+def test_allow_repairs_substitutes_lines():
+    text = (
+        "```mermaid\n"
+        "flowchart TD\n"
+        "    A[Début (x)] --> B\n"  # Unquoted parentheses, quoted by the repair
+        "    B --> C[fin\n"  # Unclosed shape, closed by the repair
+        "end\n"  # Stray 'end', dropped
+        "    C --> D;;\n"
+        "```\n"
+    )
+    validator = StreamingMermaidValidator(allow_repairs=True)
+    assert _feed_by_chars(validator, text) == len(text)
+    assert validator.closed and not validator.failed
+    assert validator.repaired_lines == 4
+
+    # Without repairs the first of them stops the stream
+    strict = StreamingMermaidValidator()
+    assert not strict.feed(text)
+    assert strict.error_line == "    A[Début (x)] --> B"
+
+
+def test_allow_repairs_missing_header():
+    validator = StreamingMermaidValidator(allow_repairs=True)
+    assert validator.feed("```mermaid\n    A --> B\n    B --> C\n```\n")
+    assert validator.repaired_lines == 1 and not validator.failed
+
+
+def test_unrepairable_line_with_repairs():
+    validator = StreamingMermaidValidator(allow_repairs=True)
+    # Partial lines are not judged when repairs are allowed, whole lines are
+    assert validator.feed("```mermaid\nflowchart TD\n    A -> B")
+    assert not validator.feed("\n")
+    assert validator.error_line == "    A -> B"
+
+
+def test_text_before_block_ignored():
+    validator = StreamingMermaidValidator()
+    assert validator.feed("Pas encore de diagramme ] [ --> ;;\n")
+    assert validator.feed("```merm")
+    assert validator.feed("aid\nflowchart LR\n")
+    assert not validator.failed
+
+
+if __name__ == "__main__":
+    for test in (
+        test_valid_answer, test_early_abort_on_partial_line, test_unfinished_line_rejected_at_newline,
+        test_allow_repairs_substitutes_lines, test_allow_repairs_missing_header, test_unrepairable_line_with_repairs,
+        test_text_before_block_ignored
+    ):
+        test()
+        print(f"✅ {test.__name__}")